@@ -0,0 +1,196 @@
+# 自适应选题：按学生在每个知识点上的错误率、最近练习时间和用时给题目加权
+#
+# 同一知识点下的题目权重相同，所以只需要对知识点做累积权重数组：
+# 抽一道题 = 二分查找知识点 + 在该知识点的题目数组里随机取一个位置，
+# 抽 k 道题是 O(k log T)。用户的知识点统计在 save_quiz_record 写入时增量更新。
+import bisect
+import itertools
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import data_loader
+import db
+import seen
+
+# 权重参数
+ERROR_WEIGHT = 3.0        # 错误率对权重的放大倍数
+RECENCY_DAYS = 7.0        # 超过这么多天没练习的知识点获得最大的“久未练习”加成
+RECENCY_WEIGHT = 1.0
+TIME_WEIGHT = 0.5         # 平均用时明显高于自己平均水平的知识点加成
+
+MAX_CACHED_USERS = 5000
+
+
+class TopicStat:
+    __slots__ = ("attempts", "wrong", "total_time", "last_seen")
+
+    def __init__(self, attempts=0, wrong=0, total_time=0.0, last_seen=None):
+        self.attempts = attempts
+        self.wrong = wrong
+        self.total_time = total_time
+        self.last_seen = last_seen
+
+
+class UserModel:
+    """单个用户的知识点统计，version 在每次更新后递增，用于让累积权重缓存失效"""
+
+    def __init__(self, rows):
+        self.topics = {}
+        self.attempts = 0
+        self.total_time = 0.0
+        self.version = 0
+        self.cumulative = {}
+        for topic, attempts, wrong, total_time, last_seen in rows:
+            self.topics[topic] = TopicStat(attempts, wrong, total_time or 0.0, last_seen)
+            self.attempts += attempts
+            self.total_time += total_time or 0.0
+
+    def update(self, topic, is_correct, time_spent, when):
+        stat = self.topics.get(topic)
+        if stat is None:
+            stat = self.topics[topic] = TopicStat()
+        stat.attempts += 1
+        stat.wrong += 0 if is_correct else 1
+        stat.total_time += time_spent or 0.0
+        stat.last_seen = when
+        self.attempts += 1
+        self.total_time += time_spent or 0.0
+        self.version += 1
+        self.cumulative.clear()
+
+    def topic_weight(self, topic, now):
+        stat = self.topics.get(topic)
+        if stat is None or stat.attempts == 0:
+            # 没练过的知识点：错误率按 0.5 估计，并且视为很久没练
+            return (1 + ERROR_WEIGHT * 0.5) * (1 + RECENCY_WEIGHT)
+        error_rate = (stat.wrong + 1) / (stat.attempts + 2)
+        weight = 1 + ERROR_WEIGHT * error_rate
+        if stat.last_seen:
+            days = max(now - stat.last_seen, 0) / 86400
+            weight *= 1 + RECENCY_WEIGHT * min(days / RECENCY_DAYS, 1.0)
+        if self.attempts:
+            overall = self.total_time / self.attempts
+            avg = stat.total_time / stat.attempts
+            if overall > 0:
+                weight *= 1 + TIME_WEIGHT * min(max(avg / overall - 1, 0.0), 1.0)
+        return weight
+
+
+_USERS = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def _get_model(user_id):
+    with _LOCK:
+        model = _USERS.get(user_id)
+        if model is not None:
+            _USERS.move_to_end(user_id)
+            return model
+    model = UserModel(db.get_user_topic_history(user_id))
+    with _LOCK:
+        model = _USERS.setdefault(user_id, model)
+        _USERS.move_to_end(user_id)
+        while len(_USERS) > MAX_CACHED_USERS:
+            _USERS.popitem(last=False)
+    return model
+
+
+def _on_record(record):
+    """save_quiz_record 的回调：只更新已缓存用户的一个知识点"""
+    with _LOCK:
+        model = _USERS.get(record["user_id"])
+        if model is not None:
+            model.update(record["topic"], record["is_correct"],
+                         record["time_spent"], record["created_at"])
+
+
+db.add_record_listener(_on_record)
+
+
+def _topic_arrays(bank, unit_name, topic_filter):
+    if unit_name:
+        topics = bank.index["unit_topics"].get(unit_name, {})
+    else:
+        topics = bank.index["topics"]
+    if topic_filter:
+        return [(t, topics[t]) for t in dict.fromkeys(topic_filter) if t in topics]
+    return list(topics.items())
+
+
+def _cumulative(model, bank, unit_name, topic_filter):
+    """(知识点数组列表, 累积权重) ，按用户版本和题库版本缓存"""
+    key = (bank.version, unit_name, tuple(topic_filter or ()))
+    with _LOCK:
+        cached = model.cumulative.get(key)
+    if cached is not None:
+        return cached
+    arrays = _topic_arrays(bank, unit_name, topic_filter)
+    now = time.time()
+    cumulative = list(itertools.accumulate(
+        model.topic_weight(topic, now) * len(rows) for topic, rows in arrays
+    ))
+    cached = ([rows for _, rows in arrays], cumulative)
+    with _LOCK:
+        model.cumulative[key] = cached
+    return cached
+
+
+def select_questions(user_id, unit_name, num=10, topic_filter=None):
+    """为用户按权重无放回地抽取 num 道题，返回题目 ID 列表
+
+    优先选择该用户在对应单元没做过的题；不够时用最久没做过的题补齐。
+    """
+    if data_loader.QUESTION_BACKEND == "sqlite" or not user_id:
+        return data_loader.get_quiz_question_ids(unit_name, num, topic_filter)
+    bank = data_loader._get_bank()
+    store = bank.store
+    model = _get_model(user_id)
+    arrays, cumulative = _cumulative(model, bank, unit_name, topic_filter)
+    total_rows = sum(len(rows) for rows in arrays)
+    num = min(num, total_rows)
+    if num <= 0:
+        return []
+    unseen = seen.unseen_filter(user_id)
+
+    def fresh(pos):
+        q = store.at(pos)
+        return unseen(q.unit, q.id)
+
+    total = cumulative[-1]
+    chosen = []
+    taken = set()
+    attempts = 0
+    while len(chosen) < num and attempts < num * 20:
+        attempts += 1
+        i = bisect.bisect_right(cumulative, random.random() * total)
+        i = min(i, len(arrays) - 1)
+        rows = arrays[i]
+        pos = int(rows[random.randrange(len(rows))])
+        if pos not in taken and fresh(pos):
+            taken.add(pos)
+            chosen.append(pos)
+    if len(chosen) < num:
+        # 没做过的题所剩不多时拒绝采样效率低，改为扫描候选题补齐
+        rest = [int(p) for rows in arrays for p in rows if int(p) not in taken and fresh(int(p))]
+        extra = random.sample(rest, min(num - len(chosen), len(rest)))
+        taken.update(extra)
+        chosen.extend(extra)
+    qids = [store.ids[pos] for pos in chosen]
+    if len(qids) < num:
+        # 候选题都做过了：按单元取最久没做过的题
+        remaining = {}
+        for rows in arrays:
+            for p in rows:
+                if int(p) not in taken:
+                    q = store.at(int(p))
+                    remaining.setdefault(q.unit, []).append(q.id)
+        for unit, candidates in remaining.items():
+            qids.extend(seen.least_recently_seen(user_id, unit, candidates, num - len(qids)))
+        if len(qids) < num:
+            picked = set(qids)
+            leftover = [qid for candidates in remaining.values() for qid in candidates
+                        if qid not in picked]
+            qids.extend(random.sample(leftover, num - len(qids)))
+    return qids
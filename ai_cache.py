@@ -0,0 +1,184 @@
+# DeepSeek 回复缓存：相同的模型、参数和提示词直接返回上次的结果
+#
+# 两级缓存：进程内 LRU（AI_CACHE_MEMORY_ITEMS 条）+ 持久化的 SQLite 文件（AI_CACHE_PATH，
+# 最多 AI_CACHE_MAX_ROWS 条），都按 AI_CACHE_TTL 秒过期。磁盘命中的结果会放回内存层。
+# 缓存文件与 users.db 分开，PostgreSQL 后端下同样可用；AI_CACHE_PATH 设为空字符串时只用内存层。
+# 持久化层的读写出错（锁等待超时、磁盘已满等）只计数（disk_errors），这次操作只用内存层，
+# 不会让已经拿到的回复变成异常。
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import database
+
+AI_CACHE_TTL = float(os.environ.get("AI_CACHE_TTL", str(7 * 86400)))
+AI_CACHE_MEMORY_ITEMS = int(os.environ.get("AI_CACHE_MEMORY_ITEMS", "256"))
+AI_CACHE_MAX_ROWS = int(os.environ.get("AI_CACHE_MAX_ROWS", "5000"))
+AI_CACHE_PATH = os.environ.get("AI_CACHE_PATH",
+                               os.path.join(os.path.dirname(database.DB_PATH), "ai_cache.db"))
+
+
+def make_key(payload):
+    """请求体（模型、参数、消息）的 SHA-256，与字典键的顺序无关"""
+    text = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=AI_CACHE_PATH, ttl=AI_CACHE_TTL, memory_items=AI_CACHE_MEMORY_ITEMS,
+                 max_rows=AI_CACHE_MAX_ROWS):
+        self.path = path
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.max_rows = max_rows
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._conn = None
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0,
+                          "stores": 0, "evictions": 0, "disk_errors": 0}
+
+    def _disk(self):
+        """持久化层的连接，打不开时关闭持久化层只用内存"""
+        if self._conn is None and self.path:
+            try:
+                conn = database.connect(self.path)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS ai_responses (
+                        key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        expires_at REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_responses_last_used ON ai_responses (last_used)")
+                self._conn = conn
+            except Exception as e:
+                print(f"AI cache disabled persistent tier ({self.path}): {e}")
+                self.path = None
+        return self._conn
+
+    def _disk_error(self, conn, error):
+        """持久化层的一次操作失败，回滚未完成的事务。调用方持有 self._lock"""
+        self._counters["disk_errors"] += 1
+        print(f"AI cache persistent tier error ({self.path}): {error}")
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            pass
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def get(self, key):
+        """命中返回缓存的回复，否则返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+            conn = self._disk()
+            if conn is not None:
+                try:
+                    row = conn.execute("SELECT response, expires_at FROM ai_responses WHERE key = ?",
+                                       (key,)).fetchone()
+                except sqlite3.Error as e:
+                    self._disk_error(conn, e)
+                    row = None
+                if row is not None and row[1] > now:
+                    self._remember(key, row[1], row[0])
+                    self._counters["disk_hits"] += 1
+                    try:
+                        conn.execute("UPDATE ai_responses SET last_used = ? WHERE key = ?", (now, key))
+                    except sqlite3.Error as e:
+                        self._disk_error(conn, e)
+                    return row[0]
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self._counters["stores"] += 1
+            conn = self._disk()
+            if conn is None:
+                return
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("""
+                    INSERT INTO ai_responses (key, response, expires_at, last_used) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        response = excluded.response, expires_at = excluded.expires_at,
+                        last_used = excluded.last_used
+                """, (key, value, expires_at, now))
+                evicted = conn.execute("DELETE FROM ai_responses WHERE expires_at <= ?", (now,)).rowcount
+                # 超过行数上限时删除最久未使用的
+                evicted += conn.execute("""
+                    DELETE FROM ai_responses WHERE key IN (
+                        SELECT key FROM ai_responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_rows,)).rowcount
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._disk_error(conn, e)
+                return
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._counters["evictions"] += evicted
+
+    def discard(self, key):
+        """删除一条缓存（例如回复内容无法解析时）"""
+        with self._lock:
+            self._memory.pop(key, None)
+            conn = self._disk()
+            if conn is not None:
+                try:
+                    conn.execute("DELETE FROM ai_responses WHERE key = ?", (key,))
+                except sqlite3.Error as e:
+                    self._disk_error(conn, e)
+
+    def record_bypass(self):
+        with self._lock:
+            self._counters["bypassed"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            conn = self._disk()
+            if conn is not None:
+                try:
+                    conn.execute("DELETE FROM ai_responses")
+                except sqlite3.Error as e:
+                    self._disk_error(conn, e)
+
+    def metrics(self):
+        """命中 / 未命中计数、命中率和各层当前条数"""
+        with self._lock:
+            disk_items = 0
+            conn = self._disk()
+            if conn is not None:
+                try:
+                    disk_items = conn.execute("SELECT COUNT(*) FROM ai_responses").fetchone()[0]
+                except sqlite3.Error as e:
+                    self._disk_error(conn, e)
+            m = dict(self._counters)
+            m["memory_items"] = len(self._memory)
+            m["disk_items"] = disk_items
+        lookups = m["memory_hits"] + m["disk_hits"] + m["misses"]
+        m["hit_rate"] = (m["memory_hits"] + m["disk_hits"]) / lookups if lookups else 0.0
+        return m
@@ -0,0 +1,294 @@
+# AI 任务的后台线程池：生成报告 / 题目不再阻塞 Streamlit 的脚本执行
+#
+# - 最多 AI_WORKERS 个任务同时执行，排队超过 AI_MAX_QUEUED 个时新任务直接使用兜底结果（或报错）
+# - 每个任务有 job id，页面轮询 get(job_id) 查看状态和已生成的部分内容
+# - 相同 key（同一个提示词）的任务在执行期间只跑一次，后来的调用拿到同一个 job id
+# - cancel(job_id) 取消；去重后的任务在所有调用方都取消后才真正取消
+# - 开始执行后超过 timeout 秒仍未完成的任务改用 fallback() 的结果（例如本地报告）
+# - 取消或超时的任务在工作线程真正返回前仍占着它的 key：同一个 key 再次提交时
+#   新任务排在它后面，不会同时向上游发出两个相同的请求
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+AI_WORKERS = int(os.environ.get("AI_WORKERS", "4"))
+AI_MAX_QUEUED = int(os.environ.get("AI_MAX_QUEUED", "32"))
+AI_JOB_TIMEOUT = float(os.environ.get("AI_JOB_TIMEOUT", "90"))
+# 结束的任务保留这么久供页面读取结果
+JOB_RETENTION = 600
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED, TIMED_OUT = (
+    "queued", "running", "done", "failed", "cancelled", "timed_out")
+FINISHED = {DONE, FAILED, CANCELLED, TIMED_OUT}
+
+
+class Job:
+    def __init__(self, key, func, fallback, timeout):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.func = func
+        self.fallback = fallback
+        self.timeout = timeout
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.used_fallback = False
+        self.parts = []
+        self.subscribers = 1
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.successor = None   # 本任务的工作线程返回后才开始执行的同 key 任务
+        self._finishing = False  # 正在锁外计算兜底结果
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        """任务函数应在耗时步骤之间检查，为 True 时尽快返回"""
+        return self._cancel.is_set()
+
+    def append(self, text):
+        """任务函数报告已生成的部分内容，轮询时可以先显示"""
+        self.parts.append(text)
+
+    def snapshot(self):
+        now = self.finished_at or time.time()
+        return {
+            "id": self.id, "status": self.status, "result": self.result, "error": self.error,
+            "used_fallback": self.used_fallback, "partial": "".join(self.parts),
+            "elapsed": now - self.created_at,
+        }
+
+
+class JobPool:
+    def __init__(self, workers=AI_WORKERS, max_queued=AI_MAX_QUEUED, timeout=AI_JOB_TIMEOUT):
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-job")
+        self._lock = threading.Lock()
+        self._jobs = {}       # job id -> Job
+        self._inflight = {}   # key -> Job（工作线程尚未返回的任务）
+        self._running = 0     # 正在执行的工作线程数，包括已超时或取消但还没返回的
+        self._deadlines = []  # 超时检查的堆：(deadline, seq, job)，由一个 reaper 线程处理
+        self._seq = itertools.count()
+        self._wakeup = threading.Condition(self._lock)
+        self._reaper = None
+        self._metrics = {"submitted": 0, "deduplicated": 0, "completed": 0, "failed": 0,
+                         "cancelled": 0, "timed_out": 0, "fallbacks": 0, "rejected": 0}
+
+    def submit(self, key, func, fallback=None, timeout=None):
+        """提交任务 func(job)，返回 job id
+
+        key 相同且上一个任务还没结束时不重复执行，返回已有任务的 id；上一个任务已超时或取消
+        但工作线程还没返回时，新任务等它返回后再开始。
+        队列已满时：有 fallback 则立即以兜底结果完成，否则抛出 RuntimeError。
+        """
+        with self._lock:
+            self._purge()
+            owner = self._inflight.get(key) if key is not None else None
+            live = owner.successor if owner is not None and owner.status in FINISHED else owner
+            if live is not None and live.status not in FINISHED:
+                live.subscribers += 1
+                self._metrics["deduplicated"] += 1
+                return live.id
+            job = Job(key, func, fallback, self.timeout if timeout is None else timeout)
+            self._jobs[job.id] = job
+            self._metrics["submitted"] += 1
+            rejected = self._queued() > self.max_queued
+            if rejected:
+                self._metrics["rejected"] += 1
+                if fallback is None:
+                    del self._jobs[job.id]
+                    raise RuntimeError("Too many AI jobs queued, please try again later")
+            elif owner is not None:
+                owner.successor = job
+            else:
+                if key is not None:
+                    self._inflight[key] = job
+                job.future = self._executor.submit(self._run, job)
+        if rejected:
+            self._complete(job, DONE, fallback=True)
+        return job.id
+
+    def get(self, job_id):
+        """任务状态快照（见 Job.snapshot），不存在或已过期时返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.snapshot() if job else None
+
+    def wait(self, job_id, timeout=None):
+        """阻塞等待任务结束，返回快照"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.get(job_id)
+            if snapshot is None or snapshot["status"] in FINISHED:
+                return snapshot
+            if deadline is not None and time.monotonic() >= deadline:
+                return snapshot
+            time.sleep(0.05)
+
+    def cancel(self, job_id):
+        """取消任务；其它调用方仍在等待同一个任务时只减少订阅数。返回任务是否被取消"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED or job._finishing:
+                return False
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                return False
+            job._cancel.set()
+            self._finish(job, CANCELLED)
+            if job.future is not None and job.future.cancel():
+                self._release(job)  # 还没开始执行，不会再有工作线程来释放 key
+            return True
+
+    def metrics(self):
+        with self._lock:
+            m = dict(self._metrics)
+            m["queued"] = self._queued()
+            m["running"] = self._running
+            return m
+
+    def _run(self, job):
+        with self._lock:
+            started = job.status == QUEUED
+            if started:
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._running += 1
+                if job.timeout:
+                    self._schedule(job, time.monotonic() + job.timeout)
+        try:
+            if not started:
+                return  # 排队时已取消
+            try:
+                result = job.func(job)
+            except Exception as e:
+                fallback = job.fallback is not None
+                self._complete(job, DONE if fallback else FAILED, error=e, fallback=fallback)
+            else:
+                self._complete(job, DONE, result=result)
+        finally:
+            with self._lock:
+                if started:
+                    self._running -= 1
+                self._release(job)
+
+    def _expire(self, job):
+        job._cancel.set()
+        self._complete(job, TIMED_OUT, error=f"timed out after {job.timeout:.0f}s",
+                       fallback=job.fallback is not None)
+
+    def _complete(self, job, status, result=None, error=None, fallback=False):
+        """以 status 结束任务，已经结束（超时、取消）的任务保持原状
+
+        fallback 为 True 时结果取 job.fallback()，兜底函数在锁外执行，出错时任务为 failed。
+        """
+        with self._lock:
+            if job.status in FINISHED or job._finishing:
+                return
+            job._finishing = True
+            if error is not None:
+                job.error = str(error)[:200]
+        if fallback:
+            try:
+                result = job.fallback()
+            except Exception as e:
+                status, error, fallback = FAILED, e, False
+        with self._lock:
+            job._finishing = False
+            if fallback:
+                job.used_fallback = True
+                self._metrics["fallbacks"] += 1
+            elif status == FAILED and error is not None:
+                job.error = str(error)[:200]
+            job.result = result
+            self._finish(job, status)
+
+    def _finish(self, job, status):
+        """调用方持有 self._lock"""
+        job.status = status
+        job.finished_at = time.time()
+        self._metrics[{DONE: "completed", FAILED: "failed", CANCELLED: "cancelled",
+                       TIMED_OUT: "timed_out"}[status]] += 1
+
+    def _release(self, job):
+        """job 的工作线程已返回（或不会再执行）：把 key 交给排在后面的任务。调用方持有 self._lock"""
+        if job.key is None or self._inflight.get(job.key) is not job:
+            return
+        successor = job.successor
+        if successor is not None and successor.status == QUEUED and not successor._finishing:
+            self._inflight[job.key] = successor
+            successor.future = self._executor.submit(self._run, successor)
+        else:
+            del self._inflight[job.key]
+
+    def _queued(self):
+        return sum(1 for j in self._jobs.values() if j.status == QUEUED and not j._finishing)
+
+    def _schedule(self, job, deadline):
+        """登记超时检查。调用方持有 self._lock"""
+        heapq.heappush(self._deadlines, (deadline, next(self._seq), job))
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, name="ai-job-reaper", daemon=True)
+            self._reaper.start()
+        self._wakeup.notify()
+
+    def _reap(self):
+        """所有任务共用的超时线程：等到最早的 deadline，把到期的任务交给 _expire"""
+        while True:
+            with self._lock:
+                expired = []
+                while not expired:
+                    now = time.monotonic()
+                    while self._deadlines and self._deadlines[0][0] <= now:
+                        job = heapq.heappop(self._deadlines)[2]
+                        if job.status not in FINISHED:
+                            expired.append(job)
+                    if not expired:
+                        self._wakeup.wait(self._deadlines[0][0] - now if self._deadlines else None)
+            for job in expired:
+                self._expire(job)
+
+    def _purge(self):
+        cutoff = time.time() - JOB_RETENTION
+        for job_id in [i for i, j in self._jobs.items() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = JobPool()
+    return _POOL
+
+
+def submit(key, func, fallback=None, timeout=None):
+    return get_pool().submit(key, func, fallback, timeout)
+
+
+def get(job_id):
+    return get_pool().get(job_id)
+
+
+def wait(job_id, timeout=None):
+    return get_pool().wait(job_id, timeout)
+
+
+def cancel(job_id):
+    return get_pool().cancel(job_id)
+
+
+def get_metrics():
+    return get_pool().metrics()
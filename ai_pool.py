@@ -0,0 +1,238 @@
+# 预先生成的 AI 题目池：按单元 / 知识点离线批量生成，答题时直接从数据库取
+#
+#   python ai_pool.py fill                         # 把每个知识点补到 AI_POOL_TARGET 道
+#   python ai_pool.py fill --unit Waves --target 20 --concurrency 2
+#   python ai_pool.py status
+#
+# 生成的每道题都按题库格式校验（question_store.validate_question），不合格的单独丢弃，
+# 合格的写入 questions 表（source='ai'），不参与普通出题，只用于错题补充练习。
+# 答题时 remedial_questions() 从池中随机取题；某个知识点剩余不足 AI_POOL_LOW_WATER 道时在后台补充，
+# 同一知识点同时只补充一次。补充在专用的线程池中逐批进行，整个进程最多 AI_POOL_CONCURRENCY 个请求，
+# 不占用 ai_jobs 中给报告等交互任务用的线程。
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import question_db
+import storage
+from question_store import sample_ids
+
+AI_POOL_TARGET = int(os.environ.get("AI_POOL_TARGET", "30"))
+AI_POOL_LOW_WATER = int(os.environ.get("AI_POOL_LOW_WATER", "10"))
+AI_POOL_CONCURRENCY = int(os.environ.get("AI_POOL_CONCURRENCY", "2"))
+# 每次请求生成的题数
+AI_POOL_BATCH = 10
+# 某个知识点补充失败后，这么久之内不再尝试
+TOP_UP_RETRY_AFTER = 300
+
+SOURCE = "ai"
+
+# 池中题目的内存索引 (unit, topic) -> [content_hash]，与 SQLite 题库的出题索引相同
+_INDEX = question_db.QuestionIndex("source = ?", [SOURCE])
+
+_TOP_UP_EXECUTOR = None
+_TOP_UP_LOCK = threading.Lock()
+_TOPPING_UP = {}    # (unit, topic) -> 还没完成的批数
+_TOP_UP_FAILED = {}  # (unit, topic) -> 可以再次尝试的时间（time.monotonic()）
+
+
+def store_questions(questions):
+    """写入 questions 表（source='ai'），已有的相同题目跳过，返回新增条数"""
+    if not questions:
+        return 0
+    st = storage.get_storage()
+    ids = [q["id"] for q in questions]
+    before = _count_existing(st, ids)
+    st.register_questions(questions)
+    question_db.invalidate_index()
+    return _count_existing(st, ids) - before
+
+
+def _count_existing(st, ids):
+    return st.query(f"""
+        SELECT COUNT(*) FROM questions WHERE content_hash IN ({', '.join('?' * len(ids))})
+    """, ids)[0][0]
+
+
+def _pool_index():
+    return _INDEX.get(storage.get_storage().query)
+
+
+def generate_batch(unit, topic, num=AI_POOL_BATCH):
+    """请求一批题目并入库，返回 {"accepted", "rejected", "stored"}"""
+    import ai_service
+    stats = {}
+    # 每批都要新题，不使用回复缓存
+    accepted = list(ai_service.stream_quiz_ai(unit, [topic], num, use_cache=False, stats=stats))
+    stored = store_questions(accepted)
+    return {"accepted": len(accepted), "rejected": stats["rejected"], "stored": stored}
+
+
+def pool_counts(unit=None):
+    """{(unit, topic): 池中题数}"""
+    sql = "SELECT unit, topic, COUNT(*) FROM questions WHERE source = ?"
+    params = [SOURCE]
+    if unit:
+        sql += " AND unit = ?"
+        params.append(unit)
+    rows = storage.get_storage().query(sql + " GROUP BY unit, topic", params)
+    return {(u, t): n for u, t, n in rows}
+
+
+def fill(units=None, target=AI_POOL_TARGET, concurrency=AI_POOL_CONCURRENCY, topics=None, progress=None):
+    """把每个知识点的题目补到 target 道，最多 concurrency 个请求同时进行
+
+    topics 为 [(unit, topic)] 时只处理这些知识点，否则处理题库中 units（默认全部单元）的所有知识点。
+    返回汇总：batches、failed、accepted、rejected、stored
+    """
+    import data_loader
+    if topics is None:
+        topics = [(u, t) for u in (units or data_loader.get_units())
+                  for t in data_loader.get_topics_for_unit(u)]
+    counts = pool_counts()
+    jobs = []
+    for unit, topic in topics:
+        missing = target - counts.get((unit, topic), 0)
+        jobs.extend([(unit, topic)] * math.ceil(max(missing, 0) / AI_POOL_BATCH))
+    summary = {"batches": len(jobs), "failed": 0, "accepted": 0, "rejected": 0, "stored": 0}
+    if not jobs:
+        return summary
+
+    def run(job):
+        try:
+            return job, generate_batch(*job), None
+        except Exception as e:
+            return job, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="ai-pool") as executor:
+        for (unit, topic), result, error in executor.map(run, jobs):
+            if error is not None:
+                summary["failed"] += 1
+                line = f"{unit} / {topic[:40]}: failed ({str(error)[:80]})"
+            else:
+                for k in ("accepted", "rejected", "stored"):
+                    summary[k] += result[k]
+                line = (f"{unit} / {topic[:40]}: +{result['stored']} "
+                        f"({result['accepted']} valid, {result['rejected']} rejected)")
+            if progress:
+                progress(line)
+    return summary
+
+
+def get_questions(qids):
+    """按 ID 查询池中的题目，保持传入顺序"""
+    qids = [q for q in qids if q]
+    if not qids:
+        return []
+    rows = storage.get_storage().query(f"""
+        SELECT content_hash, {', '.join(question_db.QUESTION_COLUMNS)} FROM questions
+        WHERE source = ? AND content_hash IN ({', '.join('?' * len(qids))})
+    """, [SOURCE, *qids])
+    found = {}
+    for r in rows:
+        d = dict(zip(question_db.QUESTION_COLUMNS, r[1:]))
+        d["id"] = r[0]
+        found[r[0]] = d
+    return [found[q] for q in qids if q in found]
+
+
+def _top_up_executor():
+    """调用方持有 _TOP_UP_LOCK"""
+    global _TOP_UP_EXECUTOR
+    if _TOP_UP_EXECUTOR is None:
+        _TOP_UP_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, AI_POOL_CONCURRENCY),
+                                              thread_name_prefix="ai-pool-top-up")
+    return _TOP_UP_EXECUTOR
+
+
+def _top_up(unit, topic, have=0):
+    """在后台把一个知识点从 have 道补到 AI_POOL_TARGET 道，返回是否安排了补充
+
+    同一知识点同时只补充一次；失败后 TOP_UP_RETRY_AFTER 秒内不再尝试。
+    """
+    import ai_service
+    if not ai_service.API_KEY:
+        return False
+    key = (unit, topic)
+    batches = math.ceil(max(AI_POOL_TARGET - have, 0) / AI_POOL_BATCH)
+    with _TOP_UP_LOCK:
+        if not batches or key in _TOPPING_UP or time.monotonic() < _TOP_UP_FAILED.get(key, 0):
+            return False
+        _TOPPING_UP[key] = batches
+        executor = _top_up_executor()
+        for _ in range(batches):
+            executor.submit(_top_up_batch, key)
+    return True
+
+
+def _top_up_batch(key):
+    try:
+        with _TOP_UP_LOCK:
+            if time.monotonic() < _TOP_UP_FAILED.get(key, 0):
+                return  # 同一知识点的前一批刚失败
+        generate_batch(*key)
+    except Exception as e:
+        print(f"AI pool top-up failed for {key[1][:40]}: {e}")
+        with _TOP_UP_LOCK:
+            _TOP_UP_FAILED[key] = time.monotonic() + TOP_UP_RETRY_AFTER
+    finally:
+        with _TOP_UP_LOCK:
+            _TOPPING_UP[key] -= 1
+            if not _TOPPING_UP[key]:
+                del _TOPPING_UP[key]
+
+
+def remedial_questions(wrong_topics, num=5, unit=None):
+    """从池中随机抽取错题知识点的题目 ID（不请求 API），余量不足的知识点在后台补充
+
+    unit 不为 None 时只取这个单元的知识点，否则取所有单元中同名的知识点。
+    """
+    import data_loader
+    topics = set(t for t in wrong_topics if t)
+    if not topics:
+        return []
+    keys = [(u, t) for u in ([unit] if unit else data_loader.get_units())
+            for t in data_loader.get_topics_for_unit(u) if t in topics]
+    index = _pool_index()
+    ids = sample_ids([index[k] for k in keys if k in index], num)
+    for key in keys:
+        have = len(index.get(key, ()))
+        if have < AI_POOL_LOW_WATER:
+            try:
+                _top_up(*key, have)
+            except Exception as e:
+                print(f"AI pool top-up failed for {key[1][:40]}: {e}")
+    return ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate AI questions per unit / topic")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fill_parser = sub.add_parser("fill", help="top every topic up to the target pool size")
+    fill_parser.add_argument("--unit", action="append", help="only this unit (repeatable)")
+    fill_parser.add_argument("--target", type=int, default=AI_POOL_TARGET)
+    fill_parser.add_argument("--concurrency", type=int, default=AI_POOL_CONCURRENCY)
+    status_parser = sub.add_parser("status", help="questions in the pool per topic")
+    status_parser.add_argument("--unit")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        counts = pool_counts(args.unit)
+        for (unit, topic), n in sorted(counts.items()):
+            print(f"{n:5d}  {unit} / {topic}")
+        print(f"{sum(counts.values())} AI questions in {len(counts)} topic(s)")
+        return 0
+    started = time.perf_counter()
+    summary = fill(args.unit, args.target, args.concurrency, progress=print)
+    print(f"{summary['stored']} questions added from {summary['batches']} batch(es) "
+          f"({summary['failed']} failed, {summary['rejected']} items rejected) "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 0 if not summary["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,15 @@
 import os
 import json
-import requests
+import queue
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import ai_cache
+import ai_jobs
+import json_stream
+from question_store import validate_question
 
 # DeepSeek API - 从环境变量读取
 API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
@@ -14,15 +23,15 @@ def log(msg):
     pass  # 云端部署时禁用日志
 
 
-def call_deepseek(prompt, retry=3):
-    """调用 DeepSeek API"""
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {API_KEY}"
-    }
-    
-    data = {
+# 相同请求（模型、参数、提示词）的回复缓存，见 ai_cache.py
+_CACHE = ai_cache.ResponseCache()
+
+# 流式报告：首个文本块超过这么多秒还没到达就改用本地报告
+AI_FIRST_TOKEN_TIMEOUT = float(os.environ.get("AI_FIRST_TOKEN_TIMEOUT", "8"))
+
+
+def _request_body(prompt):
+    return {
         "model": "deepseek-chat",
         "messages": [
             {"role": "system", "content": "You are an IGCSE Physics tutor."},
@@ -31,64 +40,309 @@ def call_deepseek(prompt, retry=3):
         "temperature": 0.7,
         "max_tokens": 2000
     }
+
+
+def get_cache_metrics():
+    """回复缓存的命中 / 未命中计数，见 ai_cache.ResponseCache.metrics"""
+    return _CACHE.metrics()
+
+
+# 请求超时：连接超时，以及两块数据之间的最长间隔（非流式请求要等整个回复生成完）
+AI_CONNECT_TIMEOUT = 10
+AI_READ_TIMEOUT = float(os.environ.get("AI_READ_TIMEOUT", "90"))
+# 一次调用（包括重试和等待）的总时长上限
+AI_CALL_DEADLINE = float(os.environ.get("AI_CALL_DEADLINE", "150"))
+# 第 n 次重试前随机等待 0 ~ min(AI_BACKOFF_MAX, AI_BACKOFF_BASE * 2**n) 秒；响应带 Retry-After 时至少等这么久
+AI_BACKOFF_BASE = 1.0
+AI_BACKOFF_MAX = 20.0
+# 熔断：连续失败 AI_BREAKER_FAILURES 次后，AI_BREAKER_COOLDOWN 秒内不再请求，直接用本地报告
+AI_BREAKER_FAILURES = int(os.environ.get("AI_BREAKER_FAILURES", "3"))
+AI_BREAKER_COOLDOWN = float(os.environ.get("AI_BREAKER_COOLDOWN", "60"))
+AI_POOL_SIZE = 8
+# 只有这些状态码值得重试；401 等其它错误重试也不会成功
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class AIError(Exception):
+    """DeepSeek 请求失败。retryable：重试可能成功；kind：错误类别（用于指标）"""
+
+    def __init__(self, message, retryable=True, retry_after=None, kind="error"):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.kind = kind
+
+
+class AIUnavailable(AIError):
+    """熔断打开期间不发请求，直接失败"""
+
+    def __init__(self, message="AI service unavailable, using local analysis"):
+        super().__init__(message, retryable=False, kind="short_circuited")
+
+
+class CircuitBreaker:
+    """连续失败 failures 次后打开；冷却 cooldown 秒后放行一个试探请求，成功则关闭，失败则重新计时"""
+
+    def __init__(self, failures=AI_BREAKER_FAILURES, cooldown=AI_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self._probing = False
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._probing or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._probing or time.monotonic() - self._opened_at >= self.cooldown:
+                return "half_open"
+            return "open"
+
+
+_BREAKER = CircuitBreaker()
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_METRICS_LOCK = threading.Lock()
+_METRICS = {
+    "calls": 0, "succeeded": 0, "failed": 0, "short_circuited": 0, "requests": 0, "retries": 0,
+    "last_call_ms": 0.0, "max_call_ms": 0.0, "total_call_ms": 0.0, "errors": {},
+}
+
+
+def _session():
+    """共用的 requests.Session：连接池复用 TCP / TLS 连接（keep-alive）"""
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                import requests  # 只在真正调用 API 时导入，本地报告不需要
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=AI_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers["Content-Type"] = "application/json"
+                _SESSION = session
+    return _SESSION
+
+
+def _record_call(elapsed_ms, requests_sent, error=None):
+    with _METRICS_LOCK:
+        m = _METRICS
+        m["calls"] += 1
+        m["requests"] += requests_sent
+        m["retries"] += max(requests_sent - 1, 0)
+        m["last_call_ms"] = elapsed_ms
+        m["max_call_ms"] = max(m["max_call_ms"], elapsed_ms)
+        m["total_call_ms"] += elapsed_ms
+        if error is None:
+            m["succeeded"] += 1
+        elif isinstance(error, AIUnavailable):
+            m["short_circuited"] += 1
+        else:
+            m["failed"] += 1
+
+
+def _record_error(kind):
+    with _METRICS_LOCK:
+        _METRICS["errors"][kind] = _METRICS["errors"].get(kind, 0) + 1
+
+
+def get_metrics():
+    """每次调用的耗时与结果：calls / succeeded / failed / short_circuited、requests / retries、
+    *_call_ms，errors 按类别计数（timeout、connection、http_429 等），breaker 为熔断状态"""
+    with _METRICS_LOCK:
+        m = dict(_METRICS, errors=dict(_METRICS["errors"]))
+    m["avg_call_ms"] = m["total_call_ms"] / m["calls"] if m["calls"] else 0.0
+    m["breaker"] = _BREAKER.state()
+    return m
+
+
+def _retry_after(value):
+    """Retry-After 头（秒数或 HTTP 日期）-> 秒，无法解析时为 None"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_error(response):
+    status = response.status_code
+    if status == 401:
+        return AIError("API Error: Invalid API key", retryable=False, kind="http_401")
+    if status == 429:
+        message = "API Error: Rate limited"
+    elif status >= 500:
+        message = f"API Server Error: {response.text[:100]}"
+    else:
+        message = f"API Error {status}"
+    return AIError(message, retryable=status in RETRY_STATUS,
+                   retry_after=_retry_after(response.headers.get("Retry-After")), kind=f"http_{status}")
+
+
+def _post(body, retry=3, stream=False):
+    """发送请求，返回状态码为 200 的响应
+
+    超时、连接错误和 RETRY_STATUS 按指数退避（带随机抖动）重试，其它错误立即抛出 AIError；
+    熔断打开时不发请求，抛出 AIUnavailable。整次调用不超过 AI_CALL_DEADLINE 秒。
+    """
+    import requests
+    
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    if stream:
+        headers["Accept"] = "text/event-stream"
+    started = time.monotonic()
+    deadline = started + AI_CALL_DEADLINE
+    sent = 0
+    error = None
+    try:
+        for attempt in range(retry):
+            if not _BREAKER.allow():
+                # 重试途中熔断打开时抛出上一次的错误
+                error = error or AIUnavailable()
+                raise error
+            remaining = deadline - time.monotonic()
+            log(f"Attempt {attempt+1}/{retry} - Sending request...")
+            sent += 1
+            try:
+                response = _session().post(
+                    API_URL, headers=headers, json=body, stream=stream,
+                    timeout=(AI_CONNECT_TIMEOUT, max(1.0, min(AI_READ_TIMEOUT, remaining))))
+                if response.status_code == 200:
+                    _BREAKER.record_success()
+                    error = None  # 前面失败过的尝试不算这次调用失败
+                    return response
+                error = _http_error(response)
+                response.close()
+            except requests.exceptions.Timeout:
+                error = AIError("API request timed out", kind="timeout")
+            except requests.exceptions.ConnectionError as e:
+                log(f"✗ CONNECTION ERROR: {str(e)[:200]}")
+                error = AIError("Cannot connect to API server", kind="connection")
+            except requests.exceptions.RequestException as e:
+                # 例如回复被截断（ChunkedEncodingError）、解压失败、重定向过多
+                transient = (requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError)
+                error = AIError(f"API request failed: {type(e).__name__}",
+                                retryable=isinstance(e, transient), kind="request")
+            except BaseException as e:
+                # 其它异常也要结束这次尝试，否则试探请求一直不结束，熔断停在半开状态
+                _BREAKER.record_failure()
+                error = e
+                raise
+            log(f"✗ Attempt {attempt+1}: {error}")
+            _BREAKER.record_failure()
+            _record_error(error.kind)
+            if not error.retryable or attempt == retry - 1:
+                raise error
+            delay = random.uniform(0, min(AI_BACKOFF_MAX, AI_BACKOFF_BASE * 2 ** attempt))
+            if error.retry_after is not None:
+                delay = max(delay, error.retry_after)
+            if time.monotonic() + delay >= deadline:
+                raise error
+            log(f"Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+    finally:
+        _record_call((time.monotonic() - started) * 1000, sent, error)
+
+
+def call_deepseek(prompt, retry=3, use_cache=True, stream=False):
+    """调用 DeepSeek API
+
+    use_cache=False 时跳过缓存直接请求，拿到的新回复仍会写入缓存。
+    stream=True 时返回一个逐块产出回复文本的迭代器（命中缓存时只有一块）。
+    失败时抛出 AIError；熔断期间抛出 AIUnavailable。
+    """
+    data = _request_body(prompt)
+    cache_key = ai_cache.make_key(data)
+    if use_cache:
+        cached = _CACHE.get(cache_key)
+        if cached is not None:
+            log("✓ Cache hit")
+            return iter([cached]) if stream else cached
+    else:
+        _CACHE.record_bypass()
+    if stream:
+        return _stream_deepseek(data, cache_key, retry)
     
     log(f"\n=== DeepSeek API Debug ===")
     log(f"URL: {API_URL}")
     log(f"Prompt length: {len(prompt)} chars")
     
-    for attempt in range(retry):
-        try:
-            log(f"Attempt {attempt+1}/{retry} - Sending request (timeout=120s)...")
-            response = requests.post(API_URL, headers=headers, json=data, timeout=120)
-            
-            log(f"Response status: {response.status_code}")
-            log(f"Response text (first 300): {response.text[:300]}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                if "choices" in result and result["choices"]:
-                    log("✓ API call successful!")
-                    return result["choices"][0]["message"]["content"]
-                else:
-                    log(f"✗ API response error: {result}")
-                    raise Exception(f"API response error: {result}")
-            elif response.status_code == 401:
-                log("✗ Unauthorized - Invalid API key")
-                raise Exception("API Error: Invalid API key")
-            elif response.status_code == 429:
-                log("✗ Rate limited - Too many requests")
-                raise Exception("API Error: Rate limited")
-            elif response.status_code == 500:
-                log("✗ Server Error")
-                raise Exception(f"API Server Error: {response.text[:100]}")
-            else:
-                log(f"✗ Unknown error: {response.status_code}")
-                raise Exception(f"API Error {response.status_code}")
-                
-        except requests.exceptions.Timeout:
-            log(f"✗ Attempt {attempt+1} TIMED OUT after 120 seconds")
-            if attempt < retry - 1:
-                log("Retrying in 5 seconds...")
-                import time
-                time.sleep(5)
-                continue
-            raise Exception("API request timed out")
-        except requests.exceptions.ConnectionError as e:
-            log(f"✗ CONNECTION ERROR: {str(e)[:200]}")
-            if attempt < retry - 1:
-                log("Retrying in 5 seconds...")
-                import time
-                time.sleep(5)
-                continue
-            raise Exception(f"Cannot connect to API server")
-        except Exception as e:
-            log(f"✗ Exception: {str(e)[:200]}")
-            if attempt < retry - 1:
-                log("Retrying in 5 seconds...")
-                import time
-                time.sleep(5)
-                continue
-            raise Exception(f"API call failed: {str(e)[:100]}")
+    response = _post(data, retry)
+    try:
+        result = response.json()
+    except ValueError:
+        result = None
+    if result and result.get("choices"):
+        log("✓ API call successful!")
+        content = result["choices"][0]["message"]["content"]
+        _CACHE.put(cache_key, content)
+        return content
+    log(f"✗ API response error: {str(result)[:300]}")
+    _record_error("bad_response")
+    raise AIError(f"API response error: {str(result)[:100]}", retryable=False, kind="bad_response")
+
+
+def _stream_deepseek(data, cache_key, retry=3):
+    """以 server-sent events 方式请求，逐块产出回复文本，完整收到后写入缓存
+
+    只在收到第一块之前重试；之后出错直接抛出，并计入熔断的失败次数。
+    """
+    response = _post(dict(data, stream=True), retry, stream=True)
+    
+    parts = []
+    try:
+        with response:
+            for line in response.iter_lines():
+                # 每个事件一行 "data: {...}"，结束时为 "data: [DONE]"；空行和注释行跳过。
+                # 读到响应末尾而不是在 [DONE] 处退出，连接才能放回连接池复用
+                if not line.startswith(b"data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == b"[DONE]":
+                    continue
+                choices = json.loads(payload).get("choices") or [{}]
+                chunk = (choices[0].get("delta") or {}).get("content")
+                if chunk:
+                    parts.append(chunk)
+                    yield chunk
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        _BREAKER.record_failure()
+        _record_error("stream")
+        raise AIError(f"API stream interrupted: {str(e)[:100]}", kind="stream") from e
+    if parts:
+        _CACHE.put(cache_key, "".join(parts))
 
 
 def generate_report_local(answers, unit_name):
@@ -164,17 +418,60 @@ def generate_report_local(answers, unit_name):
     return report
 
 
-def generate_report_ai(answers, unit_name):
+def generate_report_ai(answers, unit_name, use_cache=True):
     """AI分析报告 - 优先使用在线AI，失败则用本地"""
     try:
-        return generate_report_ai_online(answers, unit_name)
+        return generate_report_ai_online(answers, unit_name, use_cache)
     except Exception as e:
         log(f"AI failed: {e}")
         return generate_report_local(answers, unit_name)
 
 
-def generate_report_ai_online(answers, unit_name):
+def generate_report_ai_online(answers, unit_name, use_cache=True):
     """在线AI分析报告"""
+    return call_deepseek(_report_prompt(answers, unit_name), use_cache=use_cache)
+
+
+def stream_report_ai(answers, unit_name, first_token_timeout=None, use_cache=True):
+    """流式AI分析报告，逐块产出 Markdown 文本
+
+    首个文本块在 first_token_timeout 秒内没有到达、或请求出错时，改为产出本地报告；
+    中途出错时在已输出的内容后接上本地报告。超时后请求仍在后台完成并写入缓存，
+    下次生成时直接命中。
+    """
+    timeout = AI_FIRST_TOKEN_TIMEOUT if first_token_timeout is None else first_token_timeout
+    prompt = _report_prompt(answers, unit_name)
+    chunks = queue.Queue()
+    
+    def produce():
+        try:
+            for chunk in call_deepseek(prompt, use_cache=use_cache, stream=True):
+                chunks.put(chunk)
+        except Exception as e:
+            chunks.put(e)
+        chunks.put(None)
+    
+    threading.Thread(target=produce, name="deepseek-stream", daemon=True).start()
+    try:
+        item = chunks.get(timeout=timeout)
+    except queue.Empty:
+        log(f"✗ No AI output within {timeout}s, using local report")
+        yield generate_report_local(answers, unit_name)
+        return
+    received = False
+    while item is not None:
+        if isinstance(item, Exception):
+            log(f"AI stream failed: {item}")
+            if received:
+                yield "\n\n---\n\n⚠️ *AI analysis was interrupted. Local analysis:*\n\n"
+            yield generate_report_local(answers, unit_name)
+            return
+        received = True
+        yield item
+        item = chunks.get()
+
+
+def _report_prompt(answers, unit_name):
     correct = sum(1 for r in answers if r.get("correct"))
     total = len(answers)
     wrong = [r for r in answers if not r.get("correct")]
@@ -213,13 +510,21 @@ Please provide a comprehensive analysis with:
 
 Use clear headings and be encouraging for a teenage student."""
 
-    return call_deepseek(prompt)
+    return prompt
 
 
-def generate_quiz_ai(unit_name, topics, num=10):
-    """使用 AI 生成选择题"""
+def _parse_questions(prompt, response):
+    """逐个取出回复中的题目对象，格式错误的单独丢弃；一个都没有时删除这条缓存，下次重新请求"""
+    items = list(json_stream.iter_objects([response]))
+    if not items:
+        _CACHE.discard(ai_cache.make_key(_request_body(prompt)))
+        raise ValueError("no question objects in response")
+    return items
+
+
+def _quiz_prompt(unit_name, topics, num):
     topic_list = "\n".join([f"- {t}" for t in topics[:5]])
-    prompt = f"""You are an IGCSE Physics examiner. Generate {num} multiple-choice questions for "{unit_name}".
+    return f"""You are an IGCSE Physics examiner. Generate {num} multiple-choice questions for "{unit_name}".
 
 Topics:
 {topic_list}
@@ -229,36 +534,97 @@ Requirements:
 - Include explanation
 - Return valid JSON array with keys: question, option_a, option_b, option_c, option_d, answer, explanation, topic"""
 
+
+def stream_quiz_ai(unit_name, topics, num=10, use_cache=True, stats=None):
+    """流式生成选择题，每道题一生成完就校验并产出，不必等整个回复
+
+    产出的题目为 dict（含 id、source='ai'，知识点对应到 topics 之一）；
+    不合格或格式错误的题目单独跳过。stats 不为 None 时写入 accepted / rejected 计数。
+    """
+    topics = list(topics)[:5]
+    prompt = _quiz_prompt(unit_name, topics, num)
+    parser = json_stream.ObjectStream()
+    accepted = rejected = 0
     try:
-        response = call_deepseek(prompt)
-        text = response.strip()
-        
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0]
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0]
-        
-        return json.loads(text.strip())
+        for chunk in call_deepseek(prompt, use_cache=use_cache, stream=True):
+            for item in parser.feed(chunk):
+                question = validate_question(item, unit_name, topics)
+                if question is None:
+                    rejected += 1
+                    continue
+                accepted += 1
+                yield question
+        parser.close()
+    finally:
+        rejected += parser.malformed
+        if stats is not None:
+            stats.update(accepted=accepted, rejected=rejected)
+    if not accepted:
+        _CACHE.discard(ai_cache.make_key(_request_body(prompt)))
+
+
+def generate_quiz_ai(unit_name, topics, num=10, use_cache=True):
+    """使用 AI 生成选择题，返回校验通过的题目列表（见 stream_quiz_ai）"""
+    try:
+        questions = list(stream_quiz_ai(unit_name, topics, num, use_cache))
     except Exception as e:
         raise Exception(f"Failed to generate quiz: {str(e)}")
+    if not questions:
+        raise Exception("Failed to generate quiz: no valid questions in response")
+    return questions
 
 
-def generate_remedial_questions_ai(wrong_topics, num=5):
-    """针对错题知识点生成补充练习"""
+def _remedial_prompt(wrong_topics, num):
     topic_list = ", ".join(wrong_topics[:3])
-    prompt = f"""Generate {num} IGCSE Physics questions on: {topic_list}.
+    return f"""Generate {num} IGCSE Physics questions on: {topic_list}.
 
 Return JSON with: question, option_a, option_b, option_c, option_d, answer, explanation, topic"""
 
+
+def generate_remedial_questions_ai(wrong_topics, num=5, use_cache=True):
+    """针对错题知识点生成补充练习，返回校验通过的题目列表（见 validate_question）
+
+    每道题的知识点对应到 wrong_topics 之一，单元取这个知识点所在的单元；
+    题库中找不到的知识点、不合格的题目单独丢弃。
+    """
+    import data_loader
+    topics = [t for t in dict.fromkeys(wrong_topics) if t][:3]
+    prompt = _remedial_prompt(topics, num)
+    units = {t: unit for unit in data_loader.get_units()
+             for t in data_loader.get_topics_for_unit(unit) if t in topics}
+
     try:
-        response = call_deepseek(prompt)
-        text = response.strip()
-        
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0]
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0]
-        
-        return json.loads(text.strip())
+        response = call_deepseek(prompt, use_cache=use_cache)
+        items = _parse_questions(prompt, response)
     except Exception as e:
         raise Exception(f"Failed to generate remedial questions: {str(e)}")
+    questions = []
+    for item in items:
+        # 先在所有错题知识点中确定题目的知识点，再按它所在的单元生成题目
+        question = validate_question(item, "", topics)
+        if question is None or question["topic"] not in units:
+            continue
+        topic = question["topic"]
+        questions.append(validate_question(dict(item, topic=topic), units[topic], [topic]))
+    if not questions:
+        _CACHE.discard(ai_cache.make_key(_request_body(prompt)))
+        raise Exception("Failed to generate remedial questions: no valid questions in response")
+    return questions
+
+
+def submit_report_job(answers, unit_name, use_cache=True):
+    """在后台生成AI分析报告，返回 job id，用 ai_jobs.get(job_id) 轮询
+
+    生成过程中快照的 partial 为已收到的内容；出错或超过 AI_JOB_TIMEOUT 时结果为本地报告。
+    相同答题数据的报告同一时间只请求一次。
+    """
+    key = "report:" + ai_cache.make_key(_request_body(_report_prompt(answers, unit_name)))
+
+    def run(job):
+        for chunk in stream_report_ai(answers, unit_name, use_cache=use_cache):
+            if job.cancelled:
+                return None
+            job.append(chunk)
+        return "".join(job.parts)
+
+    return ai_jobs.submit(key, run, fallback=lambda: generate_report_local(answers, unit_name))
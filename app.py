@@ -3,17 +3,21 @@ import time
 import random
 import json
 import base64
-from auth import register, authenticate, validate_session, logout
-import sqlite3
+from auth import register, authenticate, validate_session, logout, is_teacher
 import os
 
-# 导入自定义模块
-from data_loader import get_units, get_topics_for_unit, get_quiz_questions, get_questions_df
-from db import save_quiz_record
-from ai_service import generate_report_ai, generate_remedial_questions_ai
+# 题库（pandas）、AI 服务（requests）等较重的模块在用到的页面里再导入，
+# 登录页不需要等它们加载
+import warmup
 
 st.set_page_config(page_title="IGCSE Physics Practice", page_icon="⚛️", layout="wide")
 
+# 后台预热：加载题库、打开数据库、启动题库热更新（每个进程只执行一次）
+warmup.start()
+
+# 错题练习中最多使用几道预先生成的 AI 题目（见 ai_pool.py）
+AI_REMEDIAL_QUESTIONS = int(os.environ.get("AI_REMEDIAL_QUESTIONS", "3"))
+
 # JavaScript to handle token in localStorage
 st.markdown("""
 <script>
@@ -58,7 +62,7 @@ def check_session_from_url():
                     
                     # 恢复页面状态 - 使用 page_status
                     page_status = query_params.get("page_status")
-                    if page_status in ["home", "quiz_setup", "quiz", "result"]:
+                    if page_status in ["home", "quiz_setup", "quiz", "result", "dashboard"]:
                         st.session_state.page = page_status
                         st.session_state.page_status = page_status
                     else:
@@ -75,18 +79,24 @@ def check_session_from_url():
                         try:
                             answers_json = base64.b64decode(answers_b64.encode()).decode()
                             simplified_answers = json.loads(answers_json)
-                            # 还原为完整格式
+                            # 还原为 session 格式（题目内容按 ID 查询）
                             answers = []
                             for a in simplified_answers:
-                                answers.append({
-                                    "question": a.get("q", ""),
-                                    "topic": a.get("t", ""),
+                                answer = {
+                                    "id": a.get("id"),
                                     "user_answer": a.get("ua", ""),
-                                    "answer": a.get("a", ""),
                                     "correct": a.get("c", 0) == 1,
-                                    "explanation": a.get("e", ""),
                                     "time_spent": a.get("ts", 0)
-                                })
+                                }
+                                if "id" not in a:
+                                    # 旧版本 URL 保存的是题目原文
+                                    answer.update({
+                                        "question": a.get("q", ""),
+                                        "topic": a.get("t", ""),
+                                        "answer": a.get("a", ""),
+                                        "explanation": a.get("e", ""),
+                                    })
+                                answers.append(answer)
                             st.session_state.answers = answers
                         except:
                             pass
@@ -143,16 +153,13 @@ def save_state_to_url():
     # 保存答题结果（如果是在结果页）
     answers = st.session_state.get("answers", [])
     if answers:
-        # 只保存关键信息，减小数据量
+        # 只保存题目 ID 和作答信息，题目内容恢复时按 ID 查询
         simplified_answers = []
         for a in answers:
             simplified_answers.append({
-                "q": a.get("question", "")[:100],  # 题目简略
-                "t": a.get("topic", ""),
+                "id": a.get("id"),
                 "ua": a.get("user_answer", ""),
-                "a": a.get("answer", ""),
                 "c": 1 if a.get("correct") else 0,
-                "e": a.get("explanation", "")[:200],  # 解析简略
                 "ts": round(a.get("time_spent", 0), 1)
             })
         try:
@@ -204,6 +211,8 @@ def init_session_state():
         st.session_state.wrong_topics = []
     if "ai_report" not in st.session_state:
         st.session_state.ai_report = None
+    if "ai_job" not in st.session_state:
+        st.session_state.ai_job = None
     if "logged_in" not in st.session_state:
         st.session_state.logged_in = False
     if "username" not in st.session_state:
@@ -259,20 +268,13 @@ UNIT_ICONS = {
 }
 
 
-def get_user_id(username):
-    conn = sqlite3.connect("users.db")
-    cursor = conn.execute("SELECT id FROM users WHERE username = ?", (username,))
-    row = cursor.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-
 def render_home_page():
     """首页 - 单元选择"""
     st.title("⚛️ IGCSE Physics Practice")
     st.markdown(f"Welcome **{st.session_state.username}**! Choose a unit to start:")
     st.divider()
     
+    from data_loader import get_units
     units = get_units()
     available_units = [(UNIT_ICONS.get(u, "📚"), u, UNIT_COLORS.get(u, "#666")) for u in units]
     
@@ -311,6 +313,8 @@ def render_quiz_setup_page():
     st.title(f"{UNIT_ICONS.get(unit, '📚')} {unit}")
     st.markdown("Choose topics to practice:")
     
+    from data_loader import get_topics_for_unit
+    from adaptive import select_questions
     topics = get_topics_for_unit(unit)
     
     # 全选按钮
@@ -333,7 +337,7 @@ def render_quiz_setup_page():
     
     if st.button("🎯 Start Quiz", type="primary", use_container_width=True):
         if selected_topics:
-            questions = get_quiz_questions(unit, num_questions, selected_topics)
+            questions = select_questions(st.session_state.user_id, unit, num_questions, selected_topics)
             if questions:
                 st.session_state.quiz_data = questions
                 st.session_state.current_q = 0
@@ -342,6 +346,7 @@ def render_quiz_setup_page():
                 st.session_state.start_time = time.time()
                 st.session_state.q_start_time = time.time()
                 st.session_state.ai_report = None
+                st.session_state.ai_job = None
                 navigate_to("quiz")
             else:
                 st.error("No questions available for selected topics!")
@@ -351,9 +356,19 @@ def render_quiz_setup_page():
 
 def render_quiz_page():
     """答题页面"""
+    from data_loader import get_question
+    from db import save_quiz_record, flush_records
     questions = st.session_state.quiz_data
     current = st.session_state.current_q
-    q = questions[current]
+    q = get_question(questions[current])
+    if q is None:
+        st.error("This question is no longer available.")
+        if st.button("⏭️ Skip", use_container_width=True):
+            if current + 1 >= len(questions):
+                navigate_to("result")
+            st.session_state.current_q += 1
+            st.rerun()
+        return
     
     # 进度条
     progress = (current + 1) / len(questions)
@@ -397,19 +412,16 @@ def render_quiz_page():
             if user_id:
                 save_quiz_record(
                     user_id, st.session_state.username,
-                    st.session_state.selected_unit,
-                    q.get("question", ""), q.get("topic", ""),
+                    q.get("unit") or st.session_state.selected_unit,
+                    q["id"], q.get("topic", ""),
                     selected_key, q.get("answer", ""), is_correct, elapsed
                 )
             
-            # 记录答案
+            # 记录答案（只保存题目 ID，内容按需查询）
             st.session_state.answers.append({
-                "question": q.get("question", ""),
-                "topic": q.get("topic", ""),
+                "id": q["id"],
                 "user_answer": selected_key,
-                "answer": q.get("answer", ""),
                 "correct": is_correct,
-                "explanation": q.get("explanation", ""),
                 "time_spent": elapsed
             })
             
@@ -419,6 +431,7 @@ def render_quiz_page():
             
             # 下一题或结束
             if current + 1 >= len(questions):
+                flush_records()  # 答题结束，立即写入缓冲中的记录
                 navigate_to("result")
             else:
                 st.session_state.current_q += 1
@@ -427,6 +440,7 @@ def render_quiz_page():
     
     with col2:
         if st.button("🏁 End Quiz", use_container_width=True):
+            flush_records()
             navigate_to("result")
 
 
@@ -441,6 +455,10 @@ def render_result_page():
         if st.button("Start New Quiz"):
             navigate_to("home")
         return
+    from data_loader import expand_answers
+    import ai_jobs
+    from ai_service import submit_report_job, generate_report_local
+    answers = expand_answers(answers)
     
     correct = sum(1 for a in answers if a.get("correct", False))
     total = len(answers)
@@ -495,35 +513,43 @@ def render_result_page():
     st.subheader("🤖 Analysis Report")
     
     # 检查是否已有报告
+    job = ai_jobs.get(st.session_state.ai_job) if st.session_state.get("ai_job") else None
+    if job and job["status"] in ai_jobs.FINISHED:
+        st.session_state.ai_job = None
+        if job["result"]:
+            st.session_state.ai_report = job["result"]
+        else:
+            st.error(f"AI unavailable: {(job['error'] or job['status'])[:80]}")
+        job = None
+    
     if st.session_state.get("ai_report"):
         st.markdown(st.session_state.ai_report)
         if st.button("🔄 Regenerate Report"):
             st.session_state.ai_report = None
             st.rerun()
+    elif job:
+        # 后台任务生成中：显示已收到的内容，定时刷新页面查看进度
+        if job["partial"]:
+            st.markdown(job["partial"] + " ▌")
+        else:
+            st.info(f"🤖 Generating AI analysis... ({job['elapsed']:.0f}s)")
+        if st.button("✖️ Cancel"):
+            ai_jobs.cancel(job["id"])
+            st.session_state.ai_job = None
+            st.rerun()
+        time.sleep(0.5)
+        st.rerun()
     else:
         col1, col2 = st.columns(2)
         with col1:
             if st.button("🤖 Generate AI Analysis", use_container_width=True):
-                try:
-                    with st.spinner("🤖 Generating AI analysis..."):
-                        report = generate_report_ai(answers, st.session_state.selected_unit)
-                        st.session_state.ai_report = report
-                        st.rerun()
-                except Exception as e:
-                    st.error(f"AI unavailable: {str(e)[:80]}")
-                    # 自动显示本地分析
-                    try:
-                        from ai_service import generate_report_local
-                        report = generate_report_local(answers, st.session_state.selected_unit)
-                        st.session_state.ai_report = report
-                        st.rerun()
-                    except:
-                        pass
+                # 在后台生成，出错或超时时任务结果为本地报告
+                st.session_state.ai_job = submit_report_job(answers, st.session_state.selected_unit)
+                st.rerun()
         
         with col2:
             if st.button("📊 Show Local Analysis", use_container_width=True):
                 try:
-                    from ai_service import generate_report_local
                     report = generate_report_local(answers, st.session_state.selected_unit)
                     st.session_state.ai_report = report
                     st.rerun()
@@ -540,9 +566,19 @@ def render_result_page():
     with col2:
         wrong_topics = list(set(st.session_state.wrong_topics))
         if wrong_topics and st.button("🎯 Practice Weak Topics", use_container_width=True):
-            # 生成错题知识点练习
-            from data_loader import get_wrong_topic_questions
-            new_questions = get_wrong_topic_questions(wrong_topics, 10)
+            # 生成错题知识点练习：题库中的题目，加上预先生成的 AI 题目（池中没有时全部来自题库）
+            from adaptive import select_questions
+            from ai_pool import remedial_questions
+            try:
+                ai_questions = remedial_questions(wrong_topics, AI_REMEDIAL_QUESTIONS,
+                                                  st.session_state.selected_unit)
+            except Exception as e:
+                print(f"AI question pool unavailable: {e}")
+                ai_questions = []
+            new_questions = select_questions(st.session_state.user_id, None,
+                                             10 - len(ai_questions), wrong_topics)
+            new_questions = new_questions + ai_questions
+            random.shuffle(new_questions)
             if new_questions:
                 st.session_state.quiz_data = new_questions
                 st.session_state.current_q = 0
@@ -551,6 +587,7 @@ def render_result_page():
                 st.session_state.start_time = time.time()
                 st.session_state.q_start_time = time.time()
                 st.session_state.ai_report = None
+                st.session_state.ai_job = None
                 navigate_to("quiz")
             else:
                 st.error("No more questions for these topics!")
@@ -558,6 +595,69 @@ def render_result_page():
         if st.button("⬅️ Go Back", use_container_width=True):
             go_back()
 
+def render_dashboard_page():
+    """教师看板 - 全班按知识点统计（读取预先汇总的数据）"""
+    if not is_teacher(st.session_state.username):
+        st.warning("The class dashboard is only available to teachers.")
+        if st.button("⬅️ Back to Home"):
+            navigate_to("home")
+        return
+
+    import pandas as pd
+    import rollups
+
+    if st.button("⬅️ Back to Unit Selection", key="back_from_dashboard"):
+        navigate_to("home")
+    st.title("📈 Class Dashboard")
+
+    freshness = rollups.get_freshness()
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        if freshness["refreshed_at"]:
+            age = max(time.time() - freshness["refreshed_at"], 0)
+            st.caption(f"Data updated {age:.0f}s ago · {freshness['pending']} newer answers not yet included")
+        else:
+            st.caption("Statistics have not been computed yet.")
+    with col2:
+        if st.button("🔄 Refresh", use_container_width=True):
+            with st.spinner("Updating statistics..."):
+                rollups.refresh()
+            st.rerun()
+
+    rows = rollups.get_topic_rollup()
+    units = sorted({r[0] for r in rows})
+    unit = st.selectbox("Unit", ["All units"] + units)
+    if unit != "All units":
+        rows = [r for r in rows if r[0] == unit]
+    if not rows:
+        st.info("No answers recorded yet.")
+        return
+
+    total_attempts = sum(r[2] for r in rows)
+    total_correct = sum(r[3] for r in rows)
+    total_time = sum(r[4] for r in rows)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Answers", f"{total_attempts:,}")
+    col2.metric("Accuracy", f"{100 * total_correct / total_attempts:.1f}%")
+    col3.metric("Avg time / question", f"{total_time / total_attempts:.1f}s")
+
+    st.subheader("Accuracy by topic")
+    topic_df = pd.DataFrame([
+        {"Unit": r[0], "Topic": r[1], "Answers": r[2],
+         "Accuracy %": round(100 * r[3] / r[2], 1), "Avg time (s)": round(r[4] / r[2], 1)}
+        for r in rows if r[2]
+    ]).sort_values("Accuracy %")
+    st.dataframe(topic_df, use_container_width=True, hide_index=True)
+
+    st.subheader("Hardest questions")
+    hardest = rollups.get_hardest_questions(None if unit == "All units" else unit)
+    if not hardest:
+        st.info(f"Questions need at least {rollups.HARDEST_MIN_ATTEMPTS} answers to be ranked.")
+    for i, q in enumerate(hardest):
+        with st.expander(f"{i+1}. {q['accuracy']:.0%} correct · {q['attempts']} answers · {q['topic'][:60]}"):
+            st.markdown(q["question"] or "_(question text not available)_")
+            st.markdown(f"✅ Correct answer: **{q['answer']}** · ⏱️ Avg time {q['avg_time']:.1f}s")
+
 
 # ==================== 主程序 ====================
 
@@ -565,10 +665,15 @@ def render_result_page():
 with st.sidebar:
     if st.session_state.logged_in:
         st.success(f"Welcome, **{st.session_state.username}** 👋")
+        if is_teacher(st.session_state.username):
+            if st.button("📈 Class Dashboard", use_container_width=True):
+                navigate_to("dashboard")
         if st.button("Logout", use_container_width=True):
             # 清除服务器端会话
             if st.session_state.get("token"):
                 logout(st.session_state.token)
+            from db import flush_records
+            flush_records()
             st.session_state.logged_in = False
             st.session_state.username = ""
             st.session_state.user_id = None
@@ -588,11 +693,11 @@ with st.sidebar:
             login_user = st.text_input("Username", key="login_user")
             login_pass = st.text_input("Password", type="password", key="login_pass")
             if st.button("Login", use_container_width=True):
-                ok, msg, token = authenticate(login_user, login_pass)
+                ok, msg, token, user_id = authenticate(login_user, login_pass)
                 if ok:
                     st.session_state.logged_in = True
                     st.session_state.username = login_user
-                    st.session_state.user_id = get_user_id(login_user)
+                    st.session_state.user_id = user_id
                     st.session_state.token = token
                     # 保存登录状态和当前页面到 URL
                     try:
@@ -641,3 +746,5 @@ elif st.session_state.page == "quiz":
     render_quiz_page()
 elif st.session_state.page == "result":
     render_result_page()
+elif st.session_state.page == "dashboard":
+    render_dashboard_page()
@@ -0,0 +1,291 @@
+# 答题记录归档：把超过保留期的记录按月移出 quiz_records，写成压缩的 Parquet 分区
+#
+#   python archive.py run                       # 归档 ARCHIVE_AFTER_DAYS 天之前的整月记录
+#   python archive.py run --older-than-days 90 --dry-run
+#   python archive.py list                      # 各月分区的文件数、行数和大小
+#
+# 分区目录为 ARCHIVE_DIR/YYYY-MM/quiz_records-<first_id>-<last_id>.parquet，
+# 列与 export_records 的导出一致（用户名、单元、知识点、题目哈希都已展开），不依赖数据库即可读取。
+# 只归档已经汇总进看板（rollup_state 水位线以内）的记录；user_topic_stats 与看板汇总表不删减，
+# 总计保持不变。归档后热表只保留最近的记录。
+# 每个月先写文件、再在一个事务里删除同一批记录，删除条数对不上时回滚并删掉文件。
+# 查询历史时传 include_archived=True 才会读取归档分区。需要安装 pyarrow：pip install pyarrow
+# 用 --dir 归档到其他目录时，目录会记录在 ARCHIVE_LOCATIONS 文件里；
+# 不指定 archive_dir 的读取（重建汇总、历史、导出）读取默认目录和所有记录过的目录。
+import argparse
+import calendar
+import glob
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import database
+import export_records
+import rollups
+import storage
+from question_store import answer_code
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", os.path.join(os.path.dirname(database.DB_PATH), "archive"))
+ARCHIVE_LOCATIONS = os.environ.get(
+    "ARCHIVE_LOCATIONS", os.path.join(os.path.dirname(database.DB_PATH), "archive_locations.txt"))
+# 后台归档间隔（秒），0 表示不在应用内归档（由 cron 运行 python archive.py run）
+ARCHIVE_INTERVAL = float(os.environ.get("ARCHIVE_INTERVAL", "0"))
+
+_LOCK = threading.Lock()
+_ARCHIVER = None
+
+
+def _month_start(epoch):
+    d = datetime.fromtimestamp(epoch, timezone.utc)
+    return calendar.timegm((d.year, d.month, 1, 0, 0, 0))
+
+
+def _next_month(start):
+    d = datetime.fromtimestamp(start, timezone.utc)
+    year, month = (d.year + 1, 1) if d.month == 12 else (d.year, d.month + 1)
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+
+def _label(start):
+    return datetime.fromtimestamp(start, timezone.utc).strftime("%Y-%m")
+
+
+def archive_dirs():
+    """默认归档目录和所有记录过的其他归档目录（绝对路径）"""
+    dirs = [os.path.abspath(ARCHIVE_DIR)]
+    try:
+        with open(ARCHIVE_LOCATIONS, encoding="utf-8") as f:
+            dirs.extend(line.strip() for line in f if line.strip())
+    except FileNotFoundError:
+        pass
+    return list(dict.fromkeys(dirs))
+
+
+def _remember_dir(archive_dir):
+    path = os.path.abspath(archive_dir)
+    if path not in archive_dirs():
+        with open(ARCHIVE_LOCATIONS, "a", encoding="utf-8") as f:
+            f.write(path + "\n")
+
+
+def _files(archive_dir=None):
+    """archive_dir 为 None 时包括所有归档目录，按月份排序"""
+    dirs = [archive_dir] if archive_dir else archive_dirs()
+    files = [f for d in dirs for f in glob.glob(os.path.join(d, "*", "quiz_records-*.parquet"))]
+    return sorted(files, key=lambda f: (os.path.basename(os.path.dirname(f)), os.path.basename(f)))
+
+
+def archive_month(start, archive_dir=None, max_id=None):
+    """归档 start 所在月份的记录，返回 {"month", "rows", "path"}"""
+    st = storage.get_storage()
+    end = _next_month(start)
+    if max_id is None:
+        max_id = rollups.get_freshness()["last_id"]
+    if archive_dir:
+        # 删除记录之前先记下位置，之后不指定目录的读取也能找到这些分区
+        _remember_dir(archive_dir)
+    month_dir = os.path.join(archive_dir or ARCHIVE_DIR, _label(start))
+    os.makedirs(month_dir, exist_ok=True)
+    pending = os.path.join(month_dir, f"pending-{os.getpid()}.parquet")
+    result = export_records.export_records(pending, "parquet", since=start, until=end, max_id=max_id)
+    if not result["rows"]:
+        os.remove(pending)
+        if not os.listdir(month_dir):
+            os.rmdir(month_dir)
+        return {"month": _label(start), "rows": 0, "path": None}
+    path = os.path.join(month_dir, f"quiz_records-{result['first_id']}-{result['last_id']}.parquet")
+    os.replace(pending, path)
+    try:
+        st.delete_records(start, end, max_id, result["rows"])
+    except BaseException:
+        os.remove(path)
+        raise
+    return {"month": _label(start), "rows": result["rows"], "path": path}
+
+
+def run(older_than_days=None, archive_dir=None, dry_run=False):
+    """归档保留期之前的所有整月，返回各月的结果列表
+
+    只处理完全早于截止时间的月份，每个月只生成一批文件；再次运行时已归档的月份没有剩余记录。
+    """
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = _month_start(time.time() - days * 86400)
+    st = storage.get_storage()
+    with _LOCK:
+        # 先把新记录汇总进看板，归档后汇总表仍然包含这些记录
+        rollups.refresh()
+        max_id = rollups.get_freshness()["last_id"]
+        results = []
+        start = 0
+        while True:
+            # 跳过没有记录的月份
+            oldest = st.query("""
+                SELECT MIN(created_at) FROM quiz_records WHERE id <= ? AND created_at >= ?
+            """, (max_id, start))[0][0]
+            if oldest is None or _month_start(oldest) >= cutoff:
+                break
+            start = _month_start(oldest)
+            if dry_run:
+                rows = st.query("""
+                    SELECT COUNT(*) FROM quiz_records WHERE created_at >= ? AND created_at < ? AND id <= ?
+                """, (start, _next_month(start), max_id))[0][0]
+                results.append({"month": _label(start), "rows": rows, "path": None})
+            else:
+                results.append(archive_month(start, archive_dir, max_id))
+            start = _next_month(start)
+    return results
+
+
+def _dataset(archive_dir=None):
+    try:
+        import pyarrow.dataset as ds
+    except ImportError as e:
+        raise RuntimeError("读取归档需要 pyarrow：pip install pyarrow") from e
+    files = _files(archive_dir)
+    return ds.dataset(files, format="parquet") if files else None
+
+
+def _filter(since, until, unit, user_id, after_id=0):
+    import pyarrow.dataset as ds
+    expr = None
+    conditions = [ds.field("id") > after_id] if after_id else []
+    if since is not None:
+        conditions.append(ds.field("created_at") >= datetime.fromtimestamp(since, timezone.utc))
+    if until is not None:
+        conditions.append(ds.field("created_at") < datetime.fromtimestamp(until, timezone.utc))
+    if unit:
+        conditions.append(ds.field("unit") == unit)
+    if user_id is not None:
+        conditions.append(ds.field("user_id") == user_id)
+    for c in conditions:
+        expr = c if expr is None else expr & c
+    return expr
+
+
+def has_archives(archive_dir=None):
+    return bool(_files(archive_dir))
+
+
+def iter_archived_batches(since=None, until=None, unit=None, user_id=None, columns=None,
+                          archive_dir=None, after_id=0, batch_size=export_records.CHUNK_ROWS):
+    """按月份顺序逐批读取归档记录（pyarrow RecordBatch，列与导出文件相同）"""
+    dataset = _dataset(archive_dir)
+    if dataset is None:
+        return
+    for batch in dataset.to_batches(columns=columns,
+                                    filter=_filter(since, until, unit, user_id, after_id),
+                                    batch_size=batch_size):
+        if batch.num_rows:
+            yield batch
+
+
+def iter_archived_rows(since=None, until=None, unit=None, user_id=None, archive_dir=None):
+    """逐行返回归档记录，格式与 storage.iter_quiz_records 的行相同"""
+    for batch in iter_archived_batches(since, until, unit, user_id, archive_dir=archive_dir):
+        for r in batch.to_pylist():
+            yield (r["id"], r["user_id"], r["username"], r["unit"], r["topic"], r["question_id"],
+                   answer_code(r["user_answer"]), r["correct_answer"], int(r["is_correct"]),
+                   r["time_spent"], int(r["created_at"].timestamp()))
+
+
+def archived_topic_stats(archive_dir=None):
+    """按 (user_id, unit, topic) 汇总归档记录，供 backfill_topic_stats 累加
+
+    返回 [(user_id, unit, topic, attempts, correct, total_time, last_seen)]
+    """
+    stats = {}
+    columns = ["user_id", "unit", "topic", "is_correct", "time_spent", "created_at"]
+    for batch in iter_archived_batches(columns=columns, archive_dir=archive_dir):
+        table = batch.to_pydict()
+        for user_id, unit, topic, is_correct, time_spent, created_at in zip(*(table[c] for c in columns)):
+            s = stats.setdefault((user_id, unit, topic), [0, 0, 0.0, 0])
+            s[0] += 1
+            s[1] += 1 if is_correct else 0
+            s[2] += time_spent or 0
+            s[3] = max(s[3], int(created_at.timestamp()))
+    return [(*key, *value) for key, value in stats.items()]
+
+
+def archived_last_seen(user_id, unit_name, archive_dir=None):
+    """{question_id(hash): last_seen}，归档记录中该用户在某单元每道题的最近作答时间"""
+    last_seen = {}
+    for batch in iter_archived_batches(unit=unit_name, user_id=user_id,
+                                       columns=["question_id", "created_at"], archive_dir=archive_dir):
+        for qid, created_at in zip(batch.column(0).to_pylist(), batch.column(1).to_pylist()):
+            ts = int(created_at.timestamp())
+            if ts > last_seen.get(qid, 0):
+                last_seen[qid] = ts
+    return last_seen
+
+
+def list_partitions(archive_dir=None):
+    """[{"month", "files", "rows", "bytes"}]"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("读取归档需要 pyarrow：pip install pyarrow") from e
+    months = {}
+    for path in _files(archive_dir):
+        month = os.path.basename(os.path.dirname(path))
+        m = months.setdefault(month, {"month": month, "files": 0, "rows": 0, "bytes": 0})
+        m["files"] += 1
+        m["rows"] += pq.ParquetFile(path).metadata.num_rows
+        m["bytes"] += os.path.getsize(path)
+    return [months[k] for k in sorted(months)]
+
+
+def _archive_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            for r in run():
+                if r["rows"]:
+                    print(f"Archived {r['rows']} quiz records for {r['month']}")
+        except Exception as e:
+            print(f"Archiving failed: {e}")
+
+
+def start_archiver(interval=None):
+    """ARCHIVE_INTERVAL > 0 时在后台定期归档，重复调用只启动一次"""
+    global _ARCHIVER
+    interval = interval or ARCHIVE_INTERVAL
+    if interval <= 0:
+        return None
+    if _ARCHIVER is None:
+        _ARCHIVER = threading.Thread(target=_archive_loop, args=(interval,),
+                                     name="quiz-record-archiver", daemon=True)
+        _ARCHIVER.start()
+    return _ARCHIVER
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old quiz records into monthly Parquet partitions")
+    parser.add_argument("--dir", default=None,
+                        help=f"archive directory (default: {ARCHIVE_DIR}; list: every recorded directory)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="move whole months older than the retention age")
+    run_parser.add_argument("--older-than-days", type=int, default=None,
+                            help=f"retention age in days (default: ARCHIVE_AFTER_DAYS={ARCHIVE_AFTER_DAYS})")
+    run_parser.add_argument("--dry-run", action="store_true", help="only count the records to archive")
+    sub.add_parser("list", help="show archived partitions")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for p in list_partitions(args.dir):
+            print(f"{p['month']}: {p['rows']} rows in {p['files']} file(s), {p['bytes'] / 1e6:.1f} MB")
+        return 0
+    started = time.perf_counter()
+    results = run(args.older_than_days, args.dir, args.dry_run)
+    verb = "would archive" if args.dry_run else "archived"
+    for r in results:
+        print(f"{r['month']}: {verb} {r['rows']} rows" + (f" -> {r['path']}" if r["path"] else ""))
+    total = sum(r["rows"] for r in results)
+    print(f"{verb} {total} rows from {len(results)} month(s) in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,92 +1,107 @@
-import sqlite3
+# 用户注册、登录和会话
+#
+# 教师账号（TEACHER_USERS）不能在页面上自行注册，由管理员在服务器上创建：
+#
+#   TEACHER_USERS=alice python auth.py alice     # 密码从终端输入
+import argparse
+import getpass
 import hashlib
 import os
+import sys
+import threading
 import uuid
 import time
+from collections import OrderedDict
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "users.db")
-
-
-def _get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute(
-        """CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
-        )"""
-    )
-    conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        username TEXT NOT NULL,
-        token TEXT UNIQUE NOT NULL,
-        created_at REAL NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )""")
-    conn.commit()
-    return conn
+import storage
+
+SESSION_LIFETIME = 7 * 24 * 60 * 60
+
+# 已验证 token 的内存缓存：每次 rerun 不必再查 sessions 表。
+# 条目最多缓存 SESSION_CACHE_TTL 秒，其他副本上的退出登录最迟在这段时间后生效。
+SESSION_CACHE_SIZE = 10000
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "300"))
+SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", "3600"))
+
+# 可以查看全班看板的教师账号，逗号分隔；这些用户名只能用 python auth.py 创建
+TEACHER_USERS = {u.strip() for u in os.environ.get("TEACHER_USERS", "").split(",") if u.strip()}
+
+_SESSION_CACHE = OrderedDict()  # token -> (user_id, username, created_at, cached_at)
+_CACHE_LOCK = threading.Lock()
+_SWEEPER = None
 
 
 def _hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
 
-def register(username: str, password: str) -> tuple[bool, str]:
+def register(username: str, password: str, allow_teacher: bool = False) -> tuple[bool, str]:
+    """allow_teacher 为 False 时（页面注册）拒绝 TEACHER_USERS 中的用户名"""
     if not username or not password:
         return False, "用户名和密码不能为空"
-    conn = _get_conn()
-    try:
-        conn.execute(
-            "INSERT INTO users (username, password_hash) VALUES (?, ?)",
-            (username, _hash_password(password)),
-        )
-        conn.commit()
+    if username in TEACHER_USERS and not allow_teacher:
+        return False, "该用户名不能注册，教师账号请联系管理员创建"
+    if storage.get_storage().create_user(username, _hash_password(password)):
         return True, "注册成功！请登录"
-    except sqlite3.IntegrityError:
-        return False, "用户名已存在"
-    finally:
-        conn.close()
+    return False, "用户名已存在"
 
 
-def authenticate(username: str, password: str) -> tuple[bool, str, str]:
-    """Returns (success, message, token)"""
+def authenticate(username: str, password: str) -> tuple[bool, str, str, int | None]:
+    """Returns (success, message, token, user_id)"""
     if not username or not password:
-        return False, "请输入用户名和密码", ""
-    conn = _get_conn()
-    row = conn.execute(
-        "SELECT id, password_hash FROM users WHERE username = ?", (username,)
-    ).fetchone()
-    conn.close()
+        return False, "请输入用户名和密码", "", None
+    row = storage.get_storage().get_user(username)
     if row is None:
-        return False, "用户名不存在", ""
+        return False, "用户名不存在", "", None
     if row[1] != _hash_password(password):
-        return False, "密码错误", ""
-    
+        return False, "密码错误", "", None
+
     # Create session token
     token = str(uuid.uuid4())
     user_id = row[0]
-    conn = _get_conn()
-    conn.execute(
-        "INSERT INTO sessions (user_id, username, token, created_at) VALUES (?, ?, ?, ?)",
-        (user_id, username, token, time.time())
-    )
-    conn.commit()
-    conn.close()
-    
-    return True, "登录成功", token
+    created_at = time.time()
+    storage.get_storage().create_session(user_id, username, token, created_at)
+
+    _cache_put(token, user_id, username, created_at)
+    return True, "登录成功", token, user_id
+
+
+def is_teacher(username: str) -> bool:
+    return username in TEACHER_USERS
+
+
+def _cache_put(token, user_id, username, created_at):
+    with _CACHE_LOCK:
+        _SESSION_CACHE[token] = (user_id, username, created_at, time.monotonic())
+        _SESSION_CACHE.move_to_end(token)
+        while len(_SESSION_CACHE) > SESSION_CACHE_SIZE:
+            _SESSION_CACHE.popitem(last=False)
+
+
+def _cache_get(token):
+    with _CACHE_LOCK:
+        entry = _SESSION_CACHE.get(token)
+        if entry is None:
+            return None
+        user_id, username, created_at, cached_at = entry
+        if (time.monotonic() - cached_at > SESSION_CACHE_TTL
+                or time.time() - created_at > SESSION_LIFETIME):
+            del _SESSION_CACHE[token]
+            return None
+        _SESSION_CACHE.move_to_end(token)
+        return user_id, username
 
 
 def validate_session(token: str) -> tuple[bool, int, str]:
     """Returns (is_valid, user_id, username)"""
     if not token:
         return False, 0, ""
-    conn = _get_conn()
-    row = conn.execute(
-        "SELECT user_id, username FROM sessions WHERE token = ?", (token,)
-    ).fetchone()
-    conn.close()
+    cached = _cache_get(token)
+    if cached:
+        return True, cached[0], cached[1]
+    row = storage.get_storage().get_session(token, time.time() - SESSION_LIFETIME)
     if row:
+        _cache_put(token, row[0], row[1], row[2])
         return True, row[0], row[1]
     return False, 0, ""
 
@@ -95,16 +110,58 @@ def logout(token: str):
     """Clear session"""
     if not token:
         return
-    conn = _get_conn()
-    conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
-    conn.commit()
-    conn.close()
+    with _CACHE_LOCK:
+        _SESSION_CACHE.pop(token, None)
+    storage.get_storage().delete_session(token)
 
 
 def cleanup_sessions():
     """Remove old sessions (older than 7 days)"""
-    conn = _get_conn()
-    cutoff = time.time() - (7 * 24 * 60 * 60)
-    conn.execute("DELETE FROM sessions WHERE created_at < ?", (cutoff,))
-    conn.commit()
-    conn.close()
+    cutoff = time.time() - SESSION_LIFETIME
+    deleted = storage.get_storage().delete_sessions_before(cutoff)
+    with _CACHE_LOCK:
+        for token in [t for t, e in _SESSION_CACHE.items() if e[2] < cutoff]:
+            del _SESSION_CACHE[token]
+    return deleted
+
+
+def _sweep_loop(interval):
+    while True:
+        try:
+            cleanup_sessions()
+        except Exception as e:
+            print(f"Session cleanup failed: {e}")
+        time.sleep(interval)
+
+
+def start_session_sweeper(interval=None):
+    """后台定期删除过期会话，重复调用只启动一次"""
+    global _SWEEPER
+    with _CACHE_LOCK:
+        if _SWEEPER is None:
+            _SWEEPER = threading.Thread(
+                target=_sweep_loop, args=(interval or SESSION_SWEEP_INTERVAL,),
+                name="session-sweeper", daemon=True,
+            )
+            _SWEEPER.start()
+    return _SWEEPER
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create a teacher account listed in TEACHER_USERS")
+    parser.add_argument("username")
+    args = parser.parse_args(argv)
+    if args.username not in TEACHER_USERS:
+        print(f"{args.username!r} is not in TEACHER_USERS")
+        return 1
+    password = getpass.getpass("Password: ")
+    if password != getpass.getpass("Repeat password: "):
+        print("Passwords do not match")
+        return 1
+    ok, message = register(args.username, password, allow_teacher=True)
+    print(message)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# 启动性能基准：模块导入耗时、预热各阶段耗时、首屏渲染时间
+#
+#   python bench_startup.py            # 每项在新进程中运行 3 次取中位数
+#   python bench_startup.py --runs 5
+#
+# 首屏渲染使用 streamlit.testing 的 AppTest 运行 app.py（未登录状态的登录页）。
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+IMPORTS = ["streamlit", "auth", "db", "data_loader", "ai_service", "adaptive", "warmup"]
+
+IMPORT_SNIPPET = """
+import time
+t = time.perf_counter()
+import {module}
+print(time.perf_counter() - t)
+"""
+
+WARMUP_SNIPPET = """
+import json, warmup
+print(json.dumps(warmup.warm_up()))
+"""
+
+RENDER_SNIPPET = """
+import time
+t = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("app.py", default_timeout=120)
+at.run()
+first = time.perf_counter() - t
+assert not at.exception, at.exception
+import warmup
+warmup.wait(120)
+print(first)
+"""
+
+
+def _run(snippet):
+    out = subprocess.run([sys.executable, "-c", snippet], cwd=HERE, check=True,
+                         capture_output=True, text=True).stdout
+    return out.strip().splitlines()[-1]
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:8.1f} ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app startup time")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print("Import time (cold process)")
+    for module in IMPORTS:
+        samples = [float(_run(IMPORT_SNIPPET.format(module=module))) for _ in range(args.runs)]
+        print(f"  {module:<24} {_ms(statistics.median(samples))}")
+
+    print("Warm-up stages")
+    stages = {}
+    for _ in range(args.runs):
+        for name, seconds in json.loads(_run(WARMUP_SNIPPET)).items():
+            stages.setdefault(name, []).append(seconds)
+    for name, samples in stages.items():
+        print(f"  {name:<24} {_ms(statistics.median(samples))}")
+
+    print("Time to first render")
+    try:
+        samples = [float(_run(RENDER_SNIPPET)) for _ in range(args.runs)]
+        print(f"  {'login page':<24} {_ms(statistics.median(samples))}")
+    except subprocess.CalledProcessError as e:
+        print(f"  failed: {e.stderr.strip().splitlines()[-1] if e.stderr else e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,30 @@
 import pandas as pd
 import os
 import glob
-import random
+import hashlib
+import pickle
+import threading
+import multiprocessing
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from question_store import QuestionStore, questions_from_frame, sample_ids
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "题目")
 
+# 题库快照缓存目录，可用环境变量覆盖
+CACHE_DIR = os.environ.get(
+    "QUESTION_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".question_cache")
+)
+CACHE_VERSION = 1
+
+# 题库后端：excel（默认，启动时加载全部 Excel）或 sqlite（查询 questions 表）
+QUESTION_BACKEND = os.environ.get("QUESTION_BACKEND", "excel")
+
+# 并行解析题库的进程数：1 为串行，0 表示按 CPU 数量
+LOAD_WORKERS = int(os.environ.get("QUESTION_LOAD_WORKERS", "0"))
+
 UNIT_MAPPING = {
     "force and energy": "Motion, Forces & Energy",
     "thermal effect": "Thermal Physics",
@@ -15,8 +35,22 @@ UNIT_MAPPING = {
     "space physics": "Space Physics",
 }
 
-def _load_all_questions():
-    all_questions = []
+COLUMN_MAPPING = {
+    'Unit Name': 'unit_name',
+    'Learning Objective': 'topic',
+    'Question': 'question',
+    'Option A': 'option_a',
+    'Option B': 'option_b',
+    'Option C': 'option_c',
+    'Option D': 'option_d',
+    'Answer': 'answer',
+    'Explanation': 'explanation'
+}
+
+
+def _find_workbooks():
+    """按 UNIT_MAPPING 顺序列出所有题库文件，返回 [(filepath, unit_name)]"""
+    workbooks = []
     for folder, unit_name in UNIT_MAPPING.items():
         patterns = [
             os.path.join(DATA_DIR, folder, "*.xlsx"),
@@ -26,56 +60,421 @@ def _load_all_questions():
             files = glob.glob(pattern)
             for filepath in files:
                 if "question_bank" in os.path.basename(filepath).lower():
-                    df = pd.read_excel(filepath)
-                    df = df.rename(columns={
-                        'Unit Name': 'unit_name',
-                        'Learning Objective': 'topic',
-                        'Question': 'question',
-                        'Option A': 'option_a',
-                        'Option B': 'option_b',
-                        'Option C': 'option_c',
-                        'Option D': 'option_d',
-                        'Answer': 'answer',
-                        'Explanation': 'explanation'
-                    })
-                    df['unit'] = unit_name
-                    all_questions.append(df)
+                    workbooks.append((filepath, unit_name))
                     break
-    if not all_questions:
+    return workbooks
+
+
+def _parse_workbook(filepath, unit_name):
+    """解析单个 Excel 题库"""
+    df = pd.read_excel(filepath)
+    df = df.rename(columns=COLUMN_MAPPING)
+    df['unit'] = unit_name
+    return df
+
+
+# ==================== 快照缓存 ====================
+
+def _file_hash(filepath):
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _cache_file(filepath):
+    key = hashlib.sha1(os.path.abspath(filepath).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.pkl")
+
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file, "rb") as f:
+            entry = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if not isinstance(entry, dict) or entry.get("version") != CACHE_VERSION:
+        return None
+    return entry
+
+
+def _write_cache(cache_file, entry):
+    """原子写入快照，失败时忽略（缓存只是加速手段）"""
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_file, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+
+def _cached_workbook(filepath, unit_name):
+    """查找快照：路径、大小、修改时间与内容哈希都匹配时返回 (df, None)
+
+    未命中时返回 (None, meta)，meta 用于解析完成后写入新快照。
+    """
+    st = os.stat(filepath)
+    cache_file = _cache_file(filepath)
+    entry = _read_cache(cache_file)
+    digest = None
+    if entry and entry["path"] == os.path.abspath(filepath) and entry["unit"] == unit_name:
+        if entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+            return entry["df"], None
+        # mtime 变了但内容可能没变（例如重新拷贝），用哈希确认
+        digest = _file_hash(filepath)
+        if entry["size"] == st.st_size and entry["sha256"] == digest:
+            entry["mtime"] = st.st_mtime_ns
+            _write_cache(cache_file, entry)
+            return entry["df"], None
+    if digest is None:
+        digest = _file_hash(filepath)
+    return None, {
+        "version": CACHE_VERSION,
+        "path": os.path.abspath(filepath),
+        "unit": unit_name,
+        "size": st.st_size,
+        "mtime": st.st_mtime_ns,
+        "sha256": digest,
+    }
+
+
+def _store_workbook(filepath, meta, df):
+    _write_cache(_cache_file(filepath), dict(meta, df=df))
+
+
+def _load_workbook(filepath, unit_name):
+    """读取单个题库，命中快照则不再解析 Excel"""
+    df, meta = _cached_workbook(filepath, unit_name)
+    if df is None:
+        df = _parse_workbook(filepath, unit_name)
+        _store_workbook(filepath, meta, df)
+    return df
+
+
+def clear_cache():
+    """删除所有题库快照"""
+    for cache_file in glob.glob(os.path.join(CACHE_DIR, "*.pkl")):
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+
+
+def _resolve_workers(workers):
+    if workers is None:
+        workers = LOAD_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def _parse_parallel(jobs, workers):
+    """在进程池中解析题库，结果顺序与 jobs 一致"""
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        return list(pool.map(_parse_workbook, *zip(*jobs)))
+
+
+def _load_frames(workbooks, workers=None):
+    """按 workbooks 顺序返回每个题库的 DataFrame
+
+    命中快照的题库直接读取，其余题库在 workers 个进程中并行解析；
+    workers=1 为串行，0 或 None 表示按 CPU 数量。进程池不可用时退回串行。
+    """
+    frames = [None] * len(workbooks)
+    pending = []
+    for i, (filepath, unit_name) in enumerate(workbooks):
+        df, meta = _cached_workbook(filepath, unit_name)
+        if df is None:
+            pending.append((i, meta))
+        else:
+            frames[i] = df
+
+    if pending:
+        jobs = [workbooks[i] for i, _ in pending]
+        workers = min(_resolve_workers(workers), len(jobs))
+        parsed = None
+        if workers > 1:
+            try:
+                parsed = _parse_parallel(jobs, workers)
+            except (OSError, BrokenProcessPool, pickle.PicklingError) as e:
+                print(f"Parallel loading failed, falling back to serial: {e}")
+        if parsed is None:
+            parsed = [_parse_workbook(filepath, unit_name) for filepath, unit_name in jobs]
+        for (i, meta), df in zip(pending, parsed):
+            _store_workbook(workbooks[i][0], meta, df)
+            frames[i] = df
+    return frames
+
+
+def _load_all_questions(workers=None):
+    frames = _load_frames(_find_workbooks(), workers)
+    if not frames:
         raise FileNotFoundError("未找到任何题库文件！")
-    return pd.concat(all_questions, ignore_index=True)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _build_index(store):
+    """一次性建立 unit -> topic -> 题目位置数组 的索引
+
+    topic 保持在题库中首次出现的顺序，和原来 unique() 的结果一致。
+    """
+    unit_topics = {}
+    topic_rows = {}
+    for pos in range(len(store)):
+        q = store.at(pos)
+        unit, topic = q.unit, q.topic
+        unit_topics.setdefault(unit, {}).setdefault(topic, []).append(pos)
+        topic_rows.setdefault(topic, []).append(pos)
+    return {
+        "units": sorted(unit_topics),
+        "unit_topics": {
+            unit: {t: np.asarray(rows, dtype=np.int64) for t, rows in topics.items()}
+            for unit, topics in unit_topics.items()
+        },
+        "topic_lists": {unit: list(topics) for unit, topics in unit_topics.items()},
+        "topics": {t: np.asarray(rows, dtype=np.int64) for t, rows in topic_rows.items()},
+    }
+
+
+# ==================== 题库快照与热更新 ====================
+
+# 当前题库。题目、索引和各文件状态放在同一个不可变对象里，
+# 热更新时整体替换引用，读者拿到的永远是一致的版本。
+# parts 为每个题库文件解析出的 Question 元组，和 store 共享同一批对象，不保留 DataFrame。
+Bank = namedtuple("Bank", ["version", "store", "index", "workbooks", "parts", "signatures"])
+
+_BANK = None
+_BANK_LOCK = threading.Lock()
+
+# 热更新轮询间隔（秒）
+WATCH_INTERVAL = float(os.environ.get("QUESTION_WATCH_INTERVAL", "5"))
+_WATCHER = None
+_WATCHER_STOP = threading.Event()
+_RELOAD_LISTENERS = []
+
+
+def _signature(filepath):
+    st = os.stat(filepath)
+    return st.st_size, st.st_mtime_ns
+
+
+def _build_bank(version, workbooks, parts, signatures, previous=None):
+    if not parts:
+        raise FileNotFoundError("未找到任何题库文件！")
+    # 完全相同的题目（例如两个文件夹重复收录）只保留第一份，保证 ID 唯一
+    seen = set()
+    questions = [q for part in parts for q in part if not (q.id in seen or seen.add(q.id))]
+    store = QuestionStore.from_questions(questions, previous.store if previous else None)
+    return Bank(version, store, _build_index(store), tuple(workbooks), tuple(parts), signatures)
+
+
+def _get_bank():
+    global _BANK
+    bank = _BANK
+    if bank is None:
+        with _BANK_LOCK:
+            if _BANK is None:
+                workbooks = _find_workbooks()
+                signatures = {path: _signature(path) for path, _ in workbooks}
+                parts = [tuple(questions_from_frame(df)) for df in _load_frames(workbooks)]
+                _BANK = _build_bank(1, workbooks, parts, signatures)
+            bank = _BANK
+    return bank
+
+
+def bank_loaded():
+    """题库是否已经加载到内存（不触发加载）"""
+    return _BANK is not None
+
+
+def reload_if_changed():
+    """检查 DATA_DIR 下的题库，只重新解析有变化的文件
+
+    新的题目和索引在旁边构建好之后才一次性替换 _BANK，
+    正在进行的答题和并发请求不会看到加载到一半的题库。返回是否发生了替换。
+    """
+    global _BANK
+    with _BANK_LOCK:
+        old = _BANK
+        if old is None:
+            return False
+        workbooks = _find_workbooks()
+        signatures = {path: _signature(path) for path, _ in workbooks}
+        if tuple(workbooks) == old.workbooks and signatures == old.signatures:
+            return False
+        previous = {path: part for (path, _), part in zip(old.workbooks, old.parts)}
+        parts = []
+        for filepath, unit_name in workbooks:
+            if filepath in previous and signatures[filepath] == old.signatures.get(filepath):
+                parts.append(previous[filepath])
+            else:
+                parts.append(tuple(questions_from_frame(_load_workbook(filepath, unit_name))))
+        new = _build_bank(old.version + 1, workbooks, parts, signatures, old)
+        _BANK = new
+    for callback in list(_RELOAD_LISTENERS):
+        try:
+            callback(old, new)
+        except Exception as e:
+            print(f"Reload listener {callback!r} failed: {e}")
+    return True
+
+
+def add_reload_listener(callback):
+    """注册热更新回调 callback(old_bank, new_bank)，在新题库替换完成后调用"""
+    if callback not in _RELOAD_LISTENERS:
+        _RELOAD_LISTENERS.append(callback)
+
+
+def _watch_loop(interval):
+    while not _WATCHER_STOP.wait(interval):
+        try:
+            if reload_if_changed():
+                print(f"Question bank reloaded (version {_BANK.version})")
+        except Exception as e:
+            # 文件可能正在被保存，保留旧题库，下一轮再试
+            print(f"Question bank reload failed: {e}")
+
+
+def start_watcher(interval=None):
+    """启动后台线程轮询题库变化，重复调用只会启动一次"""
+    global _WATCHER
+    with _BANK_LOCK:
+        if _WATCHER is not None and _WATCHER.is_alive():
+            return _WATCHER
+        _WATCHER_STOP.clear()
+        _WATCHER = threading.Thread(
+            target=_watch_loop, args=(interval or WATCH_INTERVAL,),
+            name="question-bank-watcher", daemon=True,
+        )
+        _WATCHER.start()
+        return _WATCHER
+
+
+def stop_watcher():
+    _WATCHER_STOP.set()
 
-_QUESTIONS_DF = None
 
 def get_questions_df():
-    global _QUESTIONS_DF
-    if _QUESTIONS_DF is None:
-        _QUESTIONS_DF = _load_all_questions()
-    return _QUESTIONS_DF
+    """整个题库的 DataFrame（含 id 列），每次调用时由题目存储生成"""
+    store = _get_bank().store
+    return pd.DataFrame([store.at(pos).to_dict() for pos in range(len(store))])
+
+
+def _sqlite_backend():
+    if QUESTION_BACKEND == "sqlite":
+        import question_db
+        return question_db
+    return None
+
+
+def _from_ai_pool(qids):
+    """题库中找不到的 ID 再到 AI 题目池（ai_pool.py）中查"""
+    import ai_pool
+    return ai_pool.get_questions(qids)
+
+
+def get_question(qid):
+    """按 ID 查询完整题目，找不到返回 None"""
+    backend = _sqlite_backend()
+    if backend:
+        q = backend.get_question(qid)
+    else:
+        q = _get_bank().store.get(qid)
+        q = q.to_dict() if q is not None else None
+    if q is None and qid:
+        found = _from_ai_pool([qid])
+        q = found[0] if found else None
+    return q
+
+
+def get_questions(qids):
+    backend = _sqlite_backend()
+    if backend:
+        questions = backend.get_questions(qids)
+    else:
+        store = _get_bank().store
+        questions = [q.to_dict() for q in map(store.get, qids) if q is not None]
+    known = {q["id"] for q in questions}
+    missing = [qid for qid in qids if qid and qid not in known]
+    if missing:
+        extra = _from_ai_pool(missing)
+        if extra:
+            by_id = {q["id"]: q for q in questions}
+            by_id.update((q["id"], q) for q in extra)
+            questions = [by_id[qid] for qid in qids if qid in by_id]
+    return questions
+
+
+def expand_answers(answers):
+    """把 session 中只含 ID 的答题记录补全题目内容，供结果页和分析报告使用"""
+    found = {q["id"]: q for q in get_questions([a.get("id") for a in answers])}
+    expanded = []
+    for a in answers:
+        record = dict(found.get(a.get("id"), {}))
+        record.update(a)
+        expanded.append(record)
+    return expanded
+
+
+def iter_questions():
+    """遍历题库中的全部题目（dict），sqlite 后端按游标流式读取"""
+    backend = _sqlite_backend()
+    if backend:
+        yield from backend.iter_questions()
+        return
+    store = _get_bank().store
+    for pos in range(len(store)):
+        yield store.at(pos).to_dict()
+
 
 def get_units():
-    df = get_questions_df()
-    return sorted(df['unit'].unique().tolist())
+    backend = _sqlite_backend()
+    if backend:
+        return backend.get_units()
+    return list(_get_bank().index["units"])
 
 def get_topics_for_unit(unit_name):
-    df = get_questions_df()
-    return df[df['unit'] == unit_name]['topic'].unique().tolist()
+    backend = _sqlite_backend()
+    if backend:
+        return backend.get_topics_for_unit(unit_name)
+    return list(_get_bank().index["topic_lists"].get(unit_name, []))
 
-def get_quiz_questions(unit_name, num=10, topic_filter=None):
-    df = get_questions_df()
+def get_quiz_question_ids(unit_name, num=10, topic_filter=None):
+    backend = _sqlite_backend()
+    if backend:
+        return backend.get_quiz_question_ids(unit_name, num, topic_filter)
+    bank = _get_bank()
+    index = bank.index
     if unit_name:
-        df = df[df['unit'] == unit_name]
-    if topic_filter:
-        df = df[df['topic'].isin(topic_filter)]
-    if len(df) < num:
-        num = len(df)
-    return df.sample(n=num, random_state=None).to_dict('records')
+        unit_maps = [index["unit_topics"].get(unit_name, {})]
+    else:
+        unit_maps = list(index["unit_topics"].values())
+    arrays = []
+    for topics in unit_maps:
+        if topic_filter:
+            arrays.extend(topics[t] for t in topic_filter if t in topics)
+        else:
+            arrays.extend(topics.values())
+    return [bank.store.ids[pos] for pos in sample_ids(arrays, num)]
+
+def get_wrong_topic_question_ids(wrong_topics, num=10):
+    backend = _sqlite_backend()
+    if backend:
+        return backend.get_wrong_topic_question_ids(wrong_topics, num)
+    bank = _get_bank()
+    topics = bank.index["topics"]
+    arrays = [topics[t] for t in dict.fromkeys(wrong_topics) if t in topics]
+    return [bank.store.ids[pos] for pos in sample_ids(arrays, num)]
+
+def get_quiz_questions(unit_name, num=10, topic_filter=None):
+    return get_questions(get_quiz_question_ids(unit_name, num, topic_filter))
 
 def get_wrong_topic_questions(wrong_topics, num=10):
-    df = get_questions_df()
-    df = df[df['topic'].isin(wrong_topics)]
-    if len(df) == 0:
-        return []
-    if len(df) < num:
-        num = len(df)
-    return df.sample(n=num, random_state=None).to_dict('records')
+    return get_questions(get_wrong_topic_question_ids(wrong_topics, num))
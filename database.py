@@ -0,0 +1,117 @@
+# SQLite 连接层：所有模块共用一个数据库路径和一个连接池
+#
+# - 连接复用，不再每次操作都 connect + CREATE TABLE + commit
+# - WAL 日志模式：读写互不阻塞；synchronous=NORMAL 在 WAL 下仍然保证数据库不损坏
+# - busy_timeout：并发写入时等待而不是立即报 database is locked
+# - 建表语句由各模块通过 register_schema 注册，每个进程只执行一次
+# - 连接使用自动提交模式，单条语句不需要 commit；多条语句用 transaction()
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = os.environ.get("IGCSE_DB_PATH", os.path.join(os.path.dirname(__file__), "users.db"))
+
+BUSY_TIMEOUT_MS = 5000
+POOL_SIZE = 8
+
+_POOL = queue.LifoQueue(maxsize=POOL_SIZE)
+_SCHEMAS = []
+_APPLIED = set()  # (db_path, schema 函数)
+_LOCK = threading.Lock()
+
+
+def register_schema(func):
+    """注册建表函数 func(conn)，可作为装饰器使用"""
+    if func not in _SCHEMAS:
+        _SCHEMAS.append(func)
+    return func
+
+
+def connect(path=None):
+    """新建一个已设置好 PRAGMA 的连接（连接池之外的长任务，例如批量导入）"""
+    conn = sqlite3.connect(path or DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000,
+                           isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def _apply_schemas(conn, path):
+    pending = [f for f in _SCHEMAS if (path, f) not in _APPLIED]
+    if not pending:
+        return
+    with _LOCK:
+        for func in pending:
+            if (path, func) in _APPLIED:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                func(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            _APPLIED.add((path, func))
+
+
+def init_schema():
+    """启动时一次性建表"""
+    with connection():
+        pass
+
+
+def _acquire():
+    while True:
+        try:
+            path, conn = _POOL.get_nowait()
+        except queue.Empty:
+            return DB_PATH, connect(DB_PATH)
+        if path == DB_PATH:
+            return path, conn
+        conn.close()
+
+
+def _release(path, conn):
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _POOL.put_nowait((path, conn))
+    except queue.Full:
+        conn.close()
+
+
+@contextmanager
+def connection():
+    """从连接池借一个连接（自动提交模式）"""
+    path, conn = _acquire()
+    try:
+        _apply_schemas(conn, path)
+        yield conn
+    finally:
+        _release(path, conn)
+
+
+@contextmanager
+def transaction():
+    """在一个事务中执行多条语句，异常时回滚"""
+    with connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def close_all():
+    while True:
+        try:
+            _, conn = _POOL.get_nowait()
+        except queue.Empty:
+            return
+        conn.close()
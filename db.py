@@ -1,56 +1,170 @@
-import sqlite3
+import json
 import os
+import threading
+import time
 from datetime import datetime
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "users.db")
-
-
-def _get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS quiz_records (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            username TEXT NOT NULL,
-            unit_name TEXT NOT NULL,
-            topic TEXT NOT NULL,
-            question_text TEXT NOT NULL,
-            user_answer TEXT,
-            correct_answer TEXT,
-            is_correct INTEGER,
-            time_spent REAL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    conn.commit()
-    return conn
-
-
-def save_quiz_record(user_id, username, unit_name, question_text, topic,
+import database
+import storage
+from question_store import answer_letter
+from write_behind import WriteBehindQueue
+
+# 答题记录写入后的回调，例如自适应选题的增量更新
+_RECORD_LISTENERS = []
+
+
+def _write_records(conn, rows):
+    storage.get_storage().insert_records(conn, rows)
+
+
+def backfill_topic_stats():
+    """一次性为已有数据库重建汇总表，返回汇总行数（包括已归档的记录）"""
+    flush_records()
+    extra = ()
+    import archive
+    if archive.has_archives():
+        extra = archive.archived_topic_stats()
+    return storage.get_storage().backfill_topic_stats(extra)
+
+
+# 答题记录先进入内存队列，攒够 RECORD_BATCH_SIZE 条或等待 RECORD_FLUSH_SECONDS 秒后批量写入。
+# RECORD_BATCH_SIZE=1 时退化为每条同步写入。队列最多 RECORD_QUEUE_MAX 条；
+# 无法写入的记录追加到 RECORD_DEAD_LETTER_PATH（JSON lines），可以人工检查后补录。
+RECORD_BATCH_SIZE = int(os.environ.get("RECORD_BATCH_SIZE", "100"))
+RECORD_FLUSH_SECONDS = float(os.environ.get("RECORD_FLUSH_SECONDS", "2"))
+RECORD_QUEUE_MAX = int(os.environ.get("RECORD_QUEUE_MAX", "10000"))
+RECORD_DEAD_LETTER_PATH = os.environ.get(
+    "RECORD_DEAD_LETTER_PATH",
+    os.path.join(os.path.dirname(database.DB_PATH), "quiz_records.failed.jsonl"))
+_DEAD_LETTER_LOCK = threading.Lock()
+
+
+def _dead_letter_records(rows, error):
+    failed_at = time.time()
+    with _DEAD_LETTER_LOCK, open(RECORD_DEAD_LETTER_PATH, "a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps({"record": list(row), "error": str(error)[:200], "failed_at": failed_at},
+                               ensure_ascii=False) + "\n")
+
+
+_RECORD_QUEUE = WriteBehindQueue(_write_records, RECORD_BATCH_SIZE, RECORD_FLUSH_SECONDS,
+                                 name="quiz-record-writer",
+                                 transaction=lambda: storage.get_storage().transaction(),
+                                 max_queue=RECORD_QUEUE_MAX, dead_letter=_dead_letter_records)
+
+
+def save_quiz_record(user_id, username, unit_name, question_id, topic,
                      user_answer, correct_answer, is_correct, time_spent):
-    conn = _get_conn()
-    conn.execute("""
-        INSERT INTO quiz_records 
-        (user_id, username, unit_name, topic, question_text, user_answer, correct_answer, is_correct, time_spent)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (user_id, username, unit_name, question_text, topic, user_answer,
-          correct_answer, 1 if is_correct else 0, time_spent))
-    conn.commit()
-    conn.close()
+    """保存一条答题记录。只保存题目 ID，题目原文按需从题库查询"""
+    now = time.time()
+    created_at = int(now)
+    _RECORD_QUEUE.put((user_id, username, unit_name, topic, question_id, user_answer,
+                       correct_answer, 1 if is_correct else 0, time_spent, created_at))
+    record = {
+        "user_id": user_id, "unit_name": unit_name, "question_id": question_id,
+        "topic": topic, "is_correct": bool(is_correct), "time_spent": time_spent,
+        "created_at": now,
+    }
+    for callback in list(_RECORD_LISTENERS):
+        try:
+            callback(record)
+        except Exception as e:
+            print(f"Record listener {callback!r} failed: {e}")
+    if RECORD_BATCH_SIZE <= 1:
+        _RECORD_QUEUE.flush()
+
+
+def flush_records():
+    """立即写入缓冲中的答题记录（答题结束、退出登录时调用）"""
+    return _RECORD_QUEUE.flush()
+
+
+def add_flush_hook(hook):
+    """hook(conn) 与答题记录在同一事务中执行"""
+    _RECORD_QUEUE.add_flush_hook(hook)
+
+
+def get_write_metrics():
+    """写入队列指标：depth（待写入条数）、flushes、flushed、dropped、dead_lettered、*_flush_ms 等"""
+    return _RECORD_QUEUE.metrics()
+
+
+def add_record_listener(callback):
+    """注册回调 callback(record)，每条答题记录写入后调用"""
+    if callback not in _RECORD_LISTENERS:
+        _RECORD_LISTENERS.append(callback)
+
+
+def get_user_topic_history(user_id):
+    """按知识点汇总某个用户的答题历史
+
+    返回 [(topic, attempts, wrong, total_time, last_seen_epoch)]
+    """
+    return storage.get_storage().get_user_topic_history(user_id)
 
 
 def get_user_stats(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.execute("""
-        SELECT 
-            COUNT(*) as total,
-            SUM(is_correct) as correct,
-            unit_name,
-            topic
-        FROM quiz_records
-        WHERE user_id = ?
-        GROUP BY unit_name, topic
-    """, (user_id,))
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    """返回 [(total, correct, unit_name, topic)]，直接读汇总表，与历史记录条数无关"""
+    return storage.get_storage().get_user_stats(user_id)
+
+
+def load_seen_bits(user_id):
+    """返回 {unit_name: bytes}，每个单元一个按题目整数 id 索引的位图"""
+    return storage.get_storage().load_seen_bits(user_id)
+
+
+def save_seen_bits_many(conn, items):
+    """items: [(user_id, unit_name, bits)]，在调用方的事务中执行"""
+    storage.get_storage().save_seen_bits_many(conn, items)
+
+
+def get_last_seen(user_id, unit_name, include_archived=False):
+    """用户在某单元做过的题目及最近一次作答时间，最久未见的在前
+
+    默认只查热表；include_archived=True 时合并 archive.py 归档的记录。
+    """
+    rows = storage.get_storage().get_last_seen(user_id, unit_name)
+    if not include_archived:
+        return rows
+    import archive
+    last_seen = archive.archived_last_seen(user_id, unit_name)
+    for qid, ts in rows:
+        if ts > last_seen.get(qid, 0):
+            last_seen[qid] = ts
+    return sorted(last_seen.items(), key=lambda item: item[1])
+
+
+def get_user_history(user_id, unit_name=None, since=None, until=None, include_archived=False):
+    """某个用户的答题明细，按时间先后排列
+
+    每行为 dict，键见 storage.EXPORT_COLUMNS（user_answer 为字母，created_at 为 unix 秒）。
+    include_archived=True 时包括 archive.py 归档的记录。
+    """
+    flush_records()
+    rows = []
+    if include_archived:
+        import archive
+        rows.extend(archive.iter_archived_rows(since, until, unit_name, user_id))
+    for batch in storage.get_storage().iter_quiz_records(since=since, until=until, unit=unit_name,
+                                                         user_id=user_id):
+        rows.extend(batch)
+    rows.sort(key=lambda r: (r[-1], r[0]))
+    history = []
+    for r in rows:
+        record = dict(zip(storage.EXPORT_COLUMNS, r))
+        record["user_answer"] = answer_letter(record["user_answer"])
+        history.append(record)
+    return history
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Quiz record maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill-stats", help="rebuild user_topic_stats from quiz_records")
+    args = parser.parse_args()
+    if args.command == "backfill-stats":
+        started = time.perf_counter()
+        rows = backfill_topic_stats()
+        print(f"user_topic_stats rebuilt: {rows} rows in {time.perf_counter() - started:.2f}s")
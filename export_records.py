@@ -0,0 +1,219 @@
+# 导出答题记录供数据分析：按块流式写入压缩的列式文件（Parquet 或 Arrow IPC）
+#
+#   python export_records.py out.parquet                              # 全量导出
+#   python export_records.py out.arrow --format arrow --unit Waves
+#   python export_records.py out.parquet --since 2025-09-01 --until 2025-10-01 --user 3
+#   python export_records.py exports/ --incremental                   # 只导出上次之后的新记录
+#   python export_records.py all.parquet --include-archived            # 连同 archive.py 归档的记录
+#
+# 每次只从数据库取 chunk_rows 行（按 id 分页），转换成一个 RecordBatch 写出后即丢弃，
+# 内存占用与表大小无关。增量导出的水位线（已导出的最大 id）保存在输出目录的 export_state.json。
+# 需要安装 pyarrow：pip install pyarrow
+import argparse
+import calendar
+import json
+import os
+import sys
+import time
+
+import storage
+from question_store import answer_letter
+
+CHUNK_ROWS = 50000
+COMPRESSION = "zstd"
+STATE_FILE = "export_state.json"
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.int64()),
+        ("user_id", pa.int64()),
+        ("username", pa.string()),
+        ("unit", pa.string()),
+        ("topic", pa.string()),
+        ("question_id", pa.string()),
+        ("user_answer", pa.string()),
+        ("correct_answer", pa.string()),
+        ("is_correct", pa.bool_()),
+        ("time_spent", pa.float64()),
+        ("created_at", pa.timestamp("s", tz="UTC")),
+    ])
+
+
+def _to_batch(rows, schema):
+    import pyarrow as pa
+    (ids, user_ids, usernames, units, topics, qids, answers,
+     correct, is_correct, time_spent, created_at) = zip(*rows)
+    columns = [ids, user_ids, usernames, units, topics, qids,
+               [answer_letter(a) for a in answers], correct,
+               [bool(c) for c in is_correct], time_spent, created_at]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema)
+
+
+class _Writer:
+    def __init__(self, path, fmt, schema, compression):
+        import pyarrow as pa
+        self._sink = None
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, schema, compression=compression)
+        else:
+            self._sink = pa.OSFile(path, "wb")
+            self._writer = pa.ipc.new_file(
+                self._sink, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    def write(self, batch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+
+
+def export_records(path, fmt="parquet", since=None, until=None, unit=None, user_id=None,
+                   after_id=0, chunk_rows=CHUNK_ROWS, compression=COMPRESSION, max_id=None,
+                   include_archived=False):
+    """把符合条件的记录流式写入 path，返回 {"path", "rows", "first_id", "last_id"}
+
+    since / until 为 unix 秒（左闭右开）；只导出 after_id < id <= max_id 的记录。
+    include_archived 为 True 时先写出已归档的记录（它们的 id 都小于热表中的记录）。
+    先写临时文件，完成后再替换为 path。
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError("导出需要 pyarrow：pip install pyarrow") from e
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {sorted(FORMATS)}")
+    schema = _schema()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    writer = _Writer(tmp, fmt, schema, compression)
+    rows_written, first_id, last_id = 0, None, after_id
+    try:
+        if include_archived:
+            import archive
+            for batch in archive.iter_archived_batches(since, until, unit, user_id, after_id=after_id,
+                                                       batch_size=chunk_rows):
+                writer.write(batch.cast(schema))
+                rows_written += batch.num_rows
+                ids = batch.column("id")
+                first_id = ids[0].as_py() if first_id is None else first_id
+                last_id = ids[-1].as_py()
+        for rows in storage.get_storage().iter_quiz_records(after_id, since, until, unit, user_id,
+                                                            batch_size=chunk_rows, max_id=max_id):
+            writer.write(_to_batch(rows, schema))
+            rows_written += len(rows)
+            first_id = rows[0][0] if first_id is None else first_id
+            last_id = rows[-1][0]
+        writer.close()
+        os.replace(tmp, path)
+    except BaseException:
+        writer.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return {"path": path, "rows": rows_written, "first_id": first_id, "last_id": last_id}
+
+
+def _state_key(fmt, unit, user_id):
+    return f"format={fmt};unit={unit or ''};user={'' if user_id is None else user_id}"
+
+
+def _read_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def export_incremental(out_dir, fmt="parquet", unit=None, user_id=None, chunk_rows=CHUNK_ROWS,
+                       compression=COMPRESSION):
+    """导出上次水位线之后的新记录到 out_dir 下的一个新文件
+
+    同一个输出目录可以保存多组筛选条件（格式、单元、用户）各自的水位线。
+    没有新记录时不生成文件，返回结果中 path 为 None。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    state = _read_state(out_dir)
+    key = _state_key(fmt, unit, user_id)
+    after_id = state.get(key, {}).get("last_id", 0)
+    # PostgreSQL 上并发事务的 id 不一定按提交顺序出现，水位线不越过可能还没提交的记录
+    max_id = storage.get_storage().settled_record_id(after_id)
+    tmp_name = os.path.join(out_dir, f"quiz_records-{after_id + 1}-pending{FORMATS[fmt]}")
+    result = export_records(tmp_name, fmt, unit=unit, user_id=user_id, after_id=after_id,
+                            chunk_rows=chunk_rows, compression=compression,
+                            max_id=max_id)
+    if not result["rows"]:
+        os.remove(tmp_name)
+        result["path"] = None
+        return result
+    path = os.path.join(out_dir, f"quiz_records-{result['first_id']}-{result['last_id']}{FORMATS[fmt]}")
+    os.replace(tmp_name, path)
+    result["path"] = path
+    state[key] = {"last_id": result["last_id"], "exported_at": time.time(),
+                  "file": os.path.basename(path)}
+    _write_state(out_dir, state)
+    return result
+
+
+def _parse_date(value):
+    """YYYY-MM-DD（UTC）-> unix 秒"""
+    return calendar.timegm(time.strptime(value, "%Y-%m-%d"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export quiz records to Parquet / Arrow IPC")
+    parser.add_argument("output", help="output file, or a directory with --incremental")
+    parser.add_argument("--format", choices=sorted(FORMATS), default=None,
+                        help="default: from the output file extension, else parquet")
+    parser.add_argument("--since", type=_parse_date, help="YYYY-MM-DD (UTC, inclusive)")
+    parser.add_argument("--until", type=_parse_date, help="YYYY-MM-DD (UTC, exclusive)")
+    parser.add_argument("--unit")
+    parser.add_argument("--user", type=int, dest="user_id")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only export records newer than the last export to this directory")
+    parser.add_argument("--include-archived", action="store_true",
+                        help="also export records moved out by archive.py")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--compression", default=COMPRESSION)
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if fmt is None:
+        ext = os.path.splitext(args.output)[1]
+        fmt = next((name for name, e in FORMATS.items() if e == ext), "parquet")
+    started = time.perf_counter()
+    if args.incremental:
+        if args.since or args.until or args.include_archived:
+            parser.error("--since/--until/--include-archived cannot be combined with --incremental")
+        result = export_incremental(args.output, fmt, args.unit, args.user_id,
+                                    args.chunk_rows, args.compression)
+    else:
+        result = export_records(args.output, fmt, args.since, args.until, args.unit, args.user_id,
+                                chunk_rows=args.chunk_rows, compression=args.compression,
+                                include_archived=args.include_archived)
+    elapsed = time.perf_counter() - started
+    if result["path"] is None:
+        print("no new records")
+    else:
+        size = os.path.getsize(result["path"])
+        print(f"{result['rows']} rows (id {result['first_id']}..{result['last_id']}) -> "
+              f"{result['path']} ({size / 1e6:.1f} MB) in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+# 把 Excel 题库流式导入 SQLite 的 questions 表
+#
+#   python import_questions.py                      # 导入 题目/ 下所有题库
+#   python import_questions.py bank.xlsx --unit Waves
+#
+# 使用 openpyxl 只读模式逐行读取，内存占用与题库大小无关；
+# 按内容哈希 upsert，重复导入同一个文件不会产生重复题目。
+import argparse
+import os
+import sys
+import time
+
+import openpyxl
+from openpyxl.utils.exceptions import InvalidFileException
+
+import database
+import question_db
+from question_store import Question
+
+REQUIRED_COLUMNS = ("Learning Objective", "Question", "Option A", "Option B",
+                    "Option C", "Option D", "Answer")
+OPTIONAL_COLUMNS = ("Explanation",)
+VALID_ANSWERS = {"A", "B", "C", "D"}
+
+UPSERT_SQL = """
+    INSERT INTO questions
+    (content_hash, unit, topic, question, option_a, option_b, option_c, option_d,
+     answer, explanation, source, source_file, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(content_hash) DO UPDATE SET
+        explanation = excluded.explanation,
+        source_file = excluded.source_file,
+        updated_at = excluded.updated_at
+"""
+
+
+class InvalidWorkbook(Exception):
+    pass
+
+
+def _header_positions(header):
+    names = [str(h).strip() if h is not None else "" for h in header]
+    missing = [c for c in REQUIRED_COLUMNS if c not in names]
+    if missing:
+        raise InvalidWorkbook(f"缺少必需的列: {', '.join(missing)}")
+    return {c: names.index(c) for c in REQUIRED_COLUMNS + OPTIONAL_COLUMNS if c in names}
+
+
+def iter_questions(filepath, unit_name, errors):
+    """逐行读取工作簿，产出通过校验的 Question；不合格的行记录到 errors"""
+    wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            raise InvalidWorkbook("工作表为空")
+        pos = _header_positions(header)
+        for line_no, row in enumerate(rows, start=2):
+            if not any(v is not None and str(v).strip() for v in row):
+                continue
+            get = lambda c: row[pos[c]] if c in pos and pos[c] < len(row) else None
+            q = Question(unit_name, get("Learning Objective"), get("Question"),
+                         get("Option A"), get("Option B"), get("Option C"),
+                         get("Option D"), get("Answer"), get("Explanation"))
+            if q.answer not in VALID_ANSWERS:
+                errors.append((line_no, f"答案必须是 A-D，实际为 {q.answer!r}"))
+            elif not q.question or not q.topic:
+                errors.append((line_no, "题目或知识点为空"))
+            else:
+                yield q
+    finally:
+        wb.close()
+
+
+def import_workbook(conn, filepath, unit_name, batch_size=1000):
+    """导入单个工作簿，返回 (导入条数, 错误列表, 用时秒)"""
+    started = time.perf_counter()
+    errors = []
+    imported = 0
+    batch = []
+    source_file = os.path.abspath(filepath)
+
+    def flush():
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(UPSERT_SQL, batch)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        batch.clear()
+
+    for q in iter_questions(filepath, unit_name, errors):
+        batch.append((q.id, q.unit, q.topic, q.question, q.option_a, q.option_b,
+                      q.option_c, q.option_d, q.answer, q.explanation, q.source,
+                      source_file, time.time()))
+        imported += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return imported, errors, time.perf_counter() - started
+
+
+def _default_workbooks():
+    import data_loader
+    return data_loader._find_workbooks()
+
+
+def _unit_for_path(filepath):
+    import data_loader
+    folder = os.path.basename(os.path.dirname(os.path.abspath(filepath)))
+    return data_loader.UNIT_MAPPING.get(folder)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import question bank workbooks into SQLite")
+    parser.add_argument("files", nargs="*", help="workbooks to import (default: every question bank under 题目/)")
+    parser.add_argument("--unit", help="unit name for the given files (default: from the folder name)")
+    parser.add_argument("--db", default=database.DB_PATH, help="SQLite database path")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.files:
+        workbooks = []
+        for filepath in args.files:
+            unit_name = args.unit or _unit_for_path(filepath)
+            if not unit_name:
+                parser.error(f"cannot infer unit for {filepath}, pass --unit")
+            workbooks.append((filepath, unit_name))
+    else:
+        workbooks = _default_workbooks()
+
+    conn = database.connect(args.db)
+    question_db.ensure_schema(conn)
+    total_rows, total_time, failed = 0, 0.0, False
+    for filepath, unit_name in workbooks:
+        try:
+            imported, errors, elapsed = import_workbook(conn, filepath, unit_name, args.batch_size)
+        except (InvalidWorkbook, InvalidFileException, OSError) as e:
+            print(f"✗ {filepath}: {e}")
+            failed = True
+            continue
+        total_rows += imported
+        total_time += elapsed
+        rate = imported / elapsed if elapsed > 0 else 0
+        print(f"✓ {filepath} [{unit_name}]: {imported} rows in {elapsed:.2f}s ({rate:.0f} rows/s), "
+              f"{len(errors)} rejected")
+        for line_no, reason in errors[:20]:
+            print(f"    row {line_no}: {reason}")
+        if len(errors) > 20:
+            print(f"    ... {len(errors) - 20} more")
+    conn.close()
+    rate = total_rows / total_time if total_time > 0 else 0
+    print(f"Total: {total_rows} rows in {total_time:.2f}s ({rate:.0f} rows/s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
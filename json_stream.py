@@ -0,0 +1,127 @@
+# 从逐块到达的模型回复中增量取出 JSON 对象
+#
+# 模型返回的题目可能是 [...]、{"questions": [...]}，也可能包在 ```json 代码块里、前后带说明文字。
+# 这里不解析整个回复，而是跟踪括号和字符串：题目列表里的对象（题目本身，连同其中嵌套的 options 等）
+# 一结束就单独 json.loads，所以第一道题生成完就能使用，某一道格式错误也只丢弃这一道。
+# 最外层的数组是题目列表；对象里的数组按键名判断，"questions" 这类是题目列表（外层对象只是包装），
+# "options" 之类属于对象本身，这时整个最外层对象算一道题。每个字符只扫描一次。
+import json
+
+# 未结束的对象的角色
+ITEM, TOP, WRAPPER, INNER = "item", "top", "wrapper", "inner"
+# 键名（小写）包含这些词的数组是题目列表，但先排除选项、答案一类的字段
+LIST_KEYS = ("question", "item", "quiz", "data", "result", "mcq")
+FIELD_KEYS = ("option", "choice", "answer")
+
+
+def _is_list_key(key):
+    key = key.lower()
+    return not any(word in key for word in FIELD_KEYS) and any(word in key for word in LIST_KEYS)
+
+
+class ObjectStream:
+    """feed(chunk) 返回这一块文本中完成的 JSON 对象（dict）列表
+
+    取出的是题目列表中最外层的对象；回复中没有题目列表时取出最外层对象本身，
+    {"questions": [...]} 这样的包装对象不会再整体取出，{"question": ..., "options": [{...}]} 整体取出。
+    parsed / malformed 为已取出的对象数和无法解析（或到 close() 时仍未结束）而丢弃的对象数。
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._stack = []  # 未结束的 { / [：[括号, 起始下标, 角色]，数组的角色为是否题目列表
+        self._in_item = False
+        self._in_string = False
+        self._string_start = 0
+        self._key = ""  # 对象中最近一个字符串，遇到 [ 时就是它的键名
+        self._escape = False
+        self.parsed = 0
+        self.malformed = 0
+
+    def feed(self, chunk):
+        text = self._text + chunk
+        stack = self._stack
+        completed = []
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if stack[-1][0] == "{" and not self._in_item:
+                        self._key = text[self._string_start + 1:i]
+            elif c == "{":
+                if not stack:
+                    role = TOP
+                elif stack[-1][0] == "[" and stack[-1][2] and not self._in_item:
+                    role = ITEM
+                    self._in_item = True
+                    if stack[0][2] == TOP:
+                        stack[0][2] = WRAPPER
+                else:
+                    role = INNER
+                stack.append(["{", i, role])
+            elif c == "[":
+                if not stack or stack[-1][0] == "[":
+                    listing = not self._in_item
+                else:
+                    listing = not self._in_item and _is_list_key(self._key)
+                stack.append(["[", i, listing])
+            elif c == "]":
+                if stack and stack[-1][0] == "[":
+                    stack.pop()
+            elif c == "}":
+                # 不匹配的 ] 缺失时一并弹出，对象本身交给 json.loads 判断
+                while stack:
+                    bracket, start, role = stack.pop()
+                    if bracket == "{":
+                        if role == ITEM:
+                            self._in_item = False
+                        if role in (ITEM, TOP):
+                            completed.append(text[start:i + 1])
+                        break
+            elif c == '"' and stack:
+                # 对象外面的引号属于说明文字，不当作字符串
+                self._in_string = True
+                self._string_start = i
+        # 只保留还可能取出的对象（以及可能是键名的未结束字符串）的文本
+        base = min((entry[1] for entry in stack if entry[2] in (ITEM, TOP)), default=len(text))
+        if self._in_string:
+            base = min(base, self._string_start)
+            self._string_start -= base
+        for entry in stack:
+            entry[1] -= base
+        self._text = text[base:]
+        self._pos = len(self._text)
+        return [obj for obj in map(self._load, completed) if obj is not None]
+
+    def close(self):
+        """回复结束时调用：还没结束的题目对象（回复被截断）计入 malformed"""
+        self.malformed += sum(1 for entry in self._stack if entry[2] in (ITEM, TOP))
+        self._stack = []
+        self._in_item = False
+        self._in_string = self._escape = False
+        self._key = ""
+        self._text = ""
+        self._pos = 0
+
+    def _load(self, raw):
+        try:
+            obj = json.loads(raw)
+        except ValueError:
+            self.malformed += 1
+            return None
+        self.parsed += 1
+        return obj
+
+
+def iter_objects(chunks):
+    """逐块读取文本，依次产出其中完成的 JSON 对象"""
+    stream = ObjectStream()
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    stream.close()
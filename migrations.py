@@ -0,0 +1,419 @@
+# 数据库版本迁移：PRAGMA user_version 记录当前版本，按顺序执行尚未执行的迁移
+#
+# 应用启动时（database 的 schema 钩子）会在一个事务里把数据库升级到最新版本。这时持有数据库锁，
+# 迁移只使用内存中已经加载的 Excel 题库（warmup 先加载题库再打开数据库），不在锁内解析 Excel；
+# 题库还没加载时，只有题干的旧记录保留为 source='legacy' 的题目，不与题库中的题目关联。
+# 数据量大时建议先停掉应用，离线执行：
+#
+#   python migrations.py                  # 升级到最新版本，分批提交并打印进度，最后 VACUUM
+#   python migrations.py --status
+#   python migrations.py --db other.db --batch-size 20000
+#
+# 离线执行时每批单独提交，中断后重新运行会从上次的位置继续。
+import argparse
+import calendar
+import os
+import sys
+import time
+
+import database
+import question_db
+from question_store import answer_code, question_id
+
+BATCH_SIZE = 5000
+
+MIGRATIONS = []  # [(version, name, func(conn, run))]
+
+
+def migration(version, name):
+    def decorator(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+class _Run:
+    """迁移执行上下文：离线执行时 checkpoint() 提交当前批次并报告进度"""
+
+    def __init__(self, conn, batch_size, progress, own_transactions):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.progress = progress
+        self.own_transactions = own_transactions
+
+    def checkpoint(self, message):
+        if self.own_transactions:
+            self.conn.execute("COMMIT")
+            self.conn.execute("BEGIN IMMEDIATE")
+        if self.progress:
+            self.progress(message)
+
+
+def migrate(conn, batch_size=BATCH_SIZE, progress=None):
+    """把数据库升级到最新版本，返回执行过的迁移版本号
+
+    conn 已经在事务中时（启动时的 schema 钩子）所有迁移都在这个事务里完成；
+    否则每个迁移、每个批次各自提交。
+    """
+    own = not conn.in_transaction
+    applied = []
+    for version, name, func in MIGRATIONS:
+        if version <= current_version(conn):
+            continue
+        if progress:
+            progress(f"migration {version}: {name}")
+        if own:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            func(conn, _Run(conn, batch_size, progress, own))
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            if own:
+                conn.execute("COMMIT")
+        except BaseException:
+            if own:
+                conn.execute("ROLLBACK")
+            raise
+        applied.append(version)
+    return applied
+
+
+@database.register_schema
+def _ensure_schema(conn):
+    migrate(conn)
+
+
+# 旧版本的 save_quiz_record 把 topic 和 question_text 两列写反了，
+# 这些行没有 question_id，知识点实际保存在 question_text 列
+LEGACY_TOPIC_SQL = "CASE WHEN question_id IS NULL THEN question_text ELSE topic END"
+
+
+@migration(1, "baseline")
+def _baseline(conn, run):
+    """版本号出现之前的表结构，已有数据库上重复执行无副作用"""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        )"""
+    )
+    conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        token TEXT UNIQUE NOT NULL,
+        created_at REAL NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions (created_at)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS quiz_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            unit_name TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            question_text TEXT NOT NULL,
+            question_id TEXT,
+            user_answer TEXT,
+            correct_answer TEXT,
+            is_correct INTEGER,
+            time_spent REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS seen_questions (
+            user_id INTEGER NOT NULL,
+            unit_name TEXT NOT NULL,
+            bits BLOB NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (user_id, unit_name)
+        )
+    """)
+    # 旧数据库没有 question_id 列
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(quiz_records)")]
+    if "question_id" not in columns:
+        conn.execute("ALTER TABLE quiz_records ADD COLUMN question_id TEXT")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_quiz_records_user
+        ON quiz_records (user_id, unit_name, question_id, created_at)
+    """)
+    # 每个用户每个知识点的汇总，随答题记录在同一事务中增量更新
+    stats_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_topic_stats'"
+    ).fetchone()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_topic_stats (
+            user_id INTEGER NOT NULL,
+            unit_name TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            total_time REAL NOT NULL DEFAULT 0,
+            last_seen TIMESTAMP,
+            PRIMARY KEY (user_id, unit_name, topic)
+        )
+    """)
+    if not stats_exists:
+        conn.execute(f"""
+            INSERT INTO user_topic_stats (user_id, unit_name, topic, attempts, correct, total_time, last_seen)
+            SELECT user_id, unit_name, {LEGACY_TOPIC_SQL} AS real_topic, COUNT(*),
+                   COALESCE(SUM(is_correct), 0), COALESCE(SUM(time_spent), 0), MAX(created_at)
+            FROM quiz_records
+            GROUP BY user_id, unit_name, real_topic
+        """)
+
+
+def _epoch(value):
+    """'YYYY-MM-DD HH:MM:SS'（UTC）转为 unix 秒"""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return calendar.timegm(time.strptime(str(value)[:19], "%Y-%m-%d %H:%M:%S"))
+    except ValueError:
+        return 0
+
+
+class _QuestionResolver:
+    """把旧记录里的题目（内容哈希或题干原文）解析为 questions.id
+
+    题库里已经没有的题目登记为占位行，历史记录不会丢失：
+    - 有内容哈希的记录：source='missing'，之后题库重新登记这道题时补齐内容
+    - 只有题干的旧记录：source='legacy'，保留题干、知识点和正确答案
+    """
+
+    def __init__(self, conn, load_bank=True):
+        self.conn = conn
+        self.load_bank = load_bank
+        self.by_hash = {}
+        self.by_text = None
+        self.bank_registered = False
+
+    def _lookup(self, content_hash):
+        row = self.conn.execute(
+            "SELECT id FROM questions WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _ensure_bank(self):
+        if not self.bank_registered:
+            _register_bank(self.conn, self.load_bank)
+            self.bank_registered = True
+
+    def _placeholder(self, content_hash, unit, topic, text, answer, source):
+        self.conn.execute("""
+            INSERT INTO questions (content_hash, unit, topic, question, option_a, option_b,
+                                   option_c, option_d, answer, source, updated_at)
+            VALUES (?, ?, ?, ?, '', '', '', '', ?, ?, ?)
+            ON CONFLICT(content_hash) DO NOTHING
+        """, (content_hash, unit, topic, text, answer or "", source, time.time()))
+        return self._lookup(content_hash)
+
+    def from_hash(self, content_hash, unit, topic, answer):
+        qid = self.by_hash.get(content_hash)
+        if qid is None:
+            qid = self._lookup(content_hash)
+            if qid is None and not self.bank_registered:
+                self._ensure_bank()
+                qid = self._lookup(content_hash)
+            if qid is None:
+                qid = self._placeholder(content_hash, unit, topic, "", answer, "missing")
+            self.by_hash[content_hash] = qid
+        return qid
+
+    def _load_texts(self):
+        self._ensure_bank()
+        self.by_text = {}
+        for unit, topic, text, qid in self.conn.execute(
+                "SELECT unit, topic, question, MIN(id) FROM questions GROUP BY unit, topic, question"):
+            self.by_text[(unit, topic, text)] = qid
+
+    def from_text(self, unit, topic, text, answer):
+        if self.by_text is None:
+            self._load_texts()
+        qid = self.by_text.get((unit, topic, text))
+        if qid is None:
+            content_hash = question_id(unit, topic, text, "", "", "", "", answer)
+            qid = self.by_hash.get(content_hash)
+            if qid is None:
+                qid = self._placeholder(content_hash, unit, topic, text, answer, "legacy")
+                self.by_hash[content_hash] = qid
+            self.by_text[(unit, topic, text)] = qid
+        return qid
+
+
+def _register_bank(conn, load=True):
+    """把当前 Excel 题库登记到 questions 表，旧记录才能按哈希或题干匹配到题目
+
+    load 为 False 时只使用内存中已经加载的题库，不解析 Excel。
+    """
+    try:
+        import data_loader
+        if data_loader.QUESTION_BACKEND == "sqlite":
+            return
+        if not load and not data_loader.bank_loaded():
+            print("Question bank not loaded yet, legacy rows without a question id kept as text")
+            return
+        question_db.register_questions(conn, data_loader.iter_questions())
+    except Exception as e:
+        print(f"Could not register question bank, unmatched legacy rows kept as text: {e}")
+
+
+@migration(2, "normalize quiz_records")
+def _normalize_quiz_records(conn, run):
+    """quiz_records 只保留整数外键和编码后的答案
+
+    - question_id：questions.id（单元、知识点、题干、正确答案都从 questions 表关联）
+    - user_answer：A-D 编码为 0-3
+    - created_at：unix 秒
+    username / unit_name / topic / question_text / correct_answer 不再逐行保存。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS quiz_records_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL REFERENCES questions(id),
+            user_answer INTEGER,
+            is_correct INTEGER NOT NULL,
+            time_spent REAL,
+            created_at INTEGER NOT NULL
+        )
+    """)
+    # 启动时的 schema 钩子持有数据库锁和写事务，不在这里解析 Excel 题库
+    resolver = _QuestionResolver(conn, load_bank=run.own_transactions)
+    last = conn.execute("SELECT COALESCE(MAX(id), 0) FROM quiz_records_v2").fetchone()[0]
+    total = conn.execute("SELECT COUNT(*) FROM quiz_records WHERE id > ?", (last,)).fetchone()[0]
+    done = 0
+    started = time.perf_counter()
+    while True:
+        rows = conn.execute("""
+            SELECT id, user_id, unit_name, topic, question_text, question_id,
+                   user_answer, correct_answer, is_correct, time_spent, created_at
+            FROM quiz_records WHERE id > ? ORDER BY id LIMIT ?
+        """, (last, run.batch_size)).fetchall()
+        if not rows:
+            break
+        converted = []
+        for (rid, user_id, unit, topic, question_text, content_hash,
+             user_answer, correct_answer, is_correct, time_spent, created_at) in rows:
+            if content_hash:
+                qid = resolver.from_hash(content_hash, unit, topic, correct_answer)
+            else:
+                # 旧行：topic 列是题干，question_text 列是知识点
+                qid = resolver.from_text(unit, question_text, topic, correct_answer)
+            converted.append((rid, user_id, qid, answer_code(user_answer),
+                              1 if is_correct else 0, time_spent, _epoch(created_at)))
+        conn.executemany("""
+            INSERT INTO quiz_records_v2 (id, user_id, question_id, user_answer, is_correct, time_spent, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, converted)
+        last = rows[-1][0]
+        done += len(rows)
+        rate = done / max(time.perf_counter() - started, 1e-9)
+        run.checkpoint(f"  quiz_records {done}/{total} rows ({rate:,.0f} rows/s)")
+    conn.execute("DROP TABLE quiz_records")
+    conn.execute("ALTER TABLE quiz_records_v2 RENAME TO quiz_records")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_quiz_records_user
+        ON quiz_records (user_id, question_id, created_at)
+    """)
+    # 汇总表的最近作答时间也改为 unix 秒
+    conn.execute("""
+        UPDATE user_topic_stats SET last_seen = CAST(strftime('%s', last_seen) AS INTEGER)
+        WHERE typeof(last_seen) = 'text'
+    """)
+
+
+@migration(3, "class rollup tables")
+def _rollup_tables(conn, run):
+    """教师看板用的全班汇总，由 rollups.py 按 quiz_records.id 水位线增量更新"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS topic_rollup (
+            unit TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            total_time REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (unit, topic)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS question_rollup (
+            question_id INTEGER PRIMARY KEY,
+            unit TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            total_time REAL NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS hardest_questions (
+            unit TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            attempts INTEGER NOT NULL,
+            correct INTEGER NOT NULL,
+            total_time REAL NOT NULL,
+            PRIMARY KEY (unit, rank)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            refreshed_at REAL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO rollup_state (name, last_id) VALUES ('quiz_records', 0)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upgrade the database schema")
+    parser.add_argument("--db", default=database.DB_PATH, help="SQLite database path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--status", action="store_true", help="print the schema version and exit")
+    parser.add_argument("--no-vacuum", action="store_true", help="skip VACUUM after migrating")
+    args = parser.parse_args(argv)
+
+    conn = database.connect(args.db)
+    try:
+        version = current_version(conn)
+        if args.status:
+            print(f"schema version {version}, latest {latest_version()}")
+            return 0
+        # questions 表由 question_db 维护，迁移需要它先存在
+        conn.execute("BEGIN IMMEDIATE")
+        question_db.ensure_schema(conn)
+        conn.execute("COMMIT")
+        size_before = os.path.getsize(args.db)
+        started = time.perf_counter()
+        applied = migrate(conn, args.batch_size, progress=print)
+        if not applied:
+            print(f"already at version {version}")
+            return 0
+        if not args.no_vacuum:
+            print("VACUUM ...")
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size_after = os.path.getsize(args.db)
+        print(f"migrated {version} -> {current_version(conn)} in {time.perf_counter() - started:.1f}s, "
+              f"{size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# SQLite 题库后端：题目由 import_questions.py 导入 users.db 的 questions 表，
+# 查询走索引，不需要把整个题库读进内存。设置 QUESTION_BACKEND=sqlite 启用。
+import threading
+import time
+
+import database
+from question_store import sample_ids
+
+QUESTION_COLUMNS = ("unit", "topic", "question", "option_a", "option_b",
+                    "option_c", "option_d", "answer", "explanation", "source")
+
+
+@database.register_schema
+def ensure_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content_hash TEXT UNIQUE NOT NULL,
+            unit TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            question TEXT NOT NULL,
+            option_a TEXT NOT NULL,
+            option_b TEXT NOT NULL,
+            option_c TEXT NOT NULL,
+            option_d TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            explanation TEXT,
+            source TEXT NOT NULL DEFAULT 'bank',
+            source_file TEXT,
+            updated_at REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_unit_topic ON questions (unit, topic)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_topic ON questions (topic)")
+
+
+def register_questions(conn, questions):
+    """把题目登记到 questions 表，使每道题都有稳定的整数 id
+
+    已存在的跳过；答题记录写入时为未知题目生成的占位行（source='missing'）用完整内容补齐。
+    """
+    conn.executemany(f"""
+        INSERT INTO questions (content_hash, {', '.join(QUESTION_COLUMNS)}, updated_at)
+        VALUES ({', '.join('?' * (len(QUESTION_COLUMNS) + 2))})
+        ON CONFLICT(content_hash) DO UPDATE SET
+            {', '.join(f'{c} = excluded.{c}' for c in QUESTION_COLUMNS)},
+            updated_at = excluded.updated_at
+        WHERE questions.source = 'missing'
+    """, ((q["id"], *(q.get(c) or "" for c in QUESTION_COLUMNS), time.time()) for q in questions))
+    invalidate_index()
+
+
+def load_ordinals(conn, hashes=None):
+    """content_hash -> questions.id；hashes 不为 None 时只查这些题目"""
+    if hashes is None:
+        return dict(conn.execute("SELECT content_hash, id FROM questions"))
+    hashes = list(hashes)
+    ordinals = {}
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i + 500]
+        ordinals.update(conn.execute(
+            f"SELECT content_hash, id FROM questions WHERE content_hash IN ({', '.join('?' * len(chunk))})",
+            chunk))
+    return ordinals
+
+
+def _row_to_dict(row):
+    d = dict(zip(QUESTION_COLUMNS, row[1:]))
+    d["id"] = row[0]
+    return d
+
+
+_SELECT = f"SELECT content_hash, {', '.join(QUESTION_COLUMNS)} FROM questions"
+
+# 答题记录迁移时登记的旧题目 / 占位行只用于关联历史记录，不参与出题；
+# AI 生成的题目（ai_pool.py）只用于错题补充练习
+PLAYABLE = "source NOT IN ('missing', 'legacy', 'ai')"
+
+
+def get_units():
+    with database.connection() as conn:
+        rows = conn.execute(f"SELECT DISTINCT unit FROM questions WHERE {PLAYABLE} ORDER BY unit").fetchall()
+    return [r[0] for r in rows]
+
+
+def get_topics_for_unit(unit_name):
+    """按题目导入顺序返回知识点，与 Excel 后端一致"""
+    with database.connection() as conn:
+        rows = conn.execute(
+            f"SELECT topic FROM questions WHERE unit = ? AND {PLAYABLE} GROUP BY topic ORDER BY MIN(id)",
+            (unit_name,)
+        ).fetchall()
+    return [r[0] for r in rows]
+
+
+# questions 表的内存分组索引：(unit, topic) -> [content_hash]。MAX(id) 变化（导入了新题）、
+# 本进程登记题目或超过 INDEX_MAX_AGE 秒时重建，出题时在内存中抽样（question_store.sample_ids），
+# 不必每次 ORDER BY RANDOM() 扫描并排序所有匹配的行。
+INDEX_MAX_AGE = 60
+_INDEXES = []
+
+
+class QuestionIndex:
+    """符合 where 条件的题目按 (unit, topic) 分组的 content_hash 列表
+
+    get(query) 的 query(sql, params) 执行一条只读查询（? 占位符）并返回全部行，
+    SQLite 题库用 database 连接，AI 题目池用 storage 后端。
+    """
+
+    def __init__(self, where, params=()):
+        self._where = where
+        self._params = tuple(params)
+        self._index = None  # (max_id, built_at, groups)
+        self._lock = threading.Lock()
+        _INDEXES.append(self)
+
+    def invalidate(self):
+        self._index = None
+
+    def _fresh(self, index, max_id):
+        return index is not None and index[0] == max_id and time.monotonic() - index[1] < INDEX_MAX_AGE
+
+    def get(self, query):
+        max_id = query("SELECT MAX(id) FROM questions", ())[0][0]
+        index = self._index
+        if self._fresh(index, max_id):
+            return index[2]
+        with self._lock:
+            index = self._index
+            if self._fresh(index, max_id):
+                return index[2]
+            groups = {}
+            for unit, topic, qid in query(
+                    f"SELECT unit, topic, content_hash FROM questions WHERE {self._where} ORDER BY id",
+                    self._params):
+                groups.setdefault((unit, topic), []).append(qid)
+            self._index = (max_id, time.monotonic(), groups)
+        return groups
+
+
+def invalidate_index():
+    """登记了新题目后调用，所有 QuestionIndex 下次使用时重建"""
+    for index in _INDEXES:
+        index.invalidate()
+
+
+_PLAYABLE_INDEX = QuestionIndex(PLAYABLE)
+
+
+def _query(sql, params):
+    with database.connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def _playable_index():
+    return _PLAYABLE_INDEX.get(_query)
+
+
+def get_quiz_question_ids(unit_name, num=10, topic_filter=None):
+    topics = set(topic_filter) if topic_filter else None
+    lists = [ids for (unit, topic), ids in _playable_index().items()
+             if (not unit_name or unit == unit_name) and (topics is None or topic in topics)]
+    return sample_ids(lists, num)
+
+
+def get_wrong_topic_question_ids(wrong_topics, num=10):
+    topics = set(wrong_topics)
+    if not topics:
+        return []
+    return sample_ids([ids for (_, topic), ids in _playable_index().items() if topic in topics], num)
+
+
+def get_questions(qids):
+    """按 ID 批量查询，保持传入顺序"""
+    qids = [q for q in qids if q]
+    if not qids:
+        return []
+    found = {}
+    unique = list(dict.fromkeys(qids))
+    with database.connection() as conn:
+        for i in range(0, len(unique), 500):
+            chunk = unique[i:i + 500]
+            rows = conn.execute(
+                f"{_SELECT} WHERE content_hash IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((r[0], _row_to_dict(r)) for r in rows)
+    return [found[q] for q in qids if q in found]
+
+
+def iter_questions(batch_size=1000):
+    with database.connection() as conn:
+        cursor = conn.execute(f"{_SELECT} WHERE {PLAYABLE} ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for r in rows:
+                yield _row_to_dict(r)
+
+
+def get_question(qid):
+    questions = get_questions([qid])
+    return questions[0] if questions else None
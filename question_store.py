@@ -0,0 +1,176 @@
+import bisect
+import hashlib
+import itertools
+import math
+import os
+import random
+import sys
+import time
+
+QUESTION_FIELDS = ("unit", "topic", "question", "option_a", "option_b",
+                   "option_c", "option_d", "answer", "explanation")
+
+
+def _text(value):
+    """Excel 单元格转字符串，空值为 ""（选项可能是数字）"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value).strip()
+
+
+def question_id(unit, topic, question, option_a, option_b, option_c, option_d, answer):
+    """由题目内容计算稳定 ID，题库重新加载或调整行顺序后不变"""
+    key = "\x1f".join(_text(v) for v in (unit, topic, question, option_a,
+                                         option_b, option_c, option_d, answer))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+ANSWER_LETTERS = "ABCD"
+
+# 热更新后旧版本的题目保留这么久（秒），与登录 session 的有效期一致
+RETIRED_TTL = float(os.environ.get("QUESTION_RETIRED_TTL", str(7 * 86400)))
+
+
+def answer_code(letter):
+    """答案字母 A-D 编码为 0-3，未作答或无法识别时为 None"""
+    letter = _text(letter).upper()
+    return ANSWER_LETTERS.index(letter) if len(letter) == 1 and letter in ANSWER_LETTERS else None
+
+
+def answer_letter(code):
+    return ANSWER_LETTERS[code] if code is not None else ""
+
+
+class Question:
+    """单道题目，只读。unit / topic 使用 intern 字符串，相同单元共享同一对象"""
+    __slots__ = ("id", "source") + QUESTION_FIELDS
+
+    def __init__(self, unit, topic, question, option_a, option_b, option_c,
+                 option_d, answer, explanation, source="bank"):
+        unit, topic = sys.intern(_text(unit)), sys.intern(_text(topic))
+        question = _text(question)
+        options = [_text(o) for o in (option_a, option_b, option_c, option_d)]
+        answer = _text(answer).upper()
+        self.id = question_id(unit, topic, question, *options, answer)
+        self.source = sys.intern(source)
+        self.unit = unit
+        self.topic = topic
+        self.question = question
+        self.option_a, self.option_b, self.option_c, self.option_d = options
+        self.answer = answer
+        self.explanation = _text(explanation)
+
+    def to_dict(self):
+        d = {field: getattr(self, field) for field in QUESTION_FIELDS}
+        d["id"] = self.id
+        d["source"] = self.source
+        return d
+
+
+MAX_QUESTION_CHARS = 1000
+MAX_OPTION_CHARS = 300
+_OPTIONS = ("option_a", "option_b", "option_c", "option_d")
+
+
+def _resolve_topic(value, topics):
+    """把模型写的知识点对应到请求的知识点之一（模型常只写编号或截短的名称）"""
+    if len(topics) == 1:
+        return topics[0]
+    value = _text(value)
+    if value in topics:
+        return value
+    if value:
+        for topic in topics:
+            if topic.startswith(value) or value.startswith(topic):
+                return topic
+    return None
+
+
+def validate_question(item, unit, topics, source="ai"):
+    """校验一道生成的题目，合格时返回题目 dict（含 id、source），否则返回 None
+
+    要求题干和四个互不相同的选项都不为空、长度在限制以内，答案可以写成 "B"、"b"、"B)"。
+    topics 为请求时的知识点列表，题目的知识点必须能对应到其中之一。
+    """
+    if not isinstance(item, dict):
+        return None
+    values = {}
+    for field in ("question",) + _OPTIONS:
+        value = item.get(field)
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)) or not _text(value):
+            return None
+        values[field] = _text(value)
+    options = [values[o] for o in _OPTIONS]
+    if len(values["question"]) > MAX_QUESTION_CHARS or any(len(o) > MAX_OPTION_CHARS for o in options):
+        return None
+    if len({o.casefold() for o in options}) < len(options):
+        return None
+    answer = _text(item.get("answer")).upper().rstrip(").:")
+    if len(answer) != 1 or answer not in ANSWER_LETTERS:
+        return None
+    topic = _resolve_topic(item.get("topic"), list(topics))
+    if topic is None:
+        return None
+    explanation = item.get("explanation")
+    return Question(unit, topic, values["question"], *options, answer,
+                    explanation if isinstance(explanation, str) else "", source=source).to_dict()
+
+
+def sample_ids(lists, num):
+    """从若干 ID 列表中无放回地随机抽取 num 个（各列表合起来等概率），耗时与 num 成正比"""
+    offsets = list(itertools.accumulate(len(items) for items in lists))
+    total = offsets[-1] if offsets else 0
+    picked = []
+    for k in random.sample(range(total), min(num, total)):
+        i = bisect.bisect_right(offsets, k)
+        picked.append(lists[i][k - (offsets[i - 1] if i else 0)])
+    return picked
+
+
+def questions_from_frame(df):
+    """DataFrame 的每一行转换为 Question"""
+    columns = [df[c] if c in df.columns else [None] * len(df) for c in QUESTION_FIELDS]
+    return [Question(*values) for values in zip(*columns)]
+
+
+class QuestionStore:
+    """只读题目存储：ids[pos] 为第 pos 道题的 ID
+
+    热更新时旧版本中被删除或修改的题目保存在 retired 里（qid -> (删除时间, Question)），
+    正在答题的 session 仍然可以按 ID 查到原题；超过 RETIRED_TTL 秒的条目在下次热更新时清理。
+    """
+
+    def __init__(self, questions, retired=None):
+        self._questions = tuple(questions)
+        self._by_id = {q.id: q for q in self._questions}
+        self.ids = tuple(q.id for q in self._questions)
+        self._retired = retired or {}
+
+    @classmethod
+    def from_questions(cls, questions, previous=None):
+        questions = list(questions)
+        retired = {}
+        if previous is not None:
+            now = time.time()
+            cutoff = now - RETIRED_TTL
+            retired = {qid: entry for qid, entry in previous._retired.items() if entry[0] >= cutoff}
+            retired.update((qid, (now, q)) for qid, q in previous._by_id.items())
+            for q in questions:
+                retired.pop(q.id, None)
+        return cls(questions, retired)
+
+    def __len__(self):
+        return len(self._questions)
+
+    def __contains__(self, qid):
+        return qid in self._by_id or qid in self._retired
+
+    def at(self, pos):
+        return self._questions[pos]
+
+    def get(self, qid):
+        q = self._by_id.get(qid)
+        if q is None:
+            entry = self._retired.get(qid)
+            q = entry[1] if entry is not None else None
+        return q
@@ -0,0 +1,180 @@
+# 教师看板的全班汇总：按知识点的正确率 / 平均用时，以及每个单元最难的题目
+#
+# 看板不直接在 quiz_records 上做聚合。后台线程按 quiz_records.id 水位线把新增记录
+# 增量累加到汇总表（topic_rollup / question_rollup），页面只读汇总表，读取量与知识点数成正比。
+# 每次处理最多 ROLLUP_BATCH 条记录，水位线与汇总在同一事务中更新；
+# 多个副本同时刷新时，用水位线的比较并更新保证同一段记录只累加一次。
+import os
+import threading
+import time
+
+import storage
+
+ROLLUP_REFRESH_INTERVAL = float(os.environ.get("ROLLUP_REFRESH_INTERVAL", "60"))
+ROLLUP_BATCH = 50000
+HARDEST_PER_UNIT = 10
+HARDEST_MIN_ATTEMPTS = 5
+
+_STATE = "quiz_records"
+_LOCK = threading.Lock()
+_REFRESHER = None
+
+
+def _upper_bound(tx, st, last_id):
+    """本批处理到哪个 id 为止（含），没有新记录时返回 last_id"""
+    row = tx.execute(st.sql("""
+        SELECT MAX(id) FROM (SELECT id FROM quiz_records WHERE id > ? ORDER BY id LIMIT ?) batch
+    """), (last_id, ROLLUP_BATCH)).fetchone()
+    upper = row[0] if row and row[0] is not None else last_id
+    if upper > last_id and not st.COMMIT_ORDERED_IDS:
+        # 不越过可能还有更小的 id 未提交的新记录
+        upper = st.settled_record_id(last_id, upper, tx)
+    return upper
+
+
+def _refresh_step(st):
+    """处理一批新记录，返回处理的记录条数"""
+    now = time.time()
+    with st.transaction() as tx:
+        last_id = tx.execute(st.sql("SELECT last_id FROM rollup_state WHERE name = ?"),
+                             (_STATE,)).fetchone()[0]
+        upper = _upper_bound(tx, st, last_id)
+        # 先更新水位线：另一个副本已经处理过这一段时 rowcount 为 0
+        claimed = tx.execute(st.sql("""
+            UPDATE rollup_state SET last_id = ?, refreshed_at = ? WHERE name = ? AND last_id = ?
+        """), (upper, now, _STATE, last_id)).rowcount
+        if not claimed or upper <= last_id:
+            return 0
+        rows = tx.execute(st.sql("""
+            SELECT r.question_id, q.unit, q.topic, COUNT(*),
+                   COALESCE(SUM(r.is_correct), 0), COALESCE(SUM(r.time_spent), 0)
+            FROM quiz_records r JOIN questions q ON q.id = r.question_id
+            WHERE r.id > ? AND r.id <= ?
+            GROUP BY r.question_id, q.unit, q.topic
+        """), (last_id, upper)).fetchall()
+        topics = {}
+        for _, unit, topic, attempts, correct, total_time in rows:
+            t = topics.setdefault((unit, topic), [0, 0, 0.0])
+            t[0] += attempts
+            t[1] += correct
+            t[2] += total_time
+        cur = tx.cursor()
+        cur.executemany(st.sql("""
+            INSERT INTO question_rollup (question_id, unit, attempts, correct, total_time)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (question_id) DO UPDATE SET
+                attempts = question_rollup.attempts + excluded.attempts,
+                correct = question_rollup.correct + excluded.correct,
+                total_time = question_rollup.total_time + excluded.total_time
+        """), [(qid, unit, attempts, correct, total_time)
+               for qid, unit, _, attempts, correct, total_time in rows])
+        cur.executemany(st.sql("""
+            INSERT INTO topic_rollup (unit, topic, attempts, correct, total_time)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (unit, topic) DO UPDATE SET
+                attempts = topic_rollup.attempts + excluded.attempts,
+                correct = topic_rollup.correct + excluded.correct,
+                total_time = topic_rollup.total_time + excluded.total_time
+        """), [(*key, *value) for key, value in topics.items()])
+        return sum(r[3] for r in rows)
+
+
+def _rebuild_hardest(st):
+    """从 question_rollup 重新选出每个单元正确率最低的题目（后台执行，O(题目数)）"""
+    with st.transaction() as tx:
+        tx.execute("DELETE FROM hardest_questions")
+        tx.execute(st.sql("""
+            INSERT INTO hardest_questions (unit, rank, question_id, attempts, correct, total_time)
+            SELECT unit, rank, question_id, attempts, correct, total_time FROM (
+                SELECT unit, question_id, attempts, correct, total_time,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY unit
+                           ORDER BY CAST(correct AS REAL) / attempts, attempts DESC, question_id
+                       ) AS rank
+                FROM question_rollup
+                WHERE attempts >= ?
+            ) ranked
+            WHERE rank <= ?
+        """), (HARDEST_MIN_ATTEMPTS, HARDEST_PER_UNIT))
+
+
+def refresh(max_batches=None):
+    """把新增记录累加进汇总表，返回本次处理的记录条数"""
+    st = storage.get_storage()
+    total = 0
+    with _LOCK:
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            applied = _refresh_step(st)
+            if not applied:
+                break
+            total += applied
+            batches += 1
+        if total:
+            _rebuild_hardest(st)
+    return total
+
+
+def get_topic_rollup(unit=None):
+    """[(unit, topic, attempts, correct, total_time)]"""
+    if unit:
+        return storage.get_storage().query("""
+            SELECT unit, topic, attempts, correct, total_time FROM topic_rollup
+            WHERE unit = ? ORDER BY topic
+        """, (unit,))
+    return storage.get_storage().query("""
+        SELECT unit, topic, attempts, correct, total_time FROM topic_rollup ORDER BY unit, topic
+    """)
+
+
+def get_hardest_questions(unit=None, limit=HARDEST_PER_UNIT):
+    """正确率最低的题目，不指定单元时从各单元的前几名中合并"""
+    sql = """
+        SELECT h.unit, q.topic, q.question, q.answer, h.attempts, h.correct, h.total_time
+        FROM hardest_questions h JOIN questions q ON q.id = h.question_id
+    """
+    if unit:
+        rows = storage.get_storage().query(sql + " WHERE h.unit = ? ORDER BY h.rank", (unit,))
+    else:
+        rows = storage.get_storage().query(sql)
+        rows.sort(key=lambda r: (r[5] / r[4], -r[4]))
+    return [
+        {"unit": r[0], "topic": r[1], "question": r[2], "answer": r[3], "attempts": r[4],
+         "accuracy": r[5] / r[4], "avg_time": r[6] / r[4]}
+        for r in rows[:limit]
+    ]
+
+
+def get_freshness():
+    """看板数据的新鲜度
+
+    refreshed_at：上次刷新的 unix 秒（从未刷新为 None）；last_id：已汇总到的记录 id；
+    pending：尚未汇总的记录数（按 id 估算）
+    """
+    st = storage.get_storage()
+    last_id, refreshed_at = st.query(
+        "SELECT last_id, refreshed_at FROM rollup_state WHERE name = ?", (_STATE,))[0]
+    max_id = st.max_record_id()
+    return {"refreshed_at": refreshed_at, "last_id": last_id, "pending": max(max_id - last_id, 0)}
+
+
+def _refresh_loop(interval):
+    while True:
+        try:
+            refresh()
+        except Exception as e:
+            print(f"Rollup refresh failed: {e}")
+        time.sleep(interval)
+
+
+def start_refresher(interval=None):
+    """后台定期刷新汇总表，重复调用只启动一次"""
+    global _REFRESHER
+    with _LOCK:
+        if _REFRESHER is None:
+            _REFRESHER = threading.Thread(
+                target=_refresh_loop, args=(interval or ROLLUP_REFRESH_INTERVAL,),
+                name="rollup-refresher", daemon=True,
+            )
+            _REFRESHER.start()
+    return _REFRESHER
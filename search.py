@@ -0,0 +1,164 @@
+# 题目全文搜索：用 SQLite FTS5 对题干、选项、解析和知识点建立倒排索引
+#
+# 索引放在内存数据库中，第一次搜索时由 data_loader 当前题库构建；
+# 题库热更新后只增删发生变化的题目，不整体重建。
+import re
+import sqlite3
+import threading
+
+import data_loader
+
+# 列权重：知识点和题干命中比选项、解析更重要
+_WEIGHTS = {"topic": 4.0, "question": 3.0, "options": 1.0, "explanation": 1.0}
+
+_CONN = None
+_VERSION = None
+_LOCK = threading.Lock()
+# 构建索引和热更新时的增量修改都持有 _BUILD_LOCK，互相串行，不会装上过期的索引
+_BUILD_LOCK = threading.Lock()
+
+_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def _connect():
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("""
+        CREATE VIRTUAL TABLE questions_fts USING fts5(
+            qid UNINDEXED,
+            unit UNINDEXED,
+            topic,
+            question,
+            options,
+            explanation,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    return conn
+
+
+def _row(q):
+    options = "\n".join(q.get(k, "") for k in ("option_a", "option_b", "option_c", "option_d"))
+    return (q["id"], q.get("unit", ""), q.get("topic", ""), q.get("question", ""),
+            options, q.get("explanation", ""))
+
+
+def _insert(conn, questions):
+    conn.executemany(
+        "INSERT INTO questions_fts (qid, unit, topic, question, options, explanation) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (_row(q) for q in questions)
+    )
+
+
+def rebuild():
+    """从当前题库完整重建索引（sqlite 题库后端导入新题后需手动调用）"""
+    with _BUILD_LOCK:
+        _build()
+
+
+def _ensure_index():
+    if _CONN is None:
+        with _BUILD_LOCK:
+            if _CONN is None:
+                _build()
+
+
+def _build():
+    """调用方持有 _BUILD_LOCK"""
+    global _CONN, _VERSION
+    if data_loader.QUESTION_BACKEND == "sqlite":
+        version, questions = None, data_loader.iter_questions()
+    else:
+        bank = data_loader._get_bank()
+        version = bank.version
+        questions = (bank.store.at(pos).to_dict() for pos in range(len(bank.store)))
+    conn = _connect()
+    with conn:
+        _insert(conn, questions)
+    with _LOCK:
+        old_conn, _CONN, _VERSION = _CONN, conn, version
+    if old_conn is not None:
+        old_conn.close()
+
+
+def _on_reload(old, new):
+    """题库热更新：按题目 ID 做差集，只删除/插入变化的题目"""
+    global _VERSION
+    with _BUILD_LOCK:
+        if _CONN is None or _VERSION == new.version:
+            return
+        if _VERSION != old.version:
+            # 索引落后不止一个版本，直接重建
+            _build()
+            return
+        old_ids = set(old.store.ids)
+        removed = old_ids.difference(new.store.ids)
+        added = [new.store.get(qid).to_dict() for qid in new.store.ids if qid not in old_ids]
+        with _LOCK:
+            with _CONN:
+                _CONN.executemany("DELETE FROM questions_fts WHERE qid = ?",
+                                  ((qid,) for qid in removed))
+                _insert(_CONN, added)
+            _VERSION = new.version
+
+
+data_loader.add_reload_listener(_on_reload)
+
+
+def _to_match(query):
+    """把用户输入转换成 FTS5 查询
+
+    - 普通词：所有词都要出现（AND）
+    - 词尾带 *：前缀匹配，如 radioact*
+    - 双引号：短语匹配，如 "specific heat capacity"
+    """
+    terms = []
+    for phrase, word in _TOKEN_RE.findall(query):
+        if phrase:
+            text = phrase.strip()
+            if text:
+                terms.append('"' + text.replace('"', '') + '"')
+            continue
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '')
+        if not word:
+            continue
+        terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " AND ".join(terms)
+
+
+def search_questions(query, unit=None, limit=20):
+    """搜索题目，按相关度（bm25）排序
+
+    返回题目 dict 列表，额外包含 score（越小越相关）和 snippet（命中片段）。
+    """
+    match = _to_match(query or "")
+    if not match:
+        return []
+    _ensure_index()
+    weights = ", ".join(str(w) for w in (0, 0) + tuple(_WEIGHTS.values()))
+    sql = f"""
+        SELECT qid, bm25(questions_fts, {weights}) AS score,
+               snippet(questions_fts, -1, '**', '**', '…', 12)
+        FROM questions_fts
+        WHERE questions_fts MATCH ?
+    """
+    params = [match]
+    if unit:
+        sql += " AND unit = ?"
+        params.append(unit)
+    sql += " ORDER BY score LIMIT ?"
+    params.append(limit)
+    with _LOCK:
+        try:
+            rows = _CONN.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"Search query failed ({match!r}): {e}")
+            return []
+    questions = {q["id"]: q for q in data_loader.get_questions([r[0] for r in rows])}
+    results = []
+    for qid, score, snippet in rows:
+        if qid in questions:
+            results.append(dict(questions[qid], score=score, snippet=snippet))
+    return results
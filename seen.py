@@ -0,0 +1,176 @@
+# 记录每个用户在每个单元已经做过的题目，出题时优先选没做过的
+#
+# 每道题在 questions 表中有一个稳定的整数 id，已做过的题目保存为以该 id 为下标的位图
+# （10 万道题约 12KB），判断和更新都是 O(1)。位图存放在 users.db 的 seen_questions 表，
+# 答题记录写入时通过 db 的回调同步更新。
+import threading
+from collections import OrderedDict
+
+import data_loader
+import db
+import storage
+
+MAX_CACHED_USERS = 5000
+
+
+class SeenSet:
+    """按整数 id 索引的位图"""
+    __slots__ = ("bits",)
+
+    def __init__(self, data=b""):
+        self.bits = bytearray(data)
+
+    def __contains__(self, ordinal):
+        byte = ordinal >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (ordinal & 7)))
+
+    def add(self, ordinal):
+        byte = ordinal >> 3
+        if byte >= len(self.bits):
+            # 按倍数扩容，避免每道新题都重新分配
+            self.bits.extend(bytes(max(byte + 1 - len(self.bits), len(self.bits))))
+        self.bits[byte] |= 1 << (ordinal & 7)
+
+    def __len__(self):
+        return sum(bin(b).count("1") for b in self.bits)
+
+
+_ORDINALS = {}
+_ORDINALS_VERSION = None
+_USERS = OrderedDict()
+_DIRTY = {}  # (user_id, unit_name) -> SeenSet，随答题记录批量写入
+_LOCK = threading.Lock()
+# 登记题目要等数据库写锁，不能持有 _LOCK：写入线程在事务中调用 _flush_dirty 时需要 _LOCK
+_ORDINALS_LOCK = threading.Lock()
+
+
+def _ensure_ordinals(bank=None):
+    """保证当前题库中的每道题都在 questions 表里有整数 id
+
+    第一次调用（启动预热时）读入全部已登记的 id；之后题库更新时只登记新出现的题目。
+    """
+    global _ORDINALS, _ORDINALS_VERSION
+    if data_loader.QUESTION_BACKEND == "sqlite":
+        version = "sqlite"
+    else:
+        bank = bank or data_loader._get_bank()
+        version = bank.version
+    if _ORDINALS_VERSION == version:
+        return _ORDINALS
+    with _ORDINALS_LOCK:
+        if _ORDINALS_VERSION != version:
+            st = storage.get_storage()
+            ordinals = _ORDINALS if _ORDINALS_VERSION is not None else st.load_question_ids()
+            if version != "sqlite":
+                store = bank.store
+                missing = [store.get(qid).to_dict() for qid in store.ids if qid not in ordinals]
+                if missing:
+                    ordinals = dict(ordinals)
+                    ordinals.update(st.register_questions(missing))
+            _ORDINALS = ordinals
+            _ORDINALS_VERSION = version
+    return _ORDINALS
+
+
+def _on_reload(old, new):
+    """题库热更新后在监视线程里登记新题目，不留给用户请求"""
+    if _ORDINALS_VERSION is not None:
+        _ensure_ordinals(new)
+
+
+def ordinal(qid):
+    ordinals = _ensure_ordinals()
+    return ordinals.get(qid)
+
+
+def _get_user(user_id):
+    with _LOCK:
+        units = _USERS.get(user_id)
+        if units is not None:
+            _USERS.move_to_end(user_id)
+            return units
+    loaded = {unit: SeenSet(bits) for unit, bits in db.load_seen_bits(user_id).items()}
+    with _LOCK:
+        units = _USERS.setdefault(user_id, loaded)
+        _USERS.move_to_end(user_id)
+        while len(_USERS) > MAX_CACHED_USERS:
+            _USERS.popitem(last=False)
+    return units
+
+
+def is_seen(user_id, unit_name, qid):
+    seen = _get_user(user_id).get(unit_name)
+    if seen is None:
+        return False
+    n = ordinal(qid)
+    return n is not None and n in seen
+
+
+def unseen_filter(user_id):
+    """返回判断函数 f(unit_name, qid) -> 是否没做过，供批量选题时使用"""
+    units = _get_user(user_id)
+    ordinals = _ensure_ordinals()
+
+    def unseen(unit_name, qid):
+        seen = units.get(unit_name)
+        if seen is None:
+            return True
+        n = ordinals.get(qid)
+        return n is None or n not in seen
+    return unseen
+
+
+def mark_seen(user_id, unit_name, qid):
+    n = ordinal(qid)
+    if n is None:
+        return
+    units = _get_user(user_id)
+    with _LOCK:
+        seen = units.setdefault(unit_name, SeenSet())
+        if n in seen:
+            return
+        seen.add(n)
+        _DIRTY[(user_id, unit_name)] = seen
+
+
+def _flush_dirty(conn):
+    """答题记录批量写入时，在同一事务中保存变化过的位图"""
+    with _LOCK:
+        if not _DIRTY:
+            return
+        dirty = [(user_id, unit, bytes(s.bits)) for (user_id, unit), s in _DIRTY.items()]
+        _DIRTY.clear()
+    try:
+        db.save_seen_bits_many(conn, dirty)
+    except Exception:
+        with _LOCK:
+            for user_id, unit, _ in dirty:
+                units = _USERS.get(user_id)
+                if units and unit in units:
+                    _DIRTY.setdefault((user_id, unit), units[unit])
+        raise
+
+
+def least_recently_seen(user_id, unit_name, candidates, num):
+    """从 candidates 中挑出最久没做过的 num 道题（用于没做过的题不够时补齐）"""
+    if num <= 0:
+        return []
+    candidates = set(candidates)
+    picked = []
+    for qid, _ in db.get_last_seen(user_id, unit_name):
+        if qid in candidates:
+            picked.append(qid)
+            candidates.discard(qid)
+            if len(picked) >= num:
+                break
+    return picked
+
+
+def _on_record(record):
+    if record.get("question_id"):
+        mark_seen(record["user_id"], record["unit_name"], record["question_id"])
+
+
+db.add_record_listener(_on_record)
+data_loader.add_reload_listener(_on_reload)
+db.add_flush_hook(_flush_dirty)
@@ -0,0 +1,694 @@
+# 存储后端：用户、会话、答题记录、汇总统计的读写接口
+#
+# auth.py / db.py / seen.py 只通过 get_storage() 访问数据，不直接写 SQL。
+# - SQLiteStorage：默认实现，使用 database.py 的连接池（单机部署）
+# - PostgresStorage：设置 DATABASE_URL=postgresql://... 启用，多个副本共用一个数据库。
+#   需要额外安装 psycopg 和 psycopg_pool：pip install -r requirements-postgres.txt
+#
+# transaction() 返回的对象只传回给同一个后端的方法（insert_records、save_seen_bits_many），
+# 调用方不关心它是 sqlite3 连接还是 psycopg 连接。
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+import database
+import migrations  # noqa: F401  注册 SQLite 表结构迁移
+import question_db
+from question_store import answer_code
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+PG_POOL_MIN = int(os.environ.get("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.environ.get("PG_POOL_MAX", "10"))
+# 记录 id 不按提交顺序出现的后端上，水位线只推进到插入超过这么久的记录
+RECORD_SETTLE_SECONDS = 60
+
+_STORAGE = None
+_LOCK = threading.Lock()
+
+
+def merge_topic_stats(rows):
+    """把一批答题记录按 (用户, 单元, 知识点) 合并，返回汇总表 upsert 的参数"""
+    stats = {}
+    for user_id, _, unit_name, topic, _, _, _, is_correct, time_spent, created_at in rows:
+        s = stats.setdefault((user_id, unit_name, topic), [0, 0, 0.0, created_at])
+        s[0] += 1
+        s[1] += is_correct
+        s[2] += time_spent or 0.0
+        s[3] = max(s[3], created_at)
+    return [(*key, *value) for key, value in stats.items()]
+
+
+def _placeholder_params(rows):
+    """每个题目哈希一行：(content_hash, unit, topic, answer, updated_at)"""
+    now = time.time()
+    return list({row[4]: (row[4], row[2], row[3], row[6] or "", now) for row in rows}.values())
+
+
+def _record_params(rows):
+    """quiz_records 插入参数，题目按哈希在 SQL 里换成 questions.id"""
+    return [(user_id, answer_code(user_answer), is_correct, time_spent, created_at, question_hash)
+            for user_id, _, _, _, question_hash, user_answer, _, is_correct, time_spent, created_at in rows]
+
+
+# 由答题记录全量重建汇总表；单元和知识点来自 questions 表
+_BACKFILL_SQL = """
+    INSERT INTO user_topic_stats (user_id, unit_name, topic, attempts, correct, total_time, last_seen)
+    SELECT r.user_id, q.unit, q.topic, COUNT(*),
+           COALESCE(SUM(r.is_correct), 0), COALESCE(SUM(r.time_spent), 0), MAX(r.created_at)
+    FROM quiz_records r JOIN questions q ON q.id = r.question_id
+    GROUP BY r.user_id, q.unit, q.topic
+"""
+
+
+# 导出用的答题记录明细，按 id 递增分页（keyset），每页一次独立的短查询
+EXPORT_COLUMNS = ("id", "user_id", "username", "unit", "topic", "question_id",
+                  "user_answer", "correct_answer", "is_correct", "time_spent", "created_at")
+
+
+def _export_query(param, after_id, since, until, unit, user_id, limit, max_id=None):
+    clauses, params = [f"r.id > {param}"], [after_id]
+    if max_id is not None:
+        clauses.append(f"r.id <= {param}")
+        params.append(max_id)
+    if since is not None:
+        clauses.append(f"r.created_at >= {param}")
+        params.append(since)
+    if until is not None:
+        clauses.append(f"r.created_at < {param}")
+        params.append(until)
+    if unit:
+        clauses.append(f"q.unit = {param}")
+        params.append(unit)
+    if user_id is not None:
+        clauses.append(f"r.user_id = {param}")
+        params.append(user_id)
+    params.append(limit)
+    return f"""
+        SELECT r.id, r.user_id, u.username, q.unit, q.topic, q.content_hash,
+               r.user_answer, q.answer, r.is_correct, r.time_spent, r.created_at
+        FROM quiz_records r
+        JOIN questions q ON q.id = r.question_id
+        LEFT JOIN users u ON u.id = r.user_id
+        WHERE {' AND '.join(clauses)}
+        ORDER BY r.id
+        LIMIT {param}
+    """, params
+
+
+class Storage(ABC):
+    """存储接口。答题记录行的格式为
+    (user_id, username, unit_name, topic, question_id, user_answer, correct_answer,
+     is_correct, time_spent, created_at)，question_id 是题目内容哈希，created_at 是 unix 秒。
+    quiz_records 表里只保存 questions.id、用户 id 和编码后的答案，其余字段由 questions 表关联得到。
+    """
+
+    # quiz_records.id 是否按提交顺序递增；否则按 id 增量处理时要给未提交的事务留余量
+    COMMIT_ORDERED_IDS = True
+    # COMMIT_ORDERED_IDS 为 False 的后端用来排除可能还有未提交的更小 id 的记录，参数为秒数
+    _SETTLED_FILTER = ""
+
+    @abstractmethod
+    def transaction(self):
+        """返回事务上下文：正常退出时提交，异常时回滚"""
+
+    @abstractmethod
+    def init_schema(self):
+        """创建或升级表结构"""
+
+    @abstractmethod
+    def _fetchall(self, sql, params=()):
+        """执行一条查询（当前后端的占位符），返回全部行"""
+
+    def sql(self, query):
+        """把使用 ? 占位符的 SQL 转成当前后端的占位符"""
+        return query if self._PARAM == "?" else query.replace("?", self._PARAM)
+
+    def query(self, sql, params=()):
+        """执行一条只读查询（? 占位符），返回全部行"""
+        return self._fetchall(self.sql(sql), params)
+
+    # 用户
+    @abstractmethod
+    def create_user(self, username, password_hash):
+        """用户名已存在时返回 False"""
+
+    @abstractmethod
+    def get_user(self, username):
+        """返回 (id, password_hash) 或 None"""
+
+    # 会话
+    @abstractmethod
+    def create_session(self, user_id, username, token, created_at):
+        """保存登录会话"""
+
+    @abstractmethod
+    def get_session(self, token, not_before):
+        """返回 (user_id, username, created_at) 或 None"""
+
+    @abstractmethod
+    def delete_session(self, token):
+        """删除一个会话（退出登录）"""
+
+    @abstractmethod
+    def delete_sessions_before(self, cutoff):
+        """删除 created_at < cutoff 的会话，返回删除条数"""
+
+    # 答题记录与汇总
+    @abstractmethod
+    def insert_records(self, tx, rows):
+        """在事务 tx 中写入一批答题记录并更新 user_topic_stats"""
+
+    @abstractmethod
+    def backfill_topic_stats(self, extra=()):
+        """由 quiz_records 全量重建 user_topic_stats，返回汇总行数
+
+        extra：已归档记录的汇总 [(user_id, unit, topic, attempts, correct, total_time, last_seen)]，
+        在同一事务中累加进去
+        """
+
+    @abstractmethod
+    def get_user_topic_history(self, user_id):
+        """[(topic, attempts, wrong, total_time, last_seen_epoch)]"""
+
+    @abstractmethod
+    def get_user_stats(self, user_id):
+        """[(attempts, correct, unit_name, topic)]"""
+
+    @abstractmethod
+    def get_last_seen(self, user_id, unit_name):
+        """[(question_id, last_seen)]，最久未见的在前"""
+
+    def iter_quiz_records(self, after_id=0, since=None, until=None, unit=None, user_id=None,
+                          batch_size=10000, max_id=None):
+        """按 id 顺序分批返回 after_id < id <= max_id 的记录明细（列见 EXPORT_COLUMNS）
+
+        since / until 为 unix 秒（左闭右开）。每批一次独立查询，不会长时间占用读事务。
+        """
+        while True:
+            sql, params = _export_query(self._PARAM, after_id, since, until, unit, user_id,
+                                        batch_size, max_id)
+            rows = self._fetchall(sql, params)
+            if not rows:
+                return
+            yield rows
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+
+    def max_record_id(self):
+        return self._fetchall("SELECT COALESCE(MAX(id), 0) FROM quiz_records")[0][0]
+
+    def settled_record_id(self, after_id=0, upper=None, tx=None):
+        """水位线可以推进到的记录 id（含）：after_id < id <= upper 中已经提交的最大 id，没有时返回 after_id
+
+        id 按提交顺序出现时就是其中的 MAX(id)。tx 不为 None 时在这个事务中查询。
+        """
+        sql, params = "SELECT MAX(id) FROM quiz_records WHERE id > ?", [after_id]
+        if upper is not None:
+            sql += " AND id <= ?"
+            params.append(upper)
+        sql += self._SETTLED_FILTER
+        if self._SETTLED_FILTER:
+            params.append(RECORD_SETTLE_SECONDS)
+        sql = self.sql(sql)
+        rows = tx.execute(sql, params).fetchall() if tx is not None else self._fetchall(sql, params)
+        return rows[0][0] if rows and rows[0][0] is not None else after_id
+
+    def delete_records(self, since, until, max_id, expected):
+        """删除 since <= created_at < until 且 id <= max_id 的记录（归档后调用）
+
+        删除条数与 expected 不一致时回滚并抛出 RuntimeError，避免删掉没有归档的记录。
+        """
+        with self.transaction() as tx:
+            deleted = tx.execute(self.sql("""
+                DELETE FROM quiz_records WHERE created_at >= ? AND created_at < ? AND id <= ?
+            """), (since, until, max_id)).rowcount
+            if deleted != expected:
+                raise RuntimeError(f"expected to delete {expected} archived records, matched {deleted}")
+        return deleted
+
+    # 已做题位图
+    @abstractmethod
+    def load_seen_bits(self, user_id):
+        """{unit_name: bytes}"""
+
+    @abstractmethod
+    def save_seen_bits_many(self, tx, items):
+        """在事务 tx 中保存 [(user_id, unit_name, bits)]"""
+
+    # 题目整数 id（位图下标），所有副本必须一致
+    @abstractmethod
+    def register_questions(self, questions):
+        """登记题目并返回这些题目的 {content_hash: 整数 id}"""
+
+    def load_question_ids(self):
+        """已登记题目的 {content_hash: 整数 id}，不含占位行（source='missing'，登记题库时会补齐）"""
+        return dict(self._fetchall("SELECT content_hash, id FROM questions WHERE source != 'missing'"))
+
+
+class SQLiteStorage(Storage):
+    _PARAM = "?"
+
+    def _fetchall(self, sql, params=()):
+        with database.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def transaction(self):
+        return database.transaction()
+
+    def init_schema(self):
+        database.init_schema()
+
+    def create_user(self, username, password_hash):
+        with database.connection() as conn:
+            cur = conn.execute(
+                "INSERT INTO users (username, password_hash) VALUES (?, ?) ON CONFLICT(username) DO NOTHING",
+                (username, password_hash),
+            )
+        return cur.rowcount == 1
+
+    def get_user(self, username):
+        with database.connection() as conn:
+            return conn.execute(
+                "SELECT id, password_hash FROM users WHERE username = ?", (username,)
+            ).fetchone()
+
+    def create_session(self, user_id, username, token, created_at):
+        with database.connection() as conn:
+            conn.execute(
+                "INSERT INTO sessions (user_id, username, token, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, username, token, created_at)
+            )
+
+    def get_session(self, token, not_before):
+        with database.connection() as conn:
+            return conn.execute(
+                "SELECT user_id, username, created_at FROM sessions WHERE token = ? AND created_at >= ?",
+                (token, not_before)
+            ).fetchone()
+
+    def delete_session(self, token):
+        with database.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def delete_sessions_before(self, cutoff):
+        with database.connection() as conn:
+            return conn.execute("DELETE FROM sessions WHERE created_at < ?", (cutoff,)).rowcount
+
+    # 题库里没有的题目（例如热更新后被删除）先登记占位行，保证记录总能关联到 questions.id
+    _PLACEHOLDER_SQL = """
+        INSERT INTO questions (content_hash, unit, topic, question, option_a, option_b,
+                               option_c, option_d, answer, source, updated_at)
+        VALUES (?, ?, ?, '', '', '', '', '', ?, 'missing', ?)
+        ON CONFLICT(content_hash) DO NOTHING
+    """
+
+    _INSERT_SQL = """
+        INSERT INTO quiz_records (user_id, question_id, user_answer, is_correct, time_spent, created_at)
+        SELECT ?, id, ?, ?, ?, ? FROM questions WHERE content_hash = ?
+    """
+
+    _STATS_UPSERT_SQL = """
+        INSERT INTO user_topic_stats (user_id, unit_name, topic, attempts, correct, total_time, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, unit_name, topic) DO UPDATE SET
+            attempts = attempts + excluded.attempts,
+            correct = correct + excluded.correct,
+            total_time = total_time + excluded.total_time,
+            last_seen = MAX(COALESCE(last_seen, 0), excluded.last_seen)
+    """
+
+    def insert_records(self, tx, rows):
+        tx.executemany(self._PLACEHOLDER_SQL, _placeholder_params(rows))
+        tx.executemany(self._INSERT_SQL, _record_params(rows))
+        tx.executemany(self._STATS_UPSERT_SQL, merge_topic_stats(rows))
+
+    def backfill_topic_stats(self, extra=()):
+        with database.transaction() as conn:
+            conn.execute("DELETE FROM user_topic_stats")
+            conn.execute(_BACKFILL_SQL)
+            conn.executemany(self._STATS_UPSERT_SQL, extra)
+            return conn.execute("SELECT COUNT(*) FROM user_topic_stats").fetchone()[0]
+
+    def get_user_topic_history(self, user_id):
+        with database.connection() as conn:
+            return conn.execute("""
+                SELECT
+                    topic,
+                    SUM(attempts),
+                    SUM(attempts - correct),
+                    SUM(total_time),
+                    CAST(MAX(last_seen) AS REAL)
+                FROM user_topic_stats
+                WHERE user_id = ?
+                GROUP BY topic
+            """, (user_id,)).fetchall()
+
+    def get_user_stats(self, user_id):
+        with database.connection() as conn:
+            return conn.execute("""
+                SELECT attempts, correct, unit_name, topic
+                FROM user_topic_stats
+                WHERE user_id = ?
+            """, (user_id,)).fetchall()
+
+    def get_last_seen(self, user_id, unit_name):
+        with database.connection() as conn:
+            return conn.execute("""
+                SELECT q.content_hash, MAX(r.created_at) AS last_seen
+                FROM quiz_records r JOIN questions q ON q.id = r.question_id
+                WHERE r.user_id = ? AND q.unit = ?
+                GROUP BY r.question_id
+                ORDER BY last_seen
+            """, (user_id, unit_name)).fetchall()
+
+    def load_seen_bits(self, user_id):
+        with database.connection() as conn:
+            rows = conn.execute(
+                "SELECT unit_name, bits FROM seen_questions WHERE user_id = ?", (user_id,)
+            ).fetchall()
+        return {unit: bytes(bits) for unit, bits in rows}
+
+    def save_seen_bits_many(self, tx, items):
+        now = time.time()
+        tx.executemany("""
+            INSERT INTO seen_questions (user_id, unit_name, bits, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, unit_name) DO UPDATE SET
+                bits = excluded.bits, updated_at = excluded.updated_at
+        """, [(user_id, unit, bytes(bits), now) for user_id, unit, bits in items])
+
+    def register_questions(self, questions):
+        questions = list(questions)
+        with database.transaction() as conn:
+            question_db.register_questions(conn, questions)
+            return question_db.load_ordinals(conn, [q["id"] for q in questions])
+
+
+# PostgreSQL：表结构与 SQLite 最新版本（migrations.py）相同，只是类型换成对应的 PostgreSQL 类型。
+# PostgreSQL 上没有旧格式的数据，直接按最新版本建表；多个副本可能同时启动，建表放在同一个 advisory lock 下。
+_PG_SCHEMA_LOCK = 0x49474353  # 任意固定值
+_PG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGSERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS sessions (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users(id),
+        username TEXT NOT NULL,
+        token TEXT UNIQUE NOT NULL,
+        created_at DOUBLE PRECISION NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions (created_at);
+    CREATE TABLE IF NOT EXISTS seen_questions (
+        user_id BIGINT NOT NULL,
+        unit_name TEXT NOT NULL,
+        bits BYTEA NOT NULL,
+        updated_at DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (user_id, unit_name)
+    );
+    CREATE TABLE IF NOT EXISTS user_topic_stats (
+        user_id BIGINT NOT NULL,
+        unit_name TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        correct INTEGER NOT NULL DEFAULT 0,
+        total_time DOUBLE PRECISION NOT NULL DEFAULT 0,
+        last_seen BIGINT,
+        PRIMARY KEY (user_id, unit_name, topic)
+    );
+    CREATE TABLE IF NOT EXISTS questions (
+        id BIGSERIAL PRIMARY KEY,
+        content_hash TEXT UNIQUE NOT NULL,
+        unit TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        question TEXT NOT NULL,
+        option_a TEXT NOT NULL,
+        option_b TEXT NOT NULL,
+        option_c TEXT NOT NULL,
+        option_d TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        explanation TEXT,
+        source TEXT NOT NULL DEFAULT 'bank',
+        source_file TEXT,
+        updated_at DOUBLE PRECISION
+    );
+    CREATE INDEX IF NOT EXISTS idx_questions_unit_topic ON questions (unit, topic);
+    CREATE TABLE IF NOT EXISTS quiz_records (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        question_id BIGINT NOT NULL REFERENCES questions(id),
+        user_answer SMALLINT,
+        is_correct SMALLINT NOT NULL,
+        time_spent DOUBLE PRECISION,
+        created_at BIGINT NOT NULL,
+        inserted_at TIMESTAMPTZ DEFAULT clock_timestamp()
+    );
+    -- inserted_at：数据库插入这一行（取 id）的时间，created_at 是答题时间，写入可能排队很久。
+    -- 加列之前的旧行为 NULL，当作早已提交
+    ALTER TABLE quiz_records ADD COLUMN IF NOT EXISTS inserted_at TIMESTAMPTZ;
+    ALTER TABLE quiz_records ALTER COLUMN inserted_at SET DEFAULT clock_timestamp();
+    CREATE INDEX IF NOT EXISTS idx_quiz_records_user
+        ON quiz_records (user_id, question_id, created_at);
+    CREATE TABLE IF NOT EXISTS topic_rollup (
+        unit TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        attempts BIGINT NOT NULL DEFAULT 0,
+        correct BIGINT NOT NULL DEFAULT 0,
+        total_time DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (unit, topic)
+    );
+    CREATE TABLE IF NOT EXISTS question_rollup (
+        question_id BIGINT PRIMARY KEY,
+        unit TEXT NOT NULL,
+        attempts BIGINT NOT NULL DEFAULT 0,
+        correct BIGINT NOT NULL DEFAULT 0,
+        total_time DOUBLE PRECISION NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS hardest_questions (
+        unit TEXT NOT NULL,
+        rank INTEGER NOT NULL,
+        question_id BIGINT NOT NULL,
+        attempts BIGINT NOT NULL,
+        correct BIGINT NOT NULL,
+        total_time DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (unit, rank)
+    );
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        name TEXT PRIMARY KEY,
+        last_id BIGINT NOT NULL DEFAULT 0,
+        refreshed_at DOUBLE PRECISION
+    );
+    INSERT INTO rollup_state (name, last_id) VALUES ('quiz_records', 0) ON CONFLICT (name) DO NOTHING;
+"""
+
+
+class PostgresStorage(Storage):
+    """连接池 + 预编译语句：热点查询在每个连接上只解析一次"""
+
+    _PARAM = "%s"
+    # BIGSERIAL 在插入时取号，并发事务可能晚于更大的 id 提交
+    COMMIT_ORDERED_IDS = False
+    # 只算插入超过 RECORD_SETTLE_SECONDS 的记录，用数据库自己的时钟，不受各副本时钟和写入排队影响
+    _SETTLED_FILTER = " AND (inserted_at IS NULL OR inserted_at < clock_timestamp() - ? * INTERVAL '1 second')"
+
+    def __init__(self, url, min_size=PG_POOL_MIN, max_size=PG_POOL_MAX):
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError as e:
+            raise RuntimeError(
+                "DATABASE_URL 指向 PostgreSQL，但没有安装 psycopg / psycopg_pool："
+                "pip install -r requirements-postgres.txt"
+            ) from e
+        self._pool = ConnectionPool(url, min_size=min_size, max_size=max_size,
+                                    kwargs={"autocommit": True}, open=True)
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    @contextmanager
+    def _connection(self):
+        if not self._schema_ready:
+            self.init_schema()
+        with self._pool.connection() as conn:
+            yield conn
+
+    def _execute(self, sql, params=()):
+        """单条语句，prepare=True 让 psycopg 在连接上使用服务端预编译语句"""
+        with self._connection() as conn:
+            return conn.execute(sql, params, prepare=True)
+
+    def _fetchone(self, sql, params=()):
+        with self._connection() as conn:
+            return conn.execute(sql, params, prepare=True).fetchone()
+
+    def _fetchall(self, sql, params=()):
+        with self._connection() as conn:
+            return conn.execute(sql, params, prepare=True).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        with self._connection() as conn:
+            with conn.transaction():
+                yield conn
+
+    def init_schema(self):
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            with self._pool.connection() as conn:
+                with conn.transaction():
+                    conn.execute("SELECT pg_advisory_xact_lock(%s)", (_PG_SCHEMA_LOCK,))
+                    conn.execute(_PG_SCHEMA)
+            self._schema_ready = True
+
+    def close(self):
+        self._pool.close()
+
+    def create_user(self, username, password_hash):
+        cur = self._execute(
+            "INSERT INTO users (username, password_hash) VALUES (%s, %s) ON CONFLICT (username) DO NOTHING",
+            (username, password_hash),
+        )
+        return cur.rowcount == 1
+
+    def get_user(self, username):
+        return self._fetchone("SELECT id, password_hash FROM users WHERE username = %s", (username,))
+
+    def create_session(self, user_id, username, token, created_at):
+        self._execute(
+            "INSERT INTO sessions (user_id, username, token, created_at) VALUES (%s, %s, %s, %s)",
+            (user_id, username, token, created_at),
+        )
+
+    def get_session(self, token, not_before):
+        return self._fetchone(
+            "SELECT user_id, username, created_at FROM sessions WHERE token = %s AND created_at >= %s",
+            (token, not_before),
+        )
+
+    def delete_session(self, token):
+        self._execute("DELETE FROM sessions WHERE token = %s", (token,))
+
+    def delete_sessions_before(self, cutoff):
+        return self._execute("DELETE FROM sessions WHERE created_at < %s", (cutoff,)).rowcount
+
+    _PLACEHOLDER_SQL = """
+        INSERT INTO questions (content_hash, unit, topic, question, option_a, option_b,
+                               option_c, option_d, answer, source, updated_at)
+        VALUES (%s, %s, %s, '', '', '', '', '', %s, 'missing', %s)
+        ON CONFLICT (content_hash) DO NOTHING
+    """
+
+    _INSERT_SQL = """
+        INSERT INTO quiz_records (user_id, question_id, user_answer, is_correct, time_spent, created_at)
+        SELECT %s, id, %s, %s, %s, %s FROM questions WHERE content_hash = %s
+    """
+
+    _STATS_UPSERT_SQL = """
+        INSERT INTO user_topic_stats (user_id, unit_name, topic, attempts, correct, total_time, last_seen)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (user_id, unit_name, topic) DO UPDATE SET
+            attempts = user_topic_stats.attempts + EXCLUDED.attempts,
+            correct = user_topic_stats.correct + EXCLUDED.correct,
+            total_time = user_topic_stats.total_time + EXCLUDED.total_time,
+            last_seen = GREATEST(user_topic_stats.last_seen, EXCLUDED.last_seen)
+    """
+
+    def insert_records(self, tx, rows):
+        # executemany 走 pipeline，同一语句在连接上只预编译一次
+        with tx.cursor() as cur:
+            cur.executemany(self._PLACEHOLDER_SQL, _placeholder_params(rows))
+            cur.executemany(self._INSERT_SQL, _record_params(rows))
+            cur.executemany(self._STATS_UPSERT_SQL, merge_topic_stats(rows))
+
+    def backfill_topic_stats(self, extra=()):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM user_topic_stats")
+            conn.execute(_BACKFILL_SQL)
+            if extra:
+                conn.cursor().executemany(self._STATS_UPSERT_SQL, extra)
+            return conn.execute("SELECT COUNT(*) FROM user_topic_stats").fetchone()[0]
+
+    def get_user_topic_history(self, user_id):
+        return self._fetchall("""
+            SELECT
+                topic,
+                SUM(attempts),
+                SUM(attempts - correct),
+                SUM(total_time),
+                MAX(last_seen)::DOUBLE PRECISION
+            FROM user_topic_stats
+            WHERE user_id = %s
+            GROUP BY topic
+        """, (user_id,))
+
+    def get_user_stats(self, user_id):
+        return self._fetchall("""
+            SELECT attempts, correct, unit_name, topic
+            FROM user_topic_stats
+            WHERE user_id = %s
+        """, (user_id,))
+
+    def get_last_seen(self, user_id, unit_name):
+        return self._fetchall("""
+            SELECT q.content_hash, MAX(r.created_at) AS last_seen
+            FROM quiz_records r JOIN questions q ON q.id = r.question_id
+            WHERE r.user_id = %s AND q.unit = %s
+            GROUP BY q.content_hash
+            ORDER BY last_seen
+        """, (user_id, unit_name))
+
+    def load_seen_bits(self, user_id):
+        rows = self._fetchall("SELECT unit_name, bits FROM seen_questions WHERE user_id = %s", (user_id,))
+        return {unit: bytes(bits) for unit, bits in rows}
+
+    def save_seen_bits_many(self, tx, items):
+        now = time.time()
+        with tx.cursor() as cur:
+            cur.executemany("""
+                INSERT INTO seen_questions (user_id, unit_name, bits, updated_at)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (user_id, unit_name) DO UPDATE SET
+                    bits = EXCLUDED.bits, updated_at = EXCLUDED.updated_at
+            """, [(user_id, unit, bytes(bits), now) for user_id, unit, bits in items])
+
+    def register_questions(self, questions):
+        columns = question_db.QUESTION_COLUMNS
+        questions = list(questions)
+        with self.transaction() as conn:
+            with conn.cursor() as cur:
+                cur.executemany(f"""
+                    INSERT INTO questions (content_hash, {', '.join(columns)}, updated_at)
+                    VALUES ({', '.join(['%s'] * (len(columns) + 2))})
+                    ON CONFLICT (content_hash) DO UPDATE SET
+                        {', '.join(f'{c} = EXCLUDED.{c}' for c in columns)},
+                        updated_at = EXCLUDED.updated_at
+                    WHERE questions.source = 'missing'
+                """, [(q["id"], *(q.get(c) or "" for c in columns), time.time()) for q in questions])
+            return dict(conn.execute("SELECT content_hash, id FROM questions WHERE content_hash = ANY(%s)",
+                                     ([q["id"] for q in questions],)).fetchall())
+
+
+def get_storage():
+    """按 DATABASE_URL 选择后端，进程内只创建一次"""
+    global _STORAGE
+    if _STORAGE is None:
+        with _LOCK:
+            if _STORAGE is None:
+                if DATABASE_URL.startswith(("postgres://", "postgresql://")):
+                    _STORAGE = PostgresStorage(DATABASE_URL)
+                else:
+                    _STORAGE = SQLiteStorage()
+    return _STORAGE
+
+
+def set_storage(storage):
+    """替换当前后端（例如维护脚本连接另一个数据库），返回旧的后端"""
+    global _STORAGE
+    with _LOCK:
+        previous, _STORAGE = _STORAGE, storage
+    return previous
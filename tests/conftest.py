@@ -0,0 +1,68 @@
+# 存储层测试：同一组测试分别在 SQLite 和 PostgreSQL 上运行
+#
+# PostgreSQL 的地址取自 TEST_DATABASE_URL（CI 中为 service container）；
+# 没有设置时如果安装了 pgserver 就在本地启动一个临时实例，否则跳过 PostgreSQL 的用例。
+# 测试会清空这个数据库的 public schema，不要指向正在使用的数据库。
+import os
+import tempfile
+
+import pytest
+
+# 在导入项目模块之前设置：不加载 Excel 题库，也不碰仓库里的 users.db
+os.environ.setdefault("QUESTION_BACKEND", "sqlite")
+os.environ.setdefault("IGCSE_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="igcse-test-"), "users.db"))
+
+import database  # noqa: E402
+import storage  # noqa: E402
+
+_PG_SERVER = None
+
+
+def _postgres_url():
+    global _PG_SERVER
+    url = os.environ.get("TEST_DATABASE_URL")
+    if url:
+        return url
+    try:
+        import pgserver
+    except ImportError:
+        return None
+    if _PG_SERVER is None:
+        _PG_SERVER = pgserver.get_server(tempfile.mkdtemp(prefix="igcse-pg-"), cleanup_mode="stop")
+    return _PG_SERVER.get_uri()
+
+
+def _sqlite_storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "users.db"))
+    st = storage.SQLiteStorage()
+    st.init_schema()
+    return st, database.close_all
+
+
+def _postgres_storage(tmp_path, monkeypatch):
+    url = _postgres_url()
+    if not url:
+        pytest.skip("set TEST_DATABASE_URL or install pgserver to run the PostgreSQL tests")
+    try:
+        import psycopg
+    except ImportError:
+        pytest.skip("psycopg is not installed (pip install -r requirements-postgres.txt)")
+    with psycopg.connect(url, autocommit=True) as conn:
+        conn.execute("DROP SCHEMA IF EXISTS public CASCADE")
+        conn.execute("CREATE SCHEMA public")
+    st = storage.PostgresStorage(url, min_size=1, max_size=4)
+    st.init_schema()
+    return st, st.close
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def st(request, tmp_path, monkeypatch):
+    """空数据库上的存储后端，同时设为 get_storage() 的返回值"""
+    make = _sqlite_storage if request.param == "sqlite" else _postgres_storage
+    backend, close = make(tmp_path, monkeypatch)
+    previous = storage.set_storage(backend)
+    try:
+        yield backend
+    finally:
+        storage.set_storage(previous)
+        close()
@@ -0,0 +1,37 @@
+import sqlite3
+
+import ai_cache
+import database
+
+
+def test_disk_errors_fall_back_to_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "BUSY_TIMEOUT_MS", 50)
+    path = str(tmp_path / "ai_cache.db")
+    cache = ai_cache.ResponseCache(path)
+    cache.put("a", "first")
+
+    # 另一个连接长时间持有写锁：写入超过 busy_timeout，WAL 模式下仍然可以读
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")
+    try:
+        cache.put("b", "second")
+        assert cache.get("b") == "second"
+        cache._memory.clear()
+        assert cache.get("a") == "first"  # 命中，只是没能更新 last_used
+        cache.discard("a")
+        assert cache.metrics()["disk_errors"] == 3
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+
+    # 锁释放后持久化层照常使用
+    assert cache.get("a") == "first"
+    cache.put("c", "third")
+    cache._memory.clear()
+    assert cache.get("c") == "third"
+
+    # 读取出错时按未命中处理
+    cache._memory.clear()
+    cache._conn.close()
+    assert cache.get("c") is None
+    assert cache.metrics()["disk_errors"] == 5
@@ -0,0 +1,14 @@
+import auth
+
+
+def test_teacher_names_cannot_self_register(st, monkeypatch):
+    monkeypatch.setattr(auth, "TEACHER_USERS", {"teacher"})
+    ok, _ = auth.register("teacher", "pw")
+    assert not ok
+    assert st.get_user("teacher") is None
+    assert auth.register("student", "pw")[0]
+
+    # 管理员创建的教师账号可以正常登录
+    assert auth.register("teacher", "pw", allow_teacher=True)[0]
+    assert auth.authenticate("teacher", "pw")[0]
+    assert auth.is_teacher("teacher")
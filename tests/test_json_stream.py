@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import json_stream
+
+
+def question(i, **extra):
+    return dict({"question": f"Q{i} {{x}} \"quoted\" \\ [y]", "option_a": "1", "option_b": "2",
+                 "answer": "A"}, **extra)
+
+
+def feed(text, size):
+    stream = json_stream.ObjectStream()
+    out = []
+    for i in range(0, len(text), size):
+        out += stream.feed(text[i:i + size])
+    stream.close()
+    return out, stream
+
+
+SIZES = [1, 3, 7, 10 ** 6]
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_top_level_array(size):
+    items = [question(1), question(2, options=[{"A": "1"}, {"B": "2"}])]
+    out, stream = feed("以下是题目：\n" + json.dumps(items, ensure_ascii=False) + "\n完", size)
+    assert out == items
+    assert (stream.parsed, stream.malformed) == (2, 0)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_wrapper_in_code_fence(size):
+    items = [question(1), question(2)]
+    text = "```json\n" + json.dumps({"questions": items, "count": 2}) + "\n```"
+    out, _ = feed(text, size)
+    assert out == items
+
+    # 包在更深一层的题目列表
+    out, _ = feed(json.dumps({"data": {"quiz_questions": items}}), size)
+    assert out == items
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_single_object_with_nested_options(size):
+    # options 数组属于题目本身，不能把选项当成题目取出
+    for options in ([{"A": "1"}, {"B": "2"}], {"A": "1", "B": "2"}):
+        obj = dict(question(1), options=options)
+        out, stream = feed(json.dumps(obj), size)
+        assert out == [obj]
+        assert (stream.parsed, stream.malformed) == (1, 0)
+
+
+def test_long_key_split_across_chunks():
+    items = [question(1)]
+    text = json.dumps({"generated_questions_for_this_unit": items, "choices": [{"x": 1}]})
+    out, _ = feed(text, 2)
+    assert out == items
+
+
+def test_malformed_item_dropped_alone():
+    text = "[" + json.dumps(question(1)) + ', {"question": "bad", oops}, ' + json.dumps(question(2)) + "]"
+    out, stream = feed(text, 5)
+    assert [o["question"][:2] for o in out] == ["Q1", "Q2"]
+    assert (stream.parsed, stream.malformed) == (2, 1)
+
+
+def test_truncated_reply_counts_open_item():
+    text = json.dumps({"questions": [question(1), question(2)]})
+    cut = text.index('"Q2') + 5
+    out, stream = feed(text[:cut], 4)
+    assert out == [question(1)]
+    assert (stream.parsed, stream.malformed) == (1, 1)
+
+    # 截断的单个对象同样计入
+    out, stream = feed(json.dumps(question(1))[:-3], 4)
+    assert out == [] and stream.malformed == 1
+
+
+def test_iter_objects():
+    items = [question(1), question(2)]
+    text = json.dumps(items)
+    assert list(json_stream.iter_objects(text[i:i + 6] for i in range(0, len(text), 6))) == items
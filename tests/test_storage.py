@@ -0,0 +1,170 @@
+import time
+
+import pytest
+
+import storage
+from question_store import Question
+
+NOW = 1_700_000_000
+
+
+def _question(n, unit="Waves", topic="Sound", answer="A"):
+    return Question(unit, topic, f"Question {n}", "1", "2", "3", "4", answer, f"Because {n}").to_dict()
+
+
+def _record(user_id, q, user_answer, created_at, time_spent=2.0, username="alice"):
+    """insert_records 的行格式（见 storage.Storage）"""
+    return (user_id, username, q["unit"], q["topic"], q["id"], user_answer, q["answer"],
+            1 if user_answer == q["answer"] else 0, time_spent, created_at)
+
+
+def _user(st, name="alice"):
+    assert st.create_user(name, "hash")
+    return st.get_user(name)[0]
+
+
+def _insert(st, rows):
+    with st.transaction() as tx:
+        st.insert_records(tx, rows)
+
+
+def test_incomplete_backend_fails_on_creation():
+    class Partial(storage.Storage):
+        _PARAM = "?"
+
+        def _fetchall(self, sql, params=()):
+            return []
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_users(st):
+    assert st.create_user("alice", "h1")
+    assert not st.create_user("alice", "h2")
+    user_id, password_hash = st.get_user("alice")
+    assert password_hash == "h1"
+    assert st.get_user("bob") is None
+    assert st.query("SELECT username FROM users WHERE id = ?", (user_id,)) == [("alice",)]
+
+
+def test_sessions(st):
+    user_id = _user(st)
+    now = time.time()
+    st.create_session(user_id, "alice", "old", now - 100)
+    st.create_session(user_id, "alice", "new", now)
+    assert tuple(st.get_session("new", now - 10)) == (user_id, "alice", pytest.approx(now))
+    assert st.get_session("old", now - 10) is None
+    assert st.delete_sessions_before(now - 10) == 1
+    st.delete_session("new")
+    assert st.get_session("new", 0) is None
+
+
+def test_register_questions(st):
+    questions = [_question(n) for n in range(3)]
+    ids = st.register_questions(questions)
+    assert set(ids) == {q["id"] for q in questions}
+    assert len(set(ids.values())) == 3
+    # 重复登记 id 不变，只返回这次传入的题目
+    again = st.register_questions(questions[:1])
+    assert again == {questions[0]["id"]: ids[questions[0]["id"]]}
+    assert st.load_question_ids() == ids
+
+
+def test_records_and_topic_stats(st):
+    user_id = _user(st)
+    q1, q2 = _question(1), _question(2, topic="Light", answer="C")
+    st.register_questions([q1, q2])
+    _insert(st, [_record(user_id, q1, "A", NOW), _record(user_id, q1, "B", NOW + 5)])
+    _insert(st, [_record(user_id, q2, "C", NOW + 10, time_spent=4.0)])
+
+    stats = {(unit, topic): (attempts, correct) for attempts, correct, unit, topic in st.get_user_stats(user_id)}
+    assert stats == {("Waves", "Sound"): (2, 1), ("Waves", "Light"): (1, 1)}
+    history = {row[0]: tuple(row[1:]) for row in st.get_user_topic_history(user_id)}
+    assert history["Sound"] == (2, 1, pytest.approx(4.0), NOW + 5)
+    assert history["Light"] == (1, 0, pytest.approx(4.0), NOW + 10)
+    assert [(qid, seen) for qid, seen in st.get_last_seen(user_id, "Waves")] == [
+        (q1["id"], NOW + 5), (q2["id"], NOW + 10)]
+
+    # 全量重建的结果与增量维护一致
+    before = sorted(st.get_user_stats(user_id))
+    assert st.backfill_topic_stats() == 2
+    assert sorted(st.get_user_stats(user_id)) == before
+
+
+def test_record_for_unknown_question_gets_placeholder(st):
+    user_id = _user(st)
+    q = _question(1)
+    _insert(st, [_record(user_id, q, "A", NOW)])
+    assert st.query("SELECT source FROM questions WHERE content_hash = ?", (q["id"],)) == [("missing",)]
+    assert q["id"] not in st.load_question_ids()
+    # 题库再次登记这道题时补齐内容，记录仍然关联同一行
+    ids = st.register_questions([q])
+    assert st.query("SELECT source, question FROM questions WHERE id = ?", (ids[q["id"]],)) == [
+        ("bank", q["question"])]
+    assert [row[5] for batch in st.iter_quiz_records() for row in batch] == [q["id"]]
+
+
+def test_iter_and_delete_records(st):
+    user_id = _user(st)
+    q = _question(1)
+    st.register_questions([q])
+    _insert(st, [_record(user_id, q, "A", NOW + i) for i in range(7)])
+
+    batches = list(st.iter_quiz_records(batch_size=3))
+    assert [len(b) for b in batches] == [3, 3, 1]
+    rows = [row for b in batches for row in b]
+    assert rows[0][1:] == (user_id, "alice", "Waves", "Sound", q["id"], 0, "A", 1, 2.0, NOW)
+    max_id = st.max_record_id()
+    assert max_id == rows[-1][0]
+    assert len([r for b in st.iter_quiz_records(since=NOW + 2, until=NOW + 5) for r in b]) == 3
+
+    # 条数与预期不一致时整体回滚
+    with pytest.raises(RuntimeError):
+        st.delete_records(NOW, NOW + 3, max_id, expected=2)
+    assert st.max_record_id() == max_id
+    assert st.delete_records(NOW, NOW + 3, max_id, expected=3) == 3
+    assert len([r for b in st.iter_quiz_records() for r in b]) == 4
+
+
+def test_seen_bits(st):
+    user_id = _user(st)
+    with st.transaction() as tx:
+        st.save_seen_bits_many(tx, [(user_id, "Waves", bytearray(b"\x01\x02")), (user_id, "Space", b"\x80")])
+    with st.transaction() as tx:
+        st.save_seen_bits_many(tx, [(user_id, "Waves", b"\x03")])
+    assert st.load_seen_bits(user_id) == {"Waves": b"\x03", "Space": b"\x80"}
+    assert st.load_seen_bits(user_id + 1) == {}
+
+
+def test_transaction_rolls_back(st):
+    user_id = _user(st)
+    q = _question(1)
+    st.register_questions([q])
+    with pytest.raises(ValueError):
+        with st.transaction() as tx:
+            st.insert_records(tx, [_record(user_id, q, "A", NOW)])
+            raise ValueError
+    assert st.max_record_id() == 0
+    assert st.get_user_stats(user_id) == []
+
+
+def test_settled_record_id(st):
+    user_id = _user(st)
+    q = _question(1)
+    st.register_questions([q])
+    _insert(st, [_record(user_id, q, "A", NOW + i) for i in range(3)])
+    max_id = st.max_record_id()
+    if st.COMMIT_ORDERED_IDS:
+        assert st.settled_record_id() == max_id
+        assert st.settled_record_id(0, max_id - 1) == max_id - 1
+        return
+    # 刚插入的记录还没过 RECORD_SETTLE_SECONDS；答题时间（created_at）再早也不算
+    assert st.settled_record_id() == 0
+    with st.transaction() as tx:
+        tx.execute("UPDATE quiz_records SET inserted_at = inserted_at - INTERVAL '1 hour' WHERE id < %s",
+                   (max_id,))
+    assert st.settled_record_id() == max_id - 1
+    assert st.settled_record_id(max_id - 1) == max_id - 1
+    with st.transaction() as tx:
+        assert st.settled_record_id(0, max_id - 2, tx) == max_id - 2
@@ -0,0 +1,96 @@
+# 启动预热：在用户请求到来之前加载题库、打开数据库
+#
+# app.py 在第一次运行时调用 start()，在后台线程里完成预热，登录页可以立即渲染；
+# 需要题库的页面会在 data_loader 的锁上等待加载完成。
+# 部署时也可以先执行 `python warmup.py`，提前生成题库快照和数据库表。
+import threading
+import time
+
+_THREAD = None
+_LOCK = threading.Lock()
+_DONE = threading.Event()
+TIMINGS = {}
+ERRORS = {}  # 失败的步骤 -> 错误信息
+
+
+def warm_up():
+    """同步执行全部预热步骤，返回 {步骤: 耗时秒}
+
+    每一步单独捕获异常：某一步失败（例如题库加载出错）只打印并记入 ERRORS，后面的步骤照常执行。
+    """
+    timings = {}
+
+    def step(name, func):
+        started = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            ERRORS[name] = str(e)
+            print(f"Warm-up step {name!r} failed: {e}")
+            return
+        timings[name] = time.perf_counter() - started
+
+    def load_bank():
+        import data_loader
+        if data_loader.QUESTION_BACKEND != "sqlite":
+            data_loader._get_bank()
+
+    def open_database():
+        import auth  # noqa: F401
+        import db  # noqa: F401
+        import storage
+        storage.get_storage().init_schema()
+
+    def register_listeners():
+        # adaptive / seen 注册了答题记录回调，必须在第一条记录写入前导入
+        import adaptive  # noqa: F401
+        import seen  # noqa: F401
+
+    def register_ids():
+        import seen
+        seen._ensure_ordinals()
+
+    def start_watcher():
+        import data_loader
+        if data_loader.QUESTION_BACKEND != "sqlite":
+            data_loader.start_watcher()
+
+    step("import data_loader", lambda: __import__("data_loader"))
+    step("load question bank", load_bank)
+    step("open database", open_database)
+    step("register record listeners", register_listeners)
+    step("register question ids", register_ids)
+    step("start session sweeper", lambda: __import__("auth").start_session_sweeper())
+    step("start rollup refresher", lambda: __import__("rollups").start_refresher())
+    step("start archiver", lambda: __import__("archive").start_archiver())
+    step("start bank watcher", start_watcher)
+    return timings
+
+
+def _run():
+    try:
+        TIMINGS.update(warm_up())
+    finally:
+        _DONE.set()
+
+
+def start():
+    """在后台线程预热，重复调用只启动一次"""
+    global _THREAD
+    with _LOCK:
+        if _THREAD is None:
+            _THREAD = threading.Thread(target=_run, name="warmup", daemon=True)
+            _THREAD.start()
+    return _THREAD
+
+
+def wait(timeout=None):
+    """等待预热完成，返回是否已完成"""
+    return _DONE.wait(timeout)
+
+
+if __name__ == "__main__":
+    for name, seconds in warm_up().items():
+        print(f"{name:<26} {seconds * 1000:8.1f} ms")
+    for name in ERRORS:
+        print(f"{name:<26}   failed")
@@ -0,0 +1,194 @@
+# 写后缓冲队列：先把记录放进内存，攒够一批或超过时间阈值后在一个事务里批量写入
+#
+# 批量写入把每次点击一次 fsync 变成每批一次。进程正常退出时（atexit）会写完剩余记录；
+# 调用方也可以在关键时刻（例如答题结束、退出登录）主动 flush()。
+#
+# 写入失败时记录放回队列，后台线程按指数退避重试；队列超过 max_queue 条时丢弃新记录。
+# 连续失败 max_attempts 次后逐条写入，单独写也失败的记录交给 dead_letter(items, error)，
+# 不再挡住后面的记录；退出时仍写不进去的记录同样交给 dead_letter。
+import atexit
+import threading
+import time
+from collections import deque
+
+import database
+
+
+class WriteBehindQueue:
+    def __init__(self, writer, max_batch=100, max_delay=2.0, name="write-behind",
+                 transaction=None, max_queue=10000, max_attempts=3, retry_base=1.0,
+                 retry_max=60.0, dead_letter=None):
+        """writer(conn, items) 在事务中写入一批记录；transaction() 返回事务上下文，默认 database.transaction
+
+        dead_letter(items, error) 接收无法写入的记录（默认只打印）。
+        """
+        self._writer = writer
+        self._transaction = transaction or database.transaction
+        self._dead_letter = dead_letter
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._items = deque()
+        self._hooks = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._oldest = None
+        self._stopped = False
+        self._failed_attempts = 0  # 连续失败次数
+        self._retry_at = None
+        self._metrics = {
+            "enqueued": 0, "flushed": 0, "flushes": 0, "failures": 0,
+            "dropped": 0, "dead_lettered": 0,
+            "last_flush_ms": 0.0, "max_flush_ms": 0.0, "total_flush_ms": 0.0,
+            "last_error": None,
+        }
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add_flush_hook(self, hook):
+        """hook(conn) 在每次批量写入的同一个事务中调用，用于一起落盘其他缓存状态"""
+        if hook not in self._hooks:
+            self._hooks.append(hook)
+
+    def put(self, item):
+        """放入一条记录；队列已满时丢弃并返回 False"""
+        with self._cond:
+            if len(self._items) >= self.max_queue:
+                self._metrics["dropped"] += 1
+                if self._metrics["dropped"] == 1 or self._metrics["dropped"] % 1000 == 0:
+                    print(f"Write-behind queue full ({self.max_queue}), "
+                          f"{self._metrics['dropped']} records dropped")
+                return False
+            self._items.append(item)
+            self._metrics["enqueued"] += 1
+            if self._oldest is None:
+                # 第一条记录开始计时，唤醒后台线程按 max_delay 等待
+                self._oldest = time.monotonic()
+                self._cond.notify()
+            elif len(self._items) >= self.max_batch:
+                self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._retry_at is not None:
+                        # 上次写入失败，退避期间不重试
+                        remaining = self._retry_at - time.monotonic()
+                        if remaining > 0:
+                            self._cond.wait(remaining)
+                            continue
+                    if len(self._items) >= self.max_batch:
+                        break
+                    if self._oldest is not None:
+                        remaining = self.max_delay - (time.monotonic() - self._oldest)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._stopped:
+                    return
+            self.flush()
+
+    def flush(self):
+        """立即把缓冲区写入数据库，返回写入条数；失败时记录会放回队列等待下次重试"""
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self._items)
+                self._items.clear()
+                self._oldest = None
+                isolate = self._failed_attempts >= self.max_attempts
+            if not batch and not self._hooks:
+                return 0
+            started = time.perf_counter()
+            try:
+                if isolate and batch:
+                    written = self._write_isolated(batch)
+                else:
+                    with self._transaction() as conn:
+                        if batch:
+                            self._writer(conn, batch)
+                        for hook in self._hooks:
+                            hook(conn)
+                    written = len(batch)
+            except Exception as e:
+                with self._cond:
+                    self._items.extendleft(reversed(batch))
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+                    self._failed_attempts += 1
+                    delay = min(self.retry_max, self.retry_base * 2 ** (self._failed_attempts - 1))
+                    self._retry_at = time.monotonic() + delay
+                    self._metrics["failures"] += 1
+                    self._metrics["last_error"] = str(e)[:200]
+                print(f"Write-behind flush failed ({len(batch)} records kept, retry in {delay:.1f}s): {e}")
+                return 0
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._cond:
+                self._failed_attempts = 0
+                self._retry_at = None
+                m = self._metrics
+                m["flushed"] += written
+                m["flushes"] += 1
+                m["last_flush_ms"] = elapsed
+                m["max_flush_ms"] = max(m["max_flush_ms"], elapsed)
+                m["total_flush_ms"] += elapsed
+            return written
+
+    def _write_isolated(self, batch):
+        """逐条写入，找出单独写也失败的记录，返回写入条数
+
+        先单独执行一次钩子的事务：这一步失败说明是数据库的问题（不可用、被锁），
+        异常抛给 flush() 整批重试，而不是把所有记录都当成坏记录。
+        """
+        with self._transaction() as conn:
+            for hook in self._hooks:
+                hook(conn)
+        written, failed, error = 0, [], None
+        for item in batch:
+            try:
+                with self._transaction() as conn:
+                    self._writer(conn, [item])
+                written += 1
+            except Exception as e:
+                failed.append(item)
+                error = e
+        if failed:
+            self._reject(failed, error)
+        return written
+
+    def _reject(self, items, error):
+        with self._cond:
+            self._metrics["dead_lettered"] += len(items)
+        print(f"Write-behind gave up on {len(items)} records: {error}")
+        if self._dead_letter is not None:
+            try:
+                self._dead_letter(items, error)
+            except Exception as e:
+                print(f"Write-behind dead letter failed, {len(items)} records lost: {e}")
+
+    def metrics(self):
+        with self._cond:
+            m = dict(self._metrics)
+            m["depth"] = len(self._items)
+            m["avg_flush_ms"] = m["total_flush_ms"] / m["flushes"] if m["flushes"] else 0.0
+            return m
+
+    def close(self):
+        """停止后台线程并写完剩余记录，写不进去的交给 dead_letter"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.flush()
+        with self._flush_lock:
+            with self._cond:
+                remaining = list(self._items)
+                self._items.clear()
+            if remaining:
+                self._reject(remaining, self._metrics["last_error"])